@@ -0,0 +1,389 @@
+"""Versioned JSON API for Warbler's read paths, under /api/v1.
+
+The same queries and `?before=` cursors as the HTML pages, without the
+rendering. Message lists are kept small: each message carries only its
+author's id, and the authors on the page are sent once in a `users` list:
+
+    {"messages": [{"id": 7, "text": "...", "timestamp": "...",
+                   "user_id": 2, "liked": false}, ...],
+     "users": [{"id": 2, "username": "...", "image_url": "..."}],
+     "next": "<cursor or null>"}
+
+User lists are `{"users": [...], "next": ...}`. Bodies are serialized with
+orjson when it's installed, and compact `json` otherwise.
+
+`GET /api/v1/timeline/stream` is a server-sent events stream of new messages
+for the home timeline, and `GET /api/v1/timeline/updates` long-polls for
+them (see `stream`). `GET /api/v1/trending` lists the trending messages, each with its `score`:
+its likes' worth after decay. `POST /api/v1/likes` likes and unlikes a batch
+of messages at once.
+"""
+
+import json
+
+from flask import Blueprint, abort, current_app, g, request
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import HTTPException
+
+from caching import NO_STORE, cache_policy, conditional
+from likes import set_likes
+from models import db, User, Message
+from pagination import page_size, paginate
+from stream import (DEFAULT_KEEPALIVE, DEFAULT_QUEUE_SIZE, Announcement,
+                    broker, payload, start_listening)
+from timelines import home_timeline, timeline_author_ids
+from trending import decayed_scores, trending_messages
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+USER_FIELDS = (User.id, User.username, User.image_url)
+
+# messages are read as plain rows of these, never as ORM objects
+MESSAGE_FIELDS = (Message.id, Message.text, Message.timestamp, Message.user_id)
+
+MAX_LIKE_BATCH = 100
+
+# longest a long-poll for timeline updates is held, in seconds
+DEFAULT_LONG_POLL_TIMEOUT = 25
+
+SSE_KEEPALIVE = b': keepalive\n\n'
+SSE_RESET = b'event: reset\ndata: {}\n\n'
+
+PUBLIC_ENDPOINTS = {'api.user_messages', 'api.trending'}
+
+
+def _default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+
+    raise TypeError(f"Can't serialize {type(obj).__name__}")
+
+
+def json_response(data, status=200):
+    """A response with `data` serialized as compactly and quickly as we can."""
+
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, separators=(',', ':'), default=_default)
+
+    return current_app.response_class(body, status=status,
+                                      mimetype='application/json')
+
+
+def user_summary(user):
+    return {'id': user.id, 'username': user.username,
+            'image_url': user.image_url}
+
+
+def message_page(page):
+    """The JSON body for a Page of message rows, authors listed once."""
+
+    message_ids = [msg.id for msg in page.items]
+    author_ids = {msg.user_id for msg in page.items}
+
+    liked = set()
+    if g.user and message_ids:
+        liked = g.user.liked_message_ids(message_ids)
+
+    authors = []
+    if author_ids:
+        authors = (db.session
+                   .query(*USER_FIELDS)
+                   .filter(User.id.in_(author_ids))
+                   .all())
+
+    return {
+        'messages': [{
+            'id': msg.id,
+            'text': msg.text,
+            'timestamp': msg.timestamp,
+            'user_id': msg.user_id,
+            'liked': msg.id in liked,
+        } for msg in page.items],
+        'users': [user_summary(user) for user in authors],
+        'next': page.next_cursor,
+    }
+
+
+def user_page(page):
+    """The JSON body for a Page of users."""
+
+    return {
+        'users': [dict(user_summary(user), bio=user.bio) for user in page.items],
+        'next': page.next_cursor,
+    }
+
+
+def require_user(user_id):
+    """404 unless `user_id` is an active user."""
+
+    (User.active()
+     .options(load_only(User.id))
+     .filter_by(id=user_id)
+     .first_or_404())
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    """Errors from the API are JSON too."""
+
+    return json_response({'error': error.name.lower()}, error.code)
+
+
+@api.before_request
+def require_login():
+    """As on the HTML pages, only a user's messages and trending are public."""
+
+    if not g.user and request.endpoint not in PUBLIC_ENDPOINTS:
+        return json_response({'error': 'unauthorized'}, 401)
+
+
+@api.get('/timeline')
+def timeline():
+    """The logged-in user's home timeline."""
+
+    page = home_timeline(g.user, request.args.get('before'),
+                         columns=MESSAGE_FIELDS)
+    return json_response(message_page(page))
+
+
+@api.get('/trending')
+def trending():
+    """The messages with the most recent likes."""
+
+    page = trending_messages(columns=MESSAGE_FIELDS)
+    body = message_page(page)
+
+    scores = decayed_scores([row.score for row in page.items])
+    for message, score in zip(body['messages'], scores):
+        message['score'] = round(score, 3)
+
+    return json_response(body)
+
+
+def _after_id(value):
+    """A last-seen message id from the client, or a 400."""
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def _subscribe(after=None):
+    """Subscribe to the viewer's timeline authors; return it and the backlog.
+
+    The backlog is the announcements of messages after `after` already
+    posted. It's read after subscribing, so nothing falls in between.
+    """
+
+    author_ids = db.session.scalars(timeline_author_ids(g.user.id)).all()
+
+    start_listening(current_app._get_current_object())
+    subscription = broker.subscribe(
+        author_ids, current_app.config.get('STREAM_QUEUE_SIZE',
+                                           DEFAULT_QUEUE_SIZE))
+
+    backlog = []
+    if after is not None:
+        messages = (Message.query
+                    .filter(Message.user_id.in_(author_ids),
+                            Message.id > after)
+                    .order_by(Message.id)
+                    .limit(page_size())
+                    .with_entities(*MESSAGE_FIELDS)
+                    .all())
+
+        authors = {}
+        if messages:
+            authors = {user.id: user for user in
+                       db.session.query(*USER_FIELDS).filter(
+                           User.id.in_({msg.user_id for msg in messages}))}
+
+        backlog = [Announcement.from_payload(payload(msg,
+                                                     authors[msg.user_id]))
+                   for msg in messages]
+
+    # waiting for new messages needs no database connection
+    db.session.close()
+
+    return subscription, backlog
+
+
+def _event(announcement):
+    return b'id: %d\nevent: message\ndata: %s\n\n' % (
+        announcement.message_id, announcement.data)
+
+
+@api.get('/timeline/stream')
+@cache_policy(NO_STORE)
+def timeline_stream():
+    """Server-sent events of new messages for the home timeline.
+
+    Each is a `message` event with the message id as its id and
+    `{"message": {...}, "user": {...}}` as its data. Messages after
+    `?after=<id>` (or the `Last-Event-ID` a reconnecting EventSource sends)
+    are sent first. A `reset` event means the stream fell too far behind,
+    and the timeline should be reloaded.
+    """
+
+    after = (request.headers.get('Last-Event-ID')
+             or request.args.get('after'))
+    if after is not None:
+        after = _after_id(after)
+
+    subscription, backlog = _subscribe(after)
+    keepalive = current_app.config.get('STREAM_KEEPALIVE', DEFAULT_KEEPALIVE)
+
+    def events():
+        try:
+            sent = {announcement.message_id for announcement in backlog}
+            yield b''.join(map(_event, backlog)) or SSE_KEEPALIVE
+
+            while True:
+                announcements = [announcement for announcement
+                                 in subscription.get(keepalive)
+                                 if announcement.message_id not in sent]
+
+                if subscription.overflowed:
+                    yield SSE_RESET
+                    return
+
+                if announcements:
+                    yield b''.join(map(_event, announcements))
+                    broker.delivered(announcements)
+                else:
+                    yield SSE_KEEPALIVE
+
+        finally:
+            broker.unsubscribe(subscription)
+
+    return current_app.response_class(
+        events(), mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'})
+
+
+@api.get('/timeline/updates')
+@cache_policy(NO_STORE)
+def timeline_updates():
+    """Long-poll for new messages for the home timeline.
+
+    Returns the messages after `?after=<id>` as `{"messages": [...],
+    "users": [...], "last_id": ...}`, waiting up to `?wait=` seconds (25 at
+    most) for one if there are none yet.
+    """
+
+    after = _after_id(request.args.get('after'))
+    wait = min(request.args.get('wait', DEFAULT_LONG_POLL_TIMEOUT, type=float),
+               current_app.config.get('LONG_POLL_TIMEOUT',
+                                      DEFAULT_LONG_POLL_TIMEOUT))
+
+    subscription, announcements = _subscribe(after)
+    try:
+        if not announcements and wait > 0:
+            announcements = subscription.get(wait)
+            broker.delivered(announcements)
+    finally:
+        broker.unsubscribe(subscription)
+
+    bodies = [json.loads(announcement.data) for announcement in announcements]
+    users = {body['user']['id']: body['user'] for body in bodies}
+
+    return json_response({
+        'messages': [body['message'] for body in bodies],
+        'users': list(users.values()),
+        'last_id': max([after] + [announcement.message_id
+                                  for announcement in announcements]),
+    })
+
+
+@api.get('/users/<int:user_id>/messages')
+@conditional(lambda user_id: user_id)
+def user_messages(user_id):
+    """Messages written by `user_id`."""
+
+    require_user(user_id)
+    messages = Message.by_user(user_id).with_entities(*MESSAGE_FIELDS)
+    page = paginate(messages, (Message.timestamp, Message.id),
+                    request.args.get('before'))
+
+    return json_response(message_page(page))
+
+
+@api.get('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """Messages liked by `user_id`."""
+
+    require_user(user_id)
+    messages = Message.liked_by(user_id).with_entities(*MESSAGE_FIELDS)
+    page = paginate(messages, (Message.timestamp, Message.id),
+                    request.args.get('before'))
+
+    return json_response(message_page(page))
+
+
+@api.get('/users/<int:user_id>/following')
+def user_following(user_id):
+    """Users that `user_id` follows."""
+
+    require_user(user_id)
+    users = User.following_of(user_id).options(
+        load_only(*USER_FIELDS, User.bio))
+    page = paginate(users, (User.id,), request.args.get('before'))
+
+    return json_response(user_page(page))
+
+
+@api.get('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """Users following `user_id`."""
+
+    require_user(user_id)
+    users = User.followers_of(user_id).options(
+        load_only(*USER_FIELDS, User.bio))
+    page = paginate(users, (User.id,), request.args.get('before'))
+
+    return json_response(user_page(page))
+
+
+def _message_ids(value):
+    """`value` as a list of message ids, or a 400."""
+
+    if not isinstance(value, list) or not all(
+            type(message_id) is int for message_id in value):
+        abort(400)
+
+    return value
+
+
+@api.post('/likes')
+def batch_likes():
+    """Like and unlike many messages in one transaction.
+
+    Takes `{"like": [message ids], "unlike": [message ids]}` and returns the
+    ids whose state changed, as `{"liked": [...], "unliked": [...]}`. Only
+    JSON bodies are accepted, which other sites can't send with a form.
+    """
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+
+    liked = _message_ids(body.get('like', []))
+    unliked = _message_ids(body.get('unlike', []))
+
+    if (set(liked) & set(unliked)
+            or len(liked) + len(unliked) > MAX_LIKE_BATCH):
+        abort(400)
+
+    newly_liked, newly_unliked = set_likes(g.user.id, liked, unliked)
+    db.session.commit()
+
+    return json_response({'liked': sorted(newly_liked),
+                          'unliked': sorted(newly_unliked)})
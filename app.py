@@ -1,45 +1,66 @@
-import os
+import startup  # first, to time the imports below
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+import hmac
+import sys
+
+import click
+from flask import (Blueprint, Flask, render_template, request, flash, redirect,
+                   session, g, jsonify, abort, current_app)
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
+from config import load_config
 from forms import UserAddForm, LoginForm, MessageForm, CSRFProtectForm, UserUpdateForm
-from models import db, connect_db, User, Message, Follows, LikedBy
+from models import db, connect_db, User, Message, Follows, USER_CARD
+from counters import adjust_counts, forget_message, reconcile_counters
+from pagination import paginate
+from profiler import init_profiler
+from caching import cache_policy, conditional, init_caching, NO_STORE
+from replicas import init_replicas, read_replica
+from fragments import (forget_author, forget_messages, fragment_stats,
+                       init_fragments)
+from api import api
+from assets import build_assets, init_assets, vendor_assets
+from async_views import init_async_views
+from jobs import enqueue, ensure_queued, run_workers, work_off
+from likes import like, unlike
+from purge import delete_account
+from search import search_users, autocomplete_users, create_search_indexes
+from user_cache import cache_stats, get_user, invalidate_user
+from passwords import AuthBusy, stats as password_stats
+from trending import compact_trending, trending_messages
+from stream import announce_message, stream_stats
+from timelines import (fan_out_message, remove_message, backfill_follow,
+                       prune_follow, home_timeline)
+
+startup.imported()
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ['DATABASE_URL'].replace("postgres://", "postgresql:///warbler"))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-# toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
+# Warbler's pages and commands, added to the app by create_app
+views = Blueprint('warbler', __name__, cli_group=None)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@views.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a cached LazyUser: its id, username and image_url need no
+    database query, and anything else loads the full user once.
+    """
     # ran before every single request, kind of like setup function when testing
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY]) # user.id stored in here
+    if CURR_USER_KEY in session and request.endpoint != 'static':
+        g.user = get_user(session[CURR_USER_KEY]) # user.id stored in here
 
     else:
         g.user = None
 
-@app.before_request
+@views.before_app_request
 def add_csrf_to_g():
     """If we're logged in, add curr user to Flask global."""
 
@@ -58,7 +79,17 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def liked_ids(messages):
+    """Ids of `messages` liked by the current user, for like buttons."""
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_message_ids([msg.id for msg in messages])
+
+
+@views.route('/signup', methods=["GET", "POST"])
+@cache_policy(NO_STORE)
 def signup():
     """Handle user signup.
 
@@ -94,7 +125,8 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
+@cache_policy(NO_STORE)
 def login():
     """Handle user login."""
 
@@ -105,6 +137,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -114,7 +147,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@views.post('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -127,32 +160,56 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@views.get('/users')
+@read_replica
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username; search
+    results are ranked and limited to one page. The full listing is
+    paginated with a 'before' cursor.
     """
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    if search:
+        users = search_users(search, limit=current_app.config['PAGE_SIZE'])
+        return render_template('users/index.html', users=users)
+
+    page = paginate(User.active().options(USER_CARD), (User.id,),
+                    request.args.get('before'))
+
+    return render_template('users/index.html', users=page.items,
+                           next_cursor=page.next_cursor)
+
+
+@views.get('/users/autocomplete')
+def users_autocomplete():
+    """JSON list of users whose username starts with the 'q' param."""
 
-    return render_template('users/index.html', users=users)
+    users = autocomplete_users(request.args.get('q', ''))
 
+    return jsonify([dict(id=user.id, username=user.username,
+                         image_url=user.image_url)
+                    for user in users])
 
-@app.get('/users/<int:user_id>')
+
+@views.get('/users/<int:user_id>')
+@read_replica
+@conditional(lambda user_id: user_id)
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    page = paginate(Message.by_user(user_id), (Message.timestamp, Message.id),
+                    request.args.get('before'))
 
-    return render_template('users/show.html', user=user)
+    return render_template('users/show.html', user=user, messages=page.items,
+                           liked_ids=liked_ids(page.items),
+                           next_cursor=page.next_cursor)
 
 
-@app.get('/users/<int:user_id>/likes')
+@views.get('/users/<int:user_id>/likes')
+@read_replica
 def show_likes(user_id):
     """Show list of likes for this user."""
 
@@ -160,11 +217,16 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    messages = Message.liked_by(user_id).options(joinedload(Message.user))
+    page = paginate(messages, (Message.timestamp, Message.id),
+                    request.args.get('before'))
 
-    return render_template('users/likes.html', user=user)
+    return render_template('users/likes.html', user=user, messages=page.items,
+                           next_cursor=page.next_cursor)
 
-@app.get('/users/<int:user_id>/following')
+@views.get('/users/<int:user_id>/following')
+@read_replica
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -172,12 +234,16 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    page = paginate(User.following_of(user_id).options(USER_CARD), (User.id,),
+                    request.args.get('before'))
 
-    return render_template('users/following.html', user=user)
+    return render_template('users/following.html', user=user,
+                           users=page.items, next_cursor=page.next_cursor)
 
 
-@app.get('/users/<int:user_id>/followers')
+@views.get('/users/<int:user_id>/followers')
+@read_replica
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -185,12 +251,35 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    page = paginate(User.followers_of(user_id).options(USER_CARD), (User.id,),
+                    request.args.get('before'))
+
+    return render_template('users/followers.html', user=user,
+                           users=page.items, next_cursor=page.next_cursor)
+
+
+def lock_follow(follow_id):
+    """Return active user `follow_id`, or 404.
+
+    The current user's row and theirs are locked (FOR SHARE) until commit,
+    so neither account can be deleted until the follow counts are in, and
+    then `forget_user` counts this follow (see purge.py).
+    """
+
+    users = (User.active()
+             .filter(User.id.in_({g.user.id, follow_id}))
+             .with_for_update(read=True)
+             .all())
+
+    by_id = {user.id: user for user in users}
+    if g.user.id not in by_id or follow_id not in by_id:
+        abort(404)
 
-    return render_template('users/followers.html', user=user)
+    return by_id[follow_id]
 
 
-@app.post('/users/follow/<int:follow_id>')
+@views.post('/users/follow/<int:follow_id>')
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -198,14 +287,19 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
+    followed_user = lock_follow(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    adjust_counts(g.user.id, following_count=1)
+    adjust_counts(followed_user.id, follower_count=1)
+    enqueue(backfill_follow, follower_id=g.user.id,
+            followed_id=followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@views.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -213,14 +307,18 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
+    followed_user = lock_follow(follow_id)
     g.user.following.remove(followed_user)
+    adjust_counts(g.user.id, following_count=-1)
+    adjust_counts(followed_user.id, follower_count=-1)
+    prune_follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@views.route('/users/profile', methods=["GET", "POST"])
+@cache_policy(NO_STORE)
 def profile():
     """Update profile for current user."""
 
@@ -245,6 +343,8 @@ def profile():
 
             db.session.add(user)
             db.session.commit()
+            invalidate_user(user.id)
+            forget_author(user.id)
 
             flash('User updated')
             return redirect(f"/users/{user.id}")
@@ -257,9 +357,13 @@ def profile():
 
 
 
-@app.post('/users/delete')
+@views.post('/users/delete')
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    The account is hidden and the user logged out right away; their rows
+    are removed by a background job.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -267,8 +371,9 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    delete_account(g.user.load())
     db.session.commit()
+    invalidate_user(g.user.id)
 
     return redirect("/signup")
 
@@ -276,7 +381,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@views.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -292,6 +397,10 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        adjust_counts(g.user.id, message_count=1)
+        enqueue(fan_out_message, message_id=msg.id)
+        announce_message(msg, g.user)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -299,15 +408,23 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@views.get('/messages/<int:message_id>')
+@read_replica
+@conditional(lambda message_id: Message.author_of(message_id))
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message.query
+           .options(joinedload(Message.user))
+           .get_or_404(message_id))
+    if msg.user.deleted_at is not None:
+        abort(404)
 
+    return render_template('messages/show.html', message=msg,
+                           liked_ids=liked_ids([msg]))
 
-@app.post('/messages/<int:message_id>/delete')
+
+@views.post('/messages/<int:message_id>/delete')
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -316,93 +433,247 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    remove_message(msg.id)
+    forget_message(msg.id)
+    adjust_counts(msg.user_id, message_count=-1)
     db.session.delete(msg)
     db.session.commit()
+    forget_messages([message_id])
 
     return redirect(f"/users/{g.user.id}")
 
-@app.post('/messages/<int:message_id>/like')
+@views.post('/messages/<int:message_id>/like')
 def like_message(message_id):
-    """Like a message."""
-
-    message = Message.query.get(message_id)
+    """Like a message. Liking it again is harmless."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    if g.user.id == message.user.id:
-        flash("You can't like your own warble!", "danger")
-        return redirect("/")
+    if like(g.user.id, message_id):
+        db.session.commit()
 
-    like = g.user.like_message(g.user.id, message_id)
+    else:
+        # already liked, or not likeable: only now is it worth looking
+        message = Message.query.get_or_404(message_id)
 
-    db.session.add(like)
-    db.session.commit()
+        if g.user.id == message.user_id:
+            flash("You can't like your own warble!", "danger")
+            return redirect("/")
 
     flash("Warble liked!", "success")
     return redirect("/")
 
-@app.post('/messages/<int:message_id>/unlike')
+@views.post('/messages/<int:message_id>/unlike')
 def unlike_message(message_id):
-    """Unlike a message."""
-
-    message = Message.query.get(message_id)
+    """Unlike a message. Unliking it again is harmless."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    like = LikedBy.query.get((g.user.id, message_id))
-
-    db.session.delete(like)
-    db.session.commit()
+    if unlike(g.user.id, message_id):
+        db.session.commit()
 
     flash("Warble removed from likes!", "success")
     return redirect(f"/users/{g.user.id}/likes")
 
 
+@views.get('/trending')
+@read_replica
+def trending():
+    """Show the messages with the most recent likes, for anyone."""
+
+    page = trending_messages()
+
+    return render_template('messages/trending.html', messages=page.items,
+                           liked_ids=liked_ids(page.items))
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.get('/')
+@views.get('/')
+@read_replica
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, paginated with a
+      'before' cursor
     """
 
     if g.user:
-        following = Follows.query.filter_by(user_following_id = g.user.id).all() # getting records of all users you follow using through table
-        ids = [followed_user.user_being_followed_id for followed_user in following] # getting only the user ids of people you follow
-        ids.append(g.user.id) # adding your own tweets
+        page = home_timeline(g.user, request.args.get('before'))
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(ids)) # filtering tweets to show followed and own tweets
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        return render_template('home.html', messages=page.items,
+                               liked_ids=liked_ids(page.items),
+                               next_cursor=page.next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
+@views.get('/metrics')
+@cache_policy(NO_STORE)
+def metrics():
+    """This process's counters, as JSON, for holders of METRICS_TOKEN."""
+
+    token = current_app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+
+    if not token or not hmac.compare_digest(authorization,
+                                            f'Bearer {token}'):
+        abort(404)
+
+    return jsonify(stream=stream_stats(), passwords=password_stats(),
+                   fragments=fragment_stats(), user_cache=cache_stats(),
+                   startup=startup.stats())
+
+
+@views.app_errorhandler(AuthBusy)
+def auth_busy(error):
+    """Too many logins/signups are queued for password hashing."""
+
+    return ("Warbler is busy signing people in. Please try again in a moment.",
+            503, {'Retry-After': '5'})
+
+
+
+##############################################################################
+# Maintenance commands
+
+
+@views.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute the denormalized user counters from the database."""
+
+    reconcile_counters()
+    db.session.commit()
+    click.echo("User counters reconciled.")
+
+
+@views.cli.command('jobs-worker')
+@click.option('--threads', default=2, show_default=True,
+              help="Number of worker threads.")
+@click.option('--interval', default=1.0, show_default=True,
+              help="Seconds an idle worker waits before looking for jobs.")
+@click.option('--once', is_flag=True,
+              help="Run the jobs that are due now, then exit.")
+def jobs_worker_command(threads, interval, once):
+    """Run background jobs (timeline fan-out, account purges...).
+
+    Also makes sure the periodic trending compaction is queued.
+    """
+
+    ensure_queued(compact_trending)
+    db.session.commit()
+
+    if once:
+        count = work_off()
+        click.echo(f"Ran {count} jobs.")
+    else:
+        run_workers(current_app._get_current_object(), threads,
+                    interval)
+
+
+@views.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Create the user search indexes on an existing database."""
+
+    with db.engine.begin() as connection:
+        create_search_indexes(connection)
+    click.echo("Search indexes created.")
+
+
+@views.cli.command('build-assets')
+@click.option('--vendor', is_flag=True,
+              help="Download the CDN-hosted libraries into static/vendor "
+                   "first.")
+def build_assets_command(vendor):
+    """Fingerprint and precompress the static files into static/dist."""
+
+    if vendor:
+        vendor_assets(current_app.static_folder)
+
+    manifest = build_assets(current_app.static_folder,
+                            current_app.static_url_path)
+    click.echo(f"Built {len(manifest['urls'])} static files.")
+
+
+@views.cli.command('startup-time')
+@click.option('--runs', default=5, show_default=True,
+              help="Number of fresh interpreters to time.")
+@click.option('--budget', type=float,
+              help="Seconds allowed  [default: STARTUP_BUDGET].")
+def startup_time_command(runs, budget):
+    """Time importing and building the app; fail if it's over budget.
+
+    Also fails if dev-only extensions were imported. Run it with the
+    production config (WARBLER_CONFIG=production) to check what a web
+    worker pays.
+    """
+
+    budget = budget or current_app.config['STARTUP_BUDGET']
+    measured = startup.measure(runs)
+    dev_only = measured.pop('dev_only_modules')
+    total = sum(measured.values())
+
+    for phase, ms in measured.items():
+        click.echo(f"{phase}: {ms:.0f}ms")
+    click.echo(f"total: {total:.0f}ms (budget {budget * 1000:.0f}ms)")
+
+    if dev_only:
+        click.echo(f"dev-only modules imported: {', '.join(dev_only)}")
+    if dev_only or total > budget * 1000:
+        sys.exit(1)
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# Application factory
+
+
+def init_dev_extensions(app):
+    """Set up the extensions only used in development, importing them only
+    when they're used."""
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    # Flask-Migrate's `flask db` commands import it before building the app;
+    # web workers never do, so they don't pay for importing alembic
+    if 'flask_migrate' in sys.modules:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+
+def create_app(config=None):
+    """Build the Warbler app.
+
+    `config` is a class from config.py or its name; by default it's named by
+    the WARBLER_CONFIG environment variable. Nothing connects to the
+    database until the first request, so the app can be built before
+    gunicorn forks its workers (`--preload`).
+    """
+
+    with startup.timed('create_app'):
+        app = Flask(__name__)
+        load_config(app, config)
+
+        connect_db(app)
+        init_dev_extensions(app)
+        init_profiler(app)
+        init_assets(app)
+        init_caching(app)
+        init_replicas(app)
+        init_fragments(app)
+        app.register_blueprint(api)
+        app.register_blueprint(views)
+        # with ASYNC_VIEWS on, the read-heavy pages are served by async_views
+        init_async_views(app)
+
+    startup.report(app)
+
+    return app
@@ -0,0 +1,339 @@
+"""Fingerprinted, precompressed static files.
+
+`flask build-assets` copies every file under `static/` to `static/dist/`
+with a hash of its contents in the name (`stylesheets/style.css` becomes
+`dist/stylesheets/style.3f2a9c1e04b7.css`), writes `.gz` and `.br`
+variants of the compressible ones, and records them in
+`static/dist/manifest.json`. Stylesheets are hashed after the files they
+`url()`, with those references rewritten, so a changed image changes the
+stylesheet's name too.
+
+With `FINGERPRINT_ASSETS` on and a manifest built, `url_for('static', ...)`
+links the hashed files, which are served as immutable for a year (see
+caching.py) and, where the client accepts it, as their brotli or gzip
+variant with `Vary: Accept-Encoding`. Without a manifest, static URLs fall
+back to caching.py's mtime versions.
+
+Bootstrap, jQuery, Popper and Font Awesome load from their CDNs, unless
+`VENDOR_ASSETS` is on: then pages link copies under `static/vendor/`,
+downloaded by `flask build-assets --vendor`, and hashed and compressed like
+the rest. Templates link them with `vendor_url(name)`.
+
+Brotli variants need the optional `brotli` package; without it only gzip
+variants are written.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from urllib.parse import urljoin
+from urllib.request import urlopen
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger('warbler.assets')
+
+DIST = 'dist'
+MANIFEST = 'dist/manifest.json'
+VENDOR = 'vendor'
+
+# name under static/vendor/: pinned CDN URL
+VENDOR_ASSETS = {
+    'bootstrap/bootstrap.css':
+        'https://unpkg.com/bootstrap@5.3.3/dist/css/bootstrap.css',
+    'jquery/jquery.js': 'https://unpkg.com/jquery@3.7.1/dist/jquery.js',
+    'popper/popper.js':
+        'https://unpkg.com/@popperjs/core@2.11.8/dist/umd/popper.js',
+    'bootstrap/bootstrap.js':
+        'https://unpkg.com/bootstrap@5.3.3/dist/js/bootstrap.js',
+    'fontawesome/css/all.css':
+        'https://use.fontawesome.com/releases/v5.3.1/css/all.css',
+}
+
+# best first; the suffix each variant is written with
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+# already-compressed formats (images, woff fonts) gain nothing
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.ico', '.txt',
+                '.html', '.xml', '.ttf', '.otf', '.eot'}
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+HASH_LENGTH = 12
+
+# no manifest: nothing is fingerprinted
+EMPTY = dict(urls={}, files={})
+
+
+##############################################################################
+# Building
+
+
+def _hashed_name(filename, data):
+    root, ext = posixpath.splitext(filename)
+    digest = hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+
+    return f'{DIST}/{root}.{digest}{ext}'
+
+
+def _split_ref(ref):
+    """Split a `url()` reference into its path and any ?query / #fragment."""
+
+    match = re.match(r'([^?#]*)(.*)', ref)
+
+    return match.group(1), match.group(2)
+
+
+def _local_ref(ref, filename, static_url_path):
+    """The file under static/ that `ref` in `filename` names, or None."""
+
+    if ref.startswith(('data:', '#')) or '//' in ref:
+        return None
+
+    if ref.startswith(static_url_path + '/'):
+        return ref[len(static_url_path) + 1:]
+    if ref.startswith('/'):
+        return None
+
+    return posixpath.normpath(posixpath.join(posixpath.dirname(filename),
+                                             ref))
+
+
+def _rewrite_css(css, filename, urls, static_url_path):
+    """`css` with its `url()`s pointing at the hashed files in `urls`."""
+
+    hashed_dir = posixpath.dirname(f'{DIST}/{filename}')
+
+    def replace(match):
+        path, rest = _split_ref(match.group(2))
+        target = _local_ref(path, filename, static_url_path)
+
+        if target not in urls:
+            return match.group(0)
+
+        if path.startswith('/'):
+            new = f'{static_url_path}/{urls[target]}'
+        else:
+            new = posixpath.relpath(urls[target], hashed_dir)
+
+        return f'url("{new}{rest}")'
+
+    return CSS_URL.sub(replace, css)
+
+
+def _compress(data, encoding):
+    if encoding == 'gzip':
+        # no timestamp, so builds are reproducible
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    return brotli.compress(data, quality=11)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def _sources(static_folder):
+    """Paths under `static_folder`, relative and '/'-separated; stylesheets
+    last, so what they reference is hashed first."""
+
+    sources = []
+
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [name for name in dirs if name != DIST]
+        dirs.sort()
+
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), static_folder)
+            sources.append(path.replace(os.sep, '/'))
+
+    return sorted(sources, key=lambda name: name.endswith('.css'))
+
+
+def build_assets(static_folder, static_url_path='/static'):
+    """Fingerprint and compress the files under `static_folder`.
+
+    Replaces `static_folder/dist/` and returns the manifest written there.
+    """
+
+    if brotli is None:
+        logger.warning("brotli is not installed; writing gzip variants only")
+
+    encodings = [encoding for encoding in ENCODINGS
+                 if encoding != 'br' or brotli is not None]
+
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    urls = {}
+    files = {}
+
+    for filename in _sources(static_folder):
+        with open(os.path.join(static_folder, filename), 'rb') as file:
+            data = file.read()
+
+        if filename.endswith('.css'):
+            data = _rewrite_css(data.decode(), filename, urls,
+                                static_url_path).encode()
+
+        hashed = _hashed_name(filename, data)
+        _write(os.path.join(static_folder, hashed), data)
+
+        variants = []
+        if posixpath.splitext(filename)[1].lower() in COMPRESSIBLE:
+            for encoding in encodings:
+                compressed = _compress(data, encoding)
+
+                if len(compressed) < len(data):
+                    _write(os.path.join(static_folder,
+                                        hashed + ENCODINGS[encoding]),
+                           compressed)
+                    variants.append(encoding)
+
+        urls[filename] = hashed
+        files[hashed] = variants
+
+    manifest = dict(urls=urls, files=files)
+    _write(os.path.join(static_folder, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    return manifest
+
+
+def _fetch(url):
+    with urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def vendor_assets(static_folder, fetch=_fetch):
+    """Download `VENDOR_ASSETS` into `static_folder/vendor/`.
+
+    Files a stylesheet references by relative `url()` (Font Awesome's web
+    fonts) are downloaded next to it, keeping their relative paths.
+    """
+
+    for name, url in VENDOR_ASSETS.items():
+        data = fetch(url)
+        filename = f'{VENDOR}/{name}'
+        _write(os.path.join(static_folder, filename), data)
+
+        if not name.endswith('.css'):
+            continue
+
+        refs = {_split_ref(match.group(2))[0]
+                for match in CSS_URL.finditer(data.decode())}
+
+        for ref in sorted(refs):
+            target = _local_ref(ref, filename, '/static')
+            if target is None or ref.startswith('/'):
+                continue
+
+            _write(os.path.join(static_folder, target),
+                   fetch(urljoin(url, ref)))
+
+
+##############################################################################
+# Serving
+
+
+def _assets():
+    return current_app.extensions.get('assets', EMPTY)
+
+
+def fingerprinted_url(filename):
+    """The hashed file to link for `filename`, or None if there isn't one."""
+
+    return _assets()['urls'].get(filename)
+
+
+def is_fingerprinted(filename):
+    return filename in _assets()['files']
+
+
+def send_static(filename):
+    """Flask's static view, sending hashed files precompressed if possible."""
+
+    variants = _assets()['files'].get(filename)
+
+    if not variants:
+        return current_app.send_static_file(filename)
+
+    accepted = request.accept_encodings
+    encoding = next((encoding for encoding in variants
+                     if accepted.quality(encoding)), None)
+
+    if encoding is None:
+        response = current_app.send_static_file(filename)
+    else:
+        response = send_from_directory(
+            current_app.static_folder, filename + ENCODINGS[encoding],
+            mimetype=mimetypes.guess_type(filename)[0])
+        response.content_encoding = encoding
+
+    # caches keep a copy per encoding
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def vendor_url(name):
+    """URL of a `VENDOR_ASSETS` file: our copy with `VENDOR_ASSETS` on,
+    else the CDN's."""
+
+    if current_app.config.get('VENDOR_ASSETS'):
+        return url_for('static', filename=f'{VENDOR}/{name}')
+
+    return VENDOR_ASSETS[name]
+
+
+def load_assets(app):
+    """Read the manifest `flask build-assets` wrote, if there is one."""
+
+    path = os.path.join(app.static_folder, MANIFEST)
+
+    try:
+        with open(path) as file:
+            app.extensions['assets'] = json.load(file)
+    except FileNotFoundError:
+        logger.warning("%s not found; run `flask build-assets` to serve "
+                       "fingerprinted static files", path)
+        app.extensions['assets'] = EMPTY
+
+
+def init_assets(app):
+    """Serve fingerprinted static files, and add `vendor_url` to templates.
+
+    Call it before `init_caching`, which versions the static URLs the
+    manifest doesn't cover.
+    """
+
+    if app.config.get('VENDOR_ASSETS'):
+        missing = [name for name in VENDOR_ASSETS
+                   if not os.path.exists(os.path.join(app.static_folder,
+                                                      VENDOR, name))]
+        if missing:
+            raise RuntimeError("VENDOR_ASSETS needs `flask build-assets "
+                               f"--vendor` run first (missing {missing[0]})")
+
+    if app.config.get('FINGERPRINT_ASSETS'):
+        load_assets(app)
+    else:
+        app.extensions['assets'] = EMPTY
+
+    app.view_functions['static'] = send_static
+    app.add_template_global(vendor_url)
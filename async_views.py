@@ -0,0 +1,418 @@
+"""Async versions of Warbler's read-heavy pages.
+
+With `ASYNC_VIEWS` on, the home page, profiles, the user list, message
+pages and the following/followers lists are served by the `async def`
+views here instead of the ones in app.py. They query through an
+`AsyncSession` on an async driver (asyncpg for PostgreSQL, aiosqlite for
+SQLite), and a page's independent queries run at the same time: a profile
+fetches the user, their page of messages, the viewer's likes among those
+messages and the viewer's follows in one round trip's time instead of four.
+
+Each statement runs on its own short-lived `AsyncSession`, since a session
+can only run one statement at a time. Rows come back fully loaded (authors
+are eager-loaded) and are rendered after their sessions are closed, so the
+templates never need a lazy load.
+
+Async engines hold connections tied to the event loop that opened them, so
+each process runs one event loop on a background thread and Flask's
+`async_to_sync` hands views to it, rather than making a loop per request.
+The loop and engines are made on first use in each process, so they're
+never shared across a fork.
+
+Everything else (the session user, conditional GETs, writes) stays on the
+sync session. `ASYNC_DATABASE_URL` and `ASYNC_DATABASE_REPLICA_URL` default
+to the sync URLs with the async driver swapped in; the pools are sized by
+the same `DATABASE_*` and `REPLICA_*` settings. Reads go to the async
+replica whenever `replicas` would send the page to the replica.
+
+Needs SQLAlchemy's asyncio extension (the `greenlet` package) and the
+driver: `asyncpg` or `aiosqlite`.
+"""
+
+import asyncio
+import os
+from asyncio import gather
+from functools import wraps
+from threading import Lock, Thread
+
+from flask import (abort, current_app, flash, g, redirect, render_template,
+                   request)
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from caching import conditional
+from models import (Follows, LikedBy, Message, TimelineEntry, User, USER_CARD,
+                    pool_options)
+from pagination import keyset_query, make_page
+from replicas import read_replica, stick_to_primary
+from search import search_query
+from timelines import timeline_author_ids, timeline_fill, timeline_is_full
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+except ImportError:  # pragma: no cover
+    AsyncSession = create_async_engine = None
+
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+_runtime_lock = Lock()
+_runtime = dict(pid=None, loop=None, engines={})
+
+
+def async_url(url):
+    """`url` with its dialect's async driver."""
+
+    url = make_url(url)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"ASYNC_VIEWS has no async driver for {backend}")
+
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+def _process_runtime():
+    """This process's event loop and engines, started on first use."""
+
+    with _runtime_lock:
+        if _runtime['pid'] != os.getpid():
+            # a forked child can't use its parent's loop thread or
+            # connections: start over, leaving the parent's to the parent
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, name='warbler-async',
+                   daemon=True).start()
+            _runtime.update(pid=os.getpid(), loop=loop, engines={})
+
+        return _runtime
+
+
+def _engine(name):
+    """The async engine for the primary or the replica, made on first use."""
+
+    runtime = _process_runtime()
+    config = current_app.config
+
+    with _runtime_lock:
+        if name not in runtime['engines']:
+            if name == 'replica':
+                url = (config.get('ASYNC_DATABASE_REPLICA_URL')
+                       or async_url(config['DATABASE_REPLICA_URL']))
+                prefix = 'REPLICA'
+            else:
+                url = (config.get('ASYNC_DATABASE_URL')
+                       or async_url(config['SQLALCHEMY_DATABASE_URI']))
+                prefix = 'DATABASE'
+
+            runtime['engines'][name] = create_async_engine(
+                url, **pool_options(current_app, prefix, url))
+
+        return runtime['engines'][name]
+
+
+def run_on_loop(func):
+    """Flask's `async_to_sync`: run coroutine function `func` on the loop.
+
+    The coroutine runs in a copy of the caller's context, so it sees the
+    request, `g` and the session.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        loop = _process_runtime()['loop']
+        future = asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop)
+        return future.result()
+
+    return wrapper
+
+
+##############################################################################
+# Running statements
+
+
+def _reader():
+    """The engine this request's SELECTs should use."""
+
+    if g.get('read_replica') is not None and not g.get('async_wrote'):
+        return _engine('replica')
+
+    return _engine('primary')
+
+
+async def _execute(statement, engine):
+    """Run `statement` on its own session; the result is fully buffered."""
+
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        return await session.execute(statement)
+
+
+async def _all(statement):
+    return (await _execute(statement, _reader())).scalars().all()
+
+
+async def _first(statement):
+    return (await _execute(statement, _reader())).scalars().first()
+
+
+async def _scalar(statement):
+    return (await _execute(statement, _reader())).scalar()
+
+
+async def _write(*statements):
+    """Run `statements` in one transaction on the primary.
+
+    Once anything is written, the request's reads go to the primary, and
+    the viewer stays there for a while, as with the sync session.
+    """
+
+    async with AsyncSession(_engine('primary')) as session:
+        results = [await session.execute(statement)
+                   for statement in statements]
+        await session.commit()
+
+    if any(result.rowcount for result in results):
+        g.async_wrote = True
+        stick_to_primary()
+
+
+##############################################################################
+# Queries
+
+
+def _active_users():
+    return select(User).where(User.deleted_at.is_(None))
+
+
+async def _load_following_ids():
+    """Fill in the viewer's following ids, for the pages' follow buttons."""
+
+    if g.user:
+        g.user._following_ids = set(await _all(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == g.user.id)))
+
+
+async def _liked_among(message_ids):
+    """Ids among `message_ids` (a list or a SELECT) the viewer has liked."""
+
+    if not g.user:
+        return set()
+
+    return set(await _all(select(LikedBy.message_id)
+                          .where(LikedBy.user_id == g.user.id,
+                                 LikedBy.message_id.in_(message_ids))))
+
+
+async def _messages_page(query, keys, before, attrs=None):
+    """Return (Page, liked ids) for the messages `query` selects.
+
+    The viewer's likes are looked up among the page's ids at the same time
+    as the page itself, rather than after it.
+    """
+
+    statement = keyset_query(query, keys, before)
+
+    rows, liked_ids = await gather(
+        _all(statement.options(joinedload(Message.user))),
+        _liked_among(statement.with_only_columns(Message.id)))
+
+    return make_page(rows, attrs or [key.key for key in keys]), liked_ids
+
+
+async def _users_page(query, before):
+    """Page of the user cards `query` selects."""
+
+    rows = await _all(keyset_query(query.options(USER_CARD), (User.id,),
+                                   before))
+
+    return make_page(rows, ['id'])
+
+
+async def _warm_timeline(user_id):
+    """Build a cold timeline; another request may have built it first."""
+
+    try:
+        await _write(timeline_fill(user_id),
+                     update(User)
+                     .where(User.id == user_id)
+                     .values(timeline_warm=True))
+    except IntegrityError:
+        pass
+
+
+##############################################################################
+# Views
+
+
+@read_replica
+async def homepage():
+    """Async `app.homepage`.
+
+    The viewer's row (for their counts) and their follows are read at once,
+    then the timeline page and the likes on it.
+    """
+
+    if not g.user:
+        return render_template('home-anon.html')
+
+    user_id = g.user.id
+    before = request.args.get('before')
+
+    viewer, _ = await gather(_first(select(User).where(User.id == user_id)),
+                             _load_following_ids())
+    g.user.set_loaded(viewer)
+
+    if not viewer.timeline_warm:
+        await _warm_timeline(user_id)
+
+    entries = (select(Message)
+               .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+               .join(User, User.id == TimelineEntry.author_id)
+               .where(TimelineEntry.user_id == user_id,
+                      User.deleted_at.is_(None)))
+
+    page, liked_ids = await _messages_page(
+        entries, (TimelineEntry.timestamp, TimelineEntry.message_id), before,
+        attrs=('timestamp', 'id'))
+
+    if page.next_cursor is None and await _scalar(timeline_is_full(user_id)):
+        fallback = select(Message).where(
+            Message.user_id.in_(timeline_author_ids(user_id)))
+        page, liked_ids = await _messages_page(
+            fallback, (Message.timestamp, Message.id), before)
+
+    return render_template('home.html', messages=page.items,
+                           liked_ids=liked_ids, next_cursor=page.next_cursor)
+
+
+@read_replica
+async def list_users():
+    """Async `app.list_users`."""
+
+    search = request.args.get('q')
+
+    if search:
+        statement = search_query(search, current_app.config['PAGE_SIZE'])
+        if statement is None:
+            return render_template('users/index.html', users=[])
+
+        users, _ = await gather(_all(statement), _load_following_ids())
+        return render_template('users/index.html', users=users)
+
+    page, _ = await gather(_users_page(_active_users(),
+                                       request.args.get('before')),
+                           _load_following_ids())
+
+    return render_template('users/index.html', users=page.items,
+                           next_cursor=page.next_cursor)
+
+
+@read_replica
+@conditional(lambda user_id: user_id)
+async def users_show(user_id):
+    """Async `app.users_show`."""
+
+    user, (page, liked_ids), _ = await gather(
+        _first(_active_users().where(User.id == user_id)),
+        _messages_page(select(Message).where(Message.user_id == user_id),
+                       (Message.timestamp, Message.id),
+                       request.args.get('before')),
+        _load_following_ids())
+
+    if user is None:
+        abort(404)
+
+    return render_template('users/show.html', user=user, messages=page.items,
+                           liked_ids=liked_ids, next_cursor=page.next_cursor)
+
+
+@read_replica
+async def show_following(user_id):
+    """Async `app.show_following`."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    following = (_active_users()
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .where(Follows.user_following_id == user_id))
+
+    user, page, _ = await gather(
+        _first(_active_users().where(User.id == user_id)),
+        _users_page(following, request.args.get('before')),
+        _load_following_ids())
+
+    if user is None:
+        abort(404)
+
+    return render_template('users/following.html', user=user,
+                           users=page.items, next_cursor=page.next_cursor)
+
+
+@read_replica
+async def users_followers(user_id):
+    """Async `app.users_followers`."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followers = (_active_users()
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .where(Follows.user_being_followed_id == user_id))
+
+    user, page, _ = await gather(
+        _first(_active_users().where(User.id == user_id)),
+        _users_page(followers, request.args.get('before')),
+        _load_following_ids())
+
+    if user is None:
+        abort(404)
+
+    return render_template('users/followers.html', user=user,
+                           users=page.items, next_cursor=page.next_cursor)
+
+
+@read_replica
+@conditional(lambda message_id: Message.author_of(message_id))
+async def messages_show(message_id):
+    """Async `app.messages_show`."""
+
+    msg, liked_ids, _ = await gather(
+        _first(select(Message)
+               .options(joinedload(Message.user))
+               .where(Message.id == message_id)),
+        _liked_among([message_id]),
+        _load_following_ids())
+
+    if msg is None or msg.user.deleted_at is not None:
+        abort(404)
+
+    return render_template('messages/show.html', message=msg,
+                           liked_ids=liked_ids)
+
+
+# endpoint: async view
+VIEWS = {f'warbler.{view.__name__}': view
+         for view in (homepage, list_users, users_show, show_following,
+                      users_followers, messages_show)}
+
+
+def init_async_views(app):
+    """With `ASYNC_VIEWS` on, serve the pages in `VIEWS` with these views.
+
+    Call it after app.py's views are registered; their URLs are kept.
+    """
+
+    if not app.config.get('ASYNC_VIEWS'):
+        return
+
+    if create_async_engine is None:
+        raise RuntimeError("ASYNC_VIEWS needs SQLAlchemy's asyncio extension "
+                           "(the greenlet package)")
+
+    # Flask's hook for running async views; see run_on_loop
+    app.async_to_sync = run_on_loop
+    app.view_functions.update(VIEWS)
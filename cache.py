@@ -0,0 +1,95 @@
+"""A small thread-safe, in-process LRU cache with optional expiry."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    """Keep the `maxsize` most recently used items for up to `ttl` seconds.
+
+    `ttl=None` keeps items until they're evicted. Hit and miss counts are
+    kept for sizing the cache.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default`."""
+
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is not None:
+                value, expires = item
+
+                if expires is None or expires > monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._items[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the least recently used."""
+
+        expires = None if self.ttl is None else monotonic() + self.ttl
+
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def replace(self, key, current, value):
+        """Cache `value` under `key` only if `key` still holds `current`
+        (None: nothing). Returns whether it did."""
+
+        expires = None if self.ttl is None else monotonic() + self.ttl
+
+        with self._lock:
+            item = self._items.get(key)
+
+            if (item[0] if item is not None else None) is not current:
+                return False
+
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+            return True
+
+    def delete(self, key):
+        """Drop `key` from the cache, if it's there."""
+
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Drop everything and reset the counters."""
+
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Size and hit/miss counts, for sizing the cache."""
+
+        return dict(size=len(self._items), maxsize=self.maxsize,
+                    hits=self.hits, misses=self.misses)
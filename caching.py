@@ -0,0 +1,171 @@
+"""HTTP cache policies and conditional GETs for Warbler.
+
+Every response gets a `Cache-Control` policy:
+
+- pages default to `private, no-cache`: the browser may keep a copy but has
+  to revalidate it, which `conditional` views answer with a cheap 304;
+- views marked `@cache_policy(NO_STORE)` (login, signup, profile editing)
+  are never stored;
+- static files linked through `url_for('static', ...)` are cached for a
+  year as immutable: the fingerprinted copy from assets.py's manifest if
+  there is one, else the file with a `v` version parameter taken from its
+  mtime. Unversioned static URLs are revalidated instead.
+
+`@conditional(...)` views declare which users' rows the page is built from.
+Their `updated_at` timestamps (bumped by every change to the row, counter
+updates included), together with the viewer's, make the page's `ETag` and
+`Last-Modified`. A matching `If-None-Match` / `If-Modified-Since` gets a 304
+after one indexed query, before the view runs or anything is rendered.
+"""
+
+import hashlib
+import os
+from datetime import timezone
+from functools import wraps
+from time import time
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import or_
+from werkzeug.http import is_resource_modified
+
+from assets import fingerprinted_url, is_fingerprinted
+from models import db, User
+
+PRIVATE = 'private, no-cache'
+NO_STORE = 'no-store'
+STATIC_REVALIDATE = 'public, no-cache'
+STATIC_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Flask-WTF's default token lifetime
+DEFAULT_CSRF_TIME_LIMIT = 3600
+
+
+def cache_policy(policy):
+    """Give a view a `Cache-Control` policy other than `PRIVATE`."""
+
+    def decorator(view):
+        view.cache_policy = policy
+        return view
+
+    return decorator
+
+
+def _csrf_bucket():
+    """Changes every half token lifetime, so a cached page's CSRF tokens
+    are never served once they're too old to use."""
+
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT',
+                                   DEFAULT_CSRF_TIME_LIMIT)
+
+    return int(time() // (limit / 2)) if limit else 0
+
+
+def _validators(user_ids):
+    """Return (ETag, Last-Modified) for a page built from `user_ids`' rows.
+
+    `user_ids` is an id or a SELECT of ids. Returns None if none of them
+    exist, leaving the view to deal with it.
+    """
+
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+
+    viewer = g.user.id if g.user else None
+    rows = (db.session
+            .query(User.id, User.updated_at,
+                   User.id.in_(user_ids).label('shown'))
+            .filter(or_(User.id.in_(user_ids), User.id == viewer))
+            .order_by(User.id)
+            .all())
+
+    if not any(row.shown for row in rows):
+        return None
+
+    parts = [request.full_path, viewer, _csrf_bucket()]
+    parts += [(row.id, row.updated_at.isoformat()) for row in rows]
+    etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    last_modified = max(row.updated_at for row in rows)
+
+    return etag, last_modified.replace(tzinfo=timezone.utc)
+
+
+def conditional(user_ids):
+    """Answer conditional GETs for a view whose page depends on users' rows.
+
+    `user_ids(**view_args)` returns the id (or a SELECT of ids) of the users
+    whose rows the page shows; the viewer is always included. The view may
+    be async.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            run_view = current_app.ensure_sync(view)
+
+            # pending flashes are rendered (and used up) by the page
+            if session.get('_flashes'):
+                return run_view(**view_args)
+
+            validators = _validators(user_ids(**view_args))
+            if validators is None:
+                return run_view(**view_args)
+
+            etag, last_modified = validators
+
+            if is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified):
+                response = make_response(run_view(**view_args))
+            else:
+                response = current_app.response_class(status=304)
+
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.vary.add('Cookie')
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _static_version(endpoint, values):
+    """Link the file's fingerprinted copy, or else add its mtime to the
+    URL, so it can be immutable."""
+
+    if endpoint != 'static' or 'filename' not in values or 'v' in values:
+        return
+
+    hashed = fingerprinted_url(values['filename'])
+    if hashed:
+        values['filename'] = hashed
+        return
+
+    path = os.path.join(current_app.static_folder, values['filename'])
+
+    try:
+        values['v'] = int(os.stat(path).st_mtime)
+    except OSError:
+        pass
+
+
+def _apply_cache_policy(response):
+    if request.endpoint == 'static':
+        versioned = (request.args.get('v')
+                     or is_fingerprinted(request.view_args['filename']))
+        response.headers['Cache-Control'] = (STATIC_IMMUTABLE if versioned
+                                             else STATIC_REVALIDATE)
+        return response
+
+    view = current_app.view_functions.get(request.endpoint)
+    response.headers['Cache-Control'] = getattr(view, 'cache_policy', PRIVATE)
+
+    return response
+
+
+def init_caching(app):
+    """Set a cache policy on every response and version static URLs."""
+
+    app.url_defaults(_static_version)
+    app.after_request(_apply_cache_policy)
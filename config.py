@@ -0,0 +1,155 @@
+"""Settings for each environment Warbler runs in.
+
+`create_app(config)` takes one of these classes, or its name in `CONFIGS`
+(default: the `WARBLER_CONFIG` environment variable, else 'development').
+
+Every setting can be overridden by an environment variable of the same
+name, read when the app is created: numbers are parsed, and flags are on
+when set to '1'. The database comes from `DATABASE_URL` (`TEST_DATABASE_URL`
+for the tests, so they never touch a real database by accident); Heroku
+style `postgres://` URLs are accepted.
+"""
+
+import os
+
+# an environment variable that must be set, for ProductionConfig
+REQUIRED = object()
+
+# types of the settings whose default is None, for parsing the environment
+TYPES = {'BCRYPT_MAX_PENDING': int}
+
+
+class Config:
+    """Settings shared by every environment."""
+
+    DATABASE_URL_VARIABLE = 'DATABASE_URL'
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///warbler'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = 'warbler-development-key'
+
+    # link static files by the hashes `flask build-assets` wrote; see assets.py
+    FINGERPRINT_ASSETS = True
+    # link our copies of bootstrap, jquery, etc. instead of the CDNs'
+    VENDOR_ASSETS = False
+
+    # dev-only extensions, imported only when turned on
+    DEBUG_TOOLBAR = False
+
+    # seconds import + create_app (+ worker boot) may take; see startup.py
+    STARTUP_BUDGET = 1.0
+
+    TIMELINE_LENGTH = 800
+    PAGE_SIZE = 50
+    SEARCH_PROFILES = False
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    FRAGMENT_CACHE_SIZE = 50000
+    FRAGMENT_CACHE_URL = None
+    BCRYPT_LOG_ROUNDS = 12
+    BCRYPT_WORKERS = os.cpu_count() or 1
+    # None: four per worker
+    BCRYPT_MAX_PENDING = None
+    PROFILE_REQUESTS = False
+    PROFILE_SLOW_REQUEST_MS = 500
+    PURGE_CHUNK_SIZE = 1000
+    JOB_MAX_ATTEMPTS = 5
+    JOB_BACKOFF = 10
+    JOB_LOCK_TIMEOUT = 600
+    TRENDING_HALF_LIFE = 6 * 60 * 60
+    TRENDING_COMPACT_EVERY = 60 * 60
+    TRENDING_MIN_SCORE = 0.1
+    TRENDING_SIZE = 50
+    STREAM_QUEUE_SIZE = 100
+    STREAM_KEEPALIVE = 15
+    LONG_POLL_TIMEOUT = 25
+    METRICS_TOKEN = None
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_PRE_PING = False
+    DATABASE_REPLICA_URL = None
+    REPLICA_POOL_SIZE = 5
+    REPLICA_MAX_OVERFLOW = 10
+    REPLICA_POOL_PRE_PING = True
+    REPLICA_STICKY_SECONDS = 5.0
+    REPLICA_MAX_LAG = 5.0
+    REPLICA_LAG_CHECK_INTERVAL = 1.0
+    ASYNC_VIEWS = False
+    ASYNC_DATABASE_URL = None
+    ASYNC_DATABASE_REPLICA_URL = None
+
+
+class DevelopmentConfig(Config):
+    # edits show up without rebuilding
+    FINGERPRINT_ASSETS = False
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class TestingConfig(Config):
+    DATABASE_URL_VARIABLE = 'TEST_DATABASE_URL'
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///warbler_test'
+    SECRET_KEY = 'warbler-testing-key'
+    TESTING = True
+    FINGERPRINT_ASSETS = False
+    WTF_CSRF_ENABLED = False
+
+
+class ProductionConfig(Config):
+    SQLALCHEMY_DATABASE_URI = REQUIRED
+    SECRET_KEY = REQUIRED
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def _parse(key, value, default):
+    if default is None and key in TYPES:
+        return TYPES[key](value)
+    if isinstance(default, bool):
+        return value == '1'
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+
+    return value
+
+
+def database_url(url):
+    """`url` with the `postgres://` scheme SQLAlchemy no longer accepts fixed."""
+
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+
+    return url
+
+
+def load_config(app, config=None):
+    """Configure `app` from `config` (a class or a name) and the environment."""
+
+    if config is None:
+        config = os.environ.get('WARBLER_CONFIG', 'development')
+    if isinstance(config, str):
+        config = CONFIGS[config]
+
+    app.config.from_object(config)
+
+    for key in dir(config):
+        if key.isupper() and key in os.environ:
+            app.config[key] = _parse(key, os.environ[key],
+                                     getattr(config, key))
+
+    url = os.environ.get(config.DATABASE_URL_VARIABLE)
+    if url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url(url)
+
+    missing = [key for key, value in app.config.items() if value is REQUIRED]
+    if missing:
+        names = ['DATABASE_URL' if key == 'SQLALCHEMY_DATABASE_URI' else key
+                 for key in missing]
+        raise RuntimeError(f"{config.__name__} needs {', '.join(names)} set")
@@ -0,0 +1,141 @@
+"""Denormalized user stat counters.
+
+`User.message_count`, `follower_count`, `following_count` and `like_count`
+are kept in step with the messages, follows and likes tables by the routes
+that change them, inside the same transaction. Follows and likes of a
+deleted user stop counting as soon as they're deleted (`forget_user`), not
+when the purge gets to their rows. `reconcile_counters` rebuilds them all
+from scratch if they ever drift.
+"""
+
+from sqlalchemy import func, select, update
+
+from models import db, Follows, LikedBy, Message, User
+
+
+def adjust_counts(user_ids, **deltas):
+    """Add `deltas` (e.g. like_count=1) to the counters of `user_ids`.
+
+    `user_ids` is a single id, a list of ids or a SELECT of ids. Increments
+    happen in SQL, so concurrent requests can't lose updates.
+    """
+
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(values)
+        .execution_options(synchronize_session=False))
+
+
+def forget_message(message_id):
+    """Decrement the like counts of everyone who liked `message_id`."""
+
+    likers = select(LikedBy.user_id).where(LikedBy.message_id == message_id)
+    adjust_counts(likers, like_count=-1)
+
+
+def forget_user(user_id):
+    """Stop counting the follows and likes of `user_id`, who is deleted.
+
+    Their followers follow one fewer user, the users they follow have one
+    fewer follower, and everyone who liked their messages loses those likes.
+    """
+
+    adjust_counts(select(Follows.user_following_id)
+                  .where(Follows.user_being_followed_id == user_id),
+                  following_count=-1)
+    adjust_counts(select(Follows.user_being_followed_id)
+                  .where(Follows.user_following_id == user_id),
+                  follower_count=-1)
+
+    messages = select(Message.id).where(Message.user_id == user_id)
+    liked = (select(func.count())
+             .where(LikedBy.user_id == User.id,
+                    LikedBy.message_id.in_(messages))
+             .scalar_subquery())
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(select(LikedBy.user_id)
+                           .where(LikedBy.message_id.in_(messages))))
+        .values(like_count=User.like_count - liked)
+        .execution_options(synchronize_session=False))
+
+
+def _by_active(rows, other_user_id):
+    """`rows` limited to those whose `other_user_id` isn't deleted."""
+
+    return (rows
+            .join(User, User.id == other_user_id)
+            .where(User.deleted_at.is_(None)))
+
+
+def _recount(session, counted, counter):
+    """Set `counter` to the number of `counted` rows with the user's id.
+
+    `counted` is a SELECT of one user id per counted row. Counts are grouped
+    in one pass over it rather than looked up user by user, which needs no
+    index on the counted column.
+    """
+
+    counted = counted.subquery()
+    counts = (select(counted.c[0].label('user_id'),
+                     func.count().label('n'))
+              .group_by(counted.c[0])
+              .subquery())
+
+    if session.get_bind().dialect.name != 'postgresql':
+        # SQLite can't UPDATE ... FROM here, but it builds the grouped
+        # counts once and looks them up through an automatic index
+        count = (select(counts.c.n)
+                 .where(counts.c.user_id == User.id)
+                 .scalar_subquery())
+
+        session.execute(
+            update(User)
+            .values({counter: func.coalesce(count, 0)})
+            .execution_options(synchronize_session=False))
+        return
+
+    session.execute(
+        update(User)
+        .where(User.id == counts.c.user_id, counter != counts.c.n)
+        .values({counter: counts.c.n})
+        .execution_options(synchronize_session=False))
+
+    session.execute(
+        update(User)
+        .where(counter != 0, User.id.not_in(select(counts.c.user_id)))
+        .values({counter: 0})
+        .execution_options(synchronize_session=False))
+
+
+def reconcile_counters(session=None):
+    """Recompute every user's counters from the rows they count.
+
+    Follows and likes of deleted users aren't counted (see `forget_user`).
+    Runs in `session` (default: `db.session`); the caller commits.
+    """
+
+    session = session or db.session
+
+    _recount(session, select(Message.user_id), User.message_count)
+    _recount(session,
+             _by_active(select(Follows.user_being_followed_id),
+                        Follows.user_following_id),
+             User.follower_count)
+    _recount(session,
+             _by_active(select(Follows.user_following_id),
+                        Follows.user_being_followed_id),
+             User.following_count)
+    _recount(session,
+             _by_active(select(LikedBy.user_id)
+                        .join(Message, Message.id == LikedBy.message_id),
+                        Message.user_id),
+             User.like_count)
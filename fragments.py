@@ -0,0 +1,192 @@
+"""Cached HTML fragments for message list items.
+
+The body of each message `<li>` (author avatar and name, timestamp, text) is
+the same for every viewer, so it's rendered from `messages/item.html` once
+and cached. Templates get all of a page's fragments at once:
+
+    {% set fragments = message_fragments(messages) %}
+    ...
+    <li>{{ fragments[msg.id] }} ...like button... </li>
+
+The viewer-specific like button is rendered around it as usual.
+
+Entries are keyed by message id and stamped with the author's profile
+version (a digest of the username and image_url the fragment shows), so a
+fragment rendered before a profile edit is never served after it. Entries
+are also dropped when a message or its author is deleted or the author's
+profile changes.
+
+Fragments live in an in-process LRU (`FRAGMENT_CACHE_SIZE` entries) unless
+`FRAGMENT_CACHE_URL` points at a shared Redis, which needs the optional
+`redis` package.
+"""
+
+import hashlib
+from threading import Lock
+
+from flask import current_app
+from markupsafe import Markup
+
+from cache import LRUCache
+from models import db, Message
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+DEFAULT_CACHE_SIZE = 50000
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+TEMPLATE = 'messages/item.html'
+
+_backend = None
+_backend_lock = Lock()
+_stats = dict(hits=0, misses=0)
+
+
+class LRUBackend:
+    """Fragments in this process's memory."""
+
+    def __init__(self, maxsize):
+        self.cache = LRUCache(maxsize)
+
+    def get_many(self, keys):
+        return [self.cache.get(key) for key in keys]
+
+    def set_many(self, items):
+        for key, value in items.items():
+            self.cache.set(key, value)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.cache.delete(key)
+
+    def stats(self):
+        return dict(size=len(self.cache), maxsize=self.cache.maxsize)
+
+
+class RedisBackend:
+    """Fragments in Redis, shared by every process; one round trip a page."""
+
+    def __init__(self, url, ttl=DEFAULT_CACHE_TTL):
+        if redis is None:
+            raise RuntimeError("FRAGMENT_CACHE_URL needs the redis package")
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        return self.client.mget(keys) if keys else []
+
+    def set_many(self, items):
+        pipeline = self.client.pipeline(transaction=False)
+
+        for key, value in items.items():
+            pipeline.set(key, value, ex=self.ttl)
+
+        pipeline.execute()
+
+    def delete_many(self, keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return dict(size=self.client.dbsize())
+
+
+def _get_backend():
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            config = current_app.config
+            url = config.get('FRAGMENT_CACHE_URL')
+
+            if url:
+                _backend = RedisBackend(
+                    url, config.get('FRAGMENT_CACHE_TTL', DEFAULT_CACHE_TTL))
+            else:
+                _backend = LRUBackend(
+                    config.get('FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+    return _backend
+
+
+def _key(message_id):
+    return f'fragment:message:{message_id}'
+
+
+def author_version(user):
+    """Digest of the profile fields a message fragment shows."""
+
+    profile = f'{user.username}\0{user.image_url}'
+    return hashlib.sha1(profile.encode()).hexdigest()[:16]
+
+
+def message_fragments(messages):
+    """Return {message id: rendered fragment} for `messages`."""
+
+    backend = _get_backend()
+    cached = backend.get_many([_key(msg.id) for msg in messages])
+    template = current_app.jinja_env.get_template(TEMPLATE)
+
+    fragments = {}
+    rendered = {}
+
+    for msg, entry in zip(messages, cached):
+        # the timestamp guards against ids reused after out-of-band deletes
+        version = f'{author_version(msg.user)}:{msg.timestamp.isoformat()}'
+
+        if entry is not None:
+            entry_version, _, html = entry.partition('\n')
+
+            if entry_version == version:
+                fragments[msg.id] = Markup(html)
+                continue
+
+        html = template.render(message=msg)
+        fragments[msg.id] = Markup(html)
+        rendered[_key(msg.id)] = f'{version}\n{html}'
+
+    with _backend_lock:
+        _stats['hits'] += len(fragments) - len(rendered)
+        _stats['misses'] += len(rendered)
+
+    if rendered:
+        backend.set_many(rendered)
+
+    return fragments
+
+
+def forget_messages(message_ids):
+    """Drop the cached fragments of `message_ids`."""
+
+    _get_backend().delete_many([_key(message_id)
+                                for message_id in message_ids])
+
+
+def forget_author(user_id):
+    """Drop the cached fragments of every message by `user_id`.
+
+    Call this after their profile changes, or before deleting them.
+    """
+
+    message_ids = [message_id for (message_id,) in
+                   db.session.query(Message.id).filter(Message.user_id == user_id)]
+    forget_messages(message_ids)
+
+
+def fragment_stats():
+    """Hit/miss counts of this process, and the backend's size."""
+
+    with _backend_lock:
+        stats = dict(_stats)
+
+    return dict(stats, **_get_backend().stats())
+
+
+def init_fragments(app):
+    """Make `message_fragments` available to templates."""
+
+    app.add_template_global(message_fragments)
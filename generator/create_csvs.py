@@ -2,15 +2,29 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 100000000 \\
+        --follows 50000000 --likes 20000000 --celebrities 100
+
+Everything is generated offline from `--seed`, so the same arguments always
+give the same files. Rows are streamed straight to disk and nothing grows
+with the number of rows, so memory use stays flat at any size.
+
+Follows and likes follow a power law (`--follow-skew`, `--like-skew`): a few
+accounts and messages get most of the attention. `--celebrities` picks that
+many top accounts to also receive a `--celebrity-share` of all follows.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import sys
+from datetime import datetime
+from random import Random
+
+from helpers import (MessageAuthors, Scatter, get_random_datetime,
+                     power_law_index)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -19,71 +33,278 @@ MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 LIKED_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-NUM_LIKES = 3
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+# timestamps end here by default, so output doesn't depend on today's date
+DEFAULT_END = datetime(2022, 1, 1)
 
-# Generate random profile image URLs to use for users
+PROGRESS_EVERY = 1000000
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+HEADER_IMAGE_URLS = [
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{name}_1280.jpg"
+    for name in [
+        'mnh0n9pHJW1st5lhmo1', 'mnh0uemhCk1st5lhmo1', 'mnh121HEWa1st5lhmo1',
+        'mnh17lfd9R1st5lhmo1', 'mnh1d7s3UD1st5lhmo1', 'mnh1jdFvHR1st5lhmo1',
+        'mnh1uhYnog1st5lhmo1', 'mnh25vNOvI1st5lhmo1', 'mnh29fxz111st5lhmo1',
+        'mnh2m1hnS81st5lhmo1', 'mo1h6tGOZf1st5lhmo1', 'mo2wz2LTCs1st5lhmo1',
+    ]
+]
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+WORDS = """
+    able act air arm art back ball bank bed bird blue boat body book box
+    call car case cat city cold cook cup cut dark day deal dog door down
+    draw dream east easy egg end eye face fact fall farm fast fire fish
+    fly food foot form free fun game gift girl gold good green ground
+    group grow hair half hand hard head heat help high hill home hope
+    horse hot hour house idea iron job join jump keep key kind king lake
+    land late law lead leaf left life light line list long look love low
+    main make map mark meal meet milk mind moon most move name near new
+    news nice night north note ocean old open page park part past path
+    plan play point pool post quick quiet rain read real red rest rich
+    ride ring river road rock room rose run safe salt sand save sea seat
+    seed ship shop show side sign sing site size sky slow snow soft song
+    sort south space spot star stay step stone story sun table talk tea
+    team test time tiny top town tree trip true turn unit vast view
+    voice wait walk wall warm watch water wave way week west wide wild
+    wind wine wise wood word work world year yellow young zone
+""".split()
+
+DOMAINS = ['example.com', 'example.net', 'example.org', 'mail.test']
+
+CITIES = [
+    'Austin', 'Berlin', 'Boston', 'Cairo', 'Chicago', 'Denver', 'Dublin',
+    'Lagos', 'Lima', 'Lisbon', 'London', 'Madrid', 'Mumbai', 'Nairobi',
+    'Oakland', 'Osaka', 'Oslo', 'Paris', 'Portland', 'Quito', 'Rome',
+    'Seattle', 'Seoul', 'Sydney', 'Tokyo', 'Toronto', 'Vienna', 'Warsaw',
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
-
-with open('generator/liked_by.csv', 'w') as users_csv:
-    likes_writer = csv.DictWriter(users_csv, fieldnames=LIKED_CSV_HEADERS)
-    likes_writer.writeheader()
-
-    for i in range(NUM_LIKES):
-        likes_writer.writerow(dict(
-            user_id=fake.user_id(),
-            message_id=fake.message_id(),
-        ))
+
+def sentence(rng, min_words=4, max_words=12):
+    """A random sentence of nonsense words."""
+
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, max_length=MAX_WARBLER_LENGTH):
+    """A few random sentences, cut to `max_length` characters."""
+
+    text = ' '.join(sentence(rng) for _ in range(rng.randint(1, 4)))
+    return text[:max_length]
+
+
+def spread(total, buckets, i):
+    """How many of `total` items bucket `i` of `buckets` gets, as evenly as possible."""
+
+    base, extra = divmod(total, buckets)
+    return base + (1 if i < extra else 0)
+
+
+def pick_distinct(rng, count, n, draw, exclude=None):
+    """Return up to `count` distinct ids in 1..n from `draw()`, never those
+    `exclude(id)` is true for.
+
+    Heavily skewed draws keep hitting the same few ids, so after a while the
+    rest are filled in by walking from a random starting id.
+    """
+
+    if not n:
+        return set()
+
+    count = min(count, n)
+    picked = set()
+    attempts = 0
+
+    while len(picked) < count and attempts < count * 20:
+        choice = draw()
+        if not (exclude and exclude(choice)):
+            picked.add(choice)
+        attempts += 1
+
+    choice = rng.randrange(n)
+    for _ in range(n):
+        if len(picked) >= count:
+            break
+
+        choice = choice % n + 1
+        if not (exclude and exclude(choice)):
+            picked.add(choice)
+
+    return picked
+
+
+def progress(label, done):
+    if done % PROGRESS_EVERY == 0:
+        print(f"  {label}: {done:,}", file=sys.stderr)
+
+
+def write_users(path, args, rng):
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.writer(users_csv)
+        users_writer.writerow(USERS_CSV_HEADERS)
+
+        for i in range(1, args.users + 1):
+            username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}"
+            users_writer.writerow([
+                f"{username}@{rng.choice(DOMAINS)}",
+                username,
+                rng.choice(IMAGE_URLS),
+                PASSWORD,
+                sentence(rng),
+                rng.choice(HEADER_IMAGE_URLS),
+                rng.choice(CITIES),
+            ])
+            progress('users', i)
+
+
+def message_authors(args):
+    """The author of each message id; messages and likes need the same."""
+
+    return MessageAuthors(Random(f"{args.seed}:authors"), args.users,
+                          args.messages, args.message_skew)
+
+
+def write_messages(path, args, rng):
+    authors = message_authors(args)
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.writer(messages_csv)
+        messages_writer.writerow(MESSAGES_CSV_HEADERS)
+
+        for i in range(1, args.messages + 1):
+            messages_writer.writerow([
+                paragraph(rng),
+                get_random_datetime(args.years, rng=rng, end=args.end),
+                authors(i),
+            ])
+            progress('messages', i)
+
+
+def write_follows(path, args, rng):
+    """Each user follows about follows/users others.
+
+    Who they follow is drawn from a power law over a shuffled ranking of
+    users, so follower counts have a long tail; the top `celebrities` ranks
+    also get `celebrity_share` of all follows between them.
+    """
+
+    ranking = Scatter(rng, args.users)
+    celebrities = min(args.celebrities, args.users)
+
+    def draw():
+        if celebrities and rng.random() < args.celebrity_share:
+            return ranking(rng.randrange(celebrities))
+
+        return ranking(power_law_index(rng, args.users, args.follow_skew))
+
+    written = 0
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.writer(follows_csv)
+        follows_writer.writerow(FOLLOWS_CSV_HEADERS)
+
+        for follower in range(1, args.users + 1):
+            count = min(spread(args.follows, args.users, follower - 1),
+                        args.users - 1)
+
+            for followed in sorted(pick_distinct(
+                    rng, count, args.users, draw,
+                    exclude=lambda followed: followed == follower)):
+                follows_writer.writerow([followed, follower])
+                written += 1
+                progress('follows', written)
+
+
+def write_likes(path, args, rng):
+    """Each user likes about likes/users messages, popular ones most, but
+    never their own (the app doesn't allow it)."""
+
+    likes = args.likes if args.messages else 0
+    ranking = Scatter(rng, args.messages) if args.messages else None
+    authors = message_authors(args) if args.messages else None
+
+    def draw():
+        return ranking(power_law_index(rng, args.messages, args.like_skew))
+
+    written = 0
+
+    with open(path, 'w', newline='') as likes_csv:
+        likes_writer = csv.writer(likes_csv)
+        likes_writer.writerow(LIKED_CSV_HEADERS)
+
+        for user_id in range(1, args.users + 1):
+            count = spread(likes, args.users, user_id - 1)
+
+            def own(message_id):
+                return authors(message_id) == user_id
+
+            for message_id in sorted(pick_distinct(rng, count, args.messages,
+                                                   draw, exclude=own)):
+                likes_writer.writerow([user_id, message_id])
+                written += 1
+                progress('likes', written)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler seed data as CSV files.")
+
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000,
+                        help="total follows (each user follows about "
+                             "follows/users others)")
+    parser.add_argument('--likes', type=int, default=3000,
+                        help="total likes (each user likes about "
+                             "likes/users messages)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed; the same seed gives the same files")
+    parser.add_argument('--follow-skew', type=float, default=1.0,
+                        help="power-law exponent for who gets followed "
+                             "(0 is uniform)")
+    parser.add_argument('--message-skew', type=float, default=0.5,
+                        help="power-law exponent for who posts messages")
+    parser.add_argument('--like-skew', type=float, default=1.0,
+                        help="power-law exponent for which messages get liked")
+    parser.add_argument('--celebrities', type=int, default=0,
+                        help="number of celebrity accounts")
+    parser.add_argument('--celebrity-share', type=float, default=0.2,
+                        help="fraction of all follows that go to celebrities")
+    parser.add_argument('--years', type=int, default=2,
+                        help="messages are spread over this many years")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=DEFAULT_END,
+                        help="latest message timestamp (ISO format)")
+    parser.add_argument('--out', default=os.path.dirname(__file__) or '.',
+                        help="directory to write the CSV files to")
+
+    args = parser.parse_args(argv)
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # each file gets its own stream, so changing one count doesn't
+    # reshuffle the others
+    for name, write in [('users.csv', write_users),
+                        ('messages.csv', write_messages),
+                        ('follows.csv', write_follows),
+                        ('liked_by.csv', write_likes)]:
+        print(f"Writing {name}", file=sys.stderr)
+        write(os.path.join(args.out, name), args, Random(f"{args.seed}:{name}"))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,83 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from math import gcd
 from random import uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=None, end=None):
+    """Get a random datetime within the last few years.
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    Pass a seeded `rng` and a fixed `end` for reproducible output.
+    """
 
-    return datetime.fromtimestamp(random_timestamp)
+    random_uniform = rng.uniform if rng else uniform
+    end = end or datetime.now()
+    start = end - timedelta(days=365 * year_gap)
+    random_seconds = random_uniform(0, (end - start).total_seconds())
+
+    return start + timedelta(seconds=random_seconds)
+
+
+def power_law_index(rng, n, skew):
+    """Draw an index in 0..n-1 where P(k) falls off like 1 / (k + 1) ** skew.
+
+    Uses the inverse CDF of a continuous power law, so it needs no tables
+    however large `n` is. A skew of 0 is uniform.
+    """
+
+    return power_law_quantile(rng.random(), n, skew)
+
+
+def power_law_quantile(u, n, skew):
+    """The index in 0..n-1 at quantile `u` of `power_law_index`'s draws."""
+
+    if skew == 0:
+        x = u * n + 1
+    elif skew == 1:
+        x = (n + 1) ** u
+    else:
+        x = (((n + 1) ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+
+    return min(int(x) - 1, n - 1)
+
+
+class Scatter:
+    """A seeded bijection from ranks 0..n-1 to ids 1..n, in O(1) memory.
+
+    Used so the most popular ranks land on random-looking user ids rather
+    than on ids 1, 2, 3...
+    """
+
+    def __init__(self, rng, n):
+        self.n = n
+        self.step = 1
+        self.offset = rng.randrange(n)
+
+        if n > 2:
+            self.step = rng.randrange(2, n)
+            while gcd(self.step, n) != 1:
+                self.step = rng.randrange(2, n)
+
+    def __call__(self, rank):
+        return (rank * self.step + self.offset) % self.n + 1
+
+
+class MessageAuthors:
+    """Which user wrote each message, for any message id, in O(1) memory.
+
+    Message ids are scattered over evenly spaced quantiles of a power law
+    over a shuffled ranking of users, so the likes can look up a message's
+    author without keeping the messages around.
+    """
+
+    def __init__(self, rng, users, messages, skew):
+        self.users = users
+        self.messages = messages
+        self.skew = skew
+        self.ranking = Scatter(rng, users)
+        self.quantiles = Scatter(rng, messages)
+
+    def __call__(self, message_id):
+        u = (self.quantiles(message_id - 1) - 0.5) / self.messages
+        return self.ranking(power_law_quantile(u, self.users, self.skew))
@@ -0,0 +1,24 @@
+"""gunicorn settings for Warbler.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is built once in the master and forked into the workers
+(`preload_app`), so a worker is up as soon as it's forked. Nothing in the
+master holds database connections, and each worker drops any pooled
+connections it inherited (see `models.dispose_engines`).
+"""
+
+import os
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+
+def post_worker_init(worker):
+    """Report the worker's startup times, e.g. against the budget."""
+
+    import startup
+
+    startup.worker_ready(worker.wsgi, worker.log)
@@ -0,0 +1,313 @@
+"""Durable background jobs, kept in the `jobs` table.
+
+Work a request doesn't need to wait for is written as a job function and
+queued from the request:
+
+    @job
+    def fan_out_message(message_id):
+        ...
+
+    enqueue(fan_out_message, message_id=msg.id)
+    db.session.commit()
+
+`enqueue` only adds a row to the caller's transaction, so the job exists if
+and only if the request's own changes are committed. Arguments must be JSON
+serializable; pass ids, not ORM objects.
+
+`flask jobs-worker` runs a pool of worker threads, separate from the web
+processes. A worker claims the oldest due job with `SELECT ... FOR UPDATE
+SKIP LOCKED` on PostgreSQL, so workers never wait on each other; SQLite has
+no row locks, so there claims are serialized by a lock and a conditional
+UPDATE. The claim is a lease: if a worker dies, its job is claimed again
+once `JOB_LOCK_TIMEOUT` seconds have passed.
+
+A job's changes and the deletion of its row are committed together, and
+only if the worker still holds the lease; if it has been claimed by another
+worker meanwhile, the changes are rolled back. A job that commits as it
+goes, like a purge, must be safe to run again from where it stopped, and
+calls `renew_lease()` in each of its transactions: that keeps the lease
+from expiring, and raises `LeaseLost` (rolling the transaction back)
+instead of committing work another worker has taken over.
+
+A job that raises is rolled back and retried after `JOB_BACKOFF` seconds,
+doubling each time, until it has been tried `JOB_MAX_ATTEMPTS` times; it's then kept
+with its last error and `failed_at` set.
+
+Periodic jobs queue their own next run before they finish; `ensure_queued`
+starts them off when the workers start.
+
+Tests run the queued jobs in-line with `work_off()`.
+"""
+
+import logging
+import os
+import signal
+import socket
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread, local
+
+from flask import current_app
+from sqlalchemy import delete, or_, update
+
+from models import db, Job
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 10
+DEFAULT_LOCK_TIMEOUT = 600
+
+# how much of a failed job's error to keep
+MAX_ERROR_LENGTH = 2000
+
+logger = logging.getLogger('warbler.jobs')
+
+_registry = {}
+_sqlite_claim_lock = Lock()
+
+# the (job id, worker) of the job this thread is running
+_running = local()
+
+
+class LeaseLost(Exception):
+    """The running job's lease expired and another worker claimed it."""
+
+
+def job(func):
+    """Register `func` as a job that can be queued by name."""
+
+    if _registry.setdefault(func.__name__, func) is not func:
+        raise ValueError(f"There's already a job called {func.__name__}")
+
+    return func
+
+
+def enqueue(func, run_at=None, **kwargs):
+    """Queue `func(**kwargs)` in the current transaction; return the Job."""
+
+    if _registry.get(func.__name__) is not func:
+        raise ValueError(f"{func.__name__} isn't a registered @job")
+
+    queued = Job(name=func.__name__, args=kwargs,
+                 run_at=run_at or datetime.utcnow())
+    db.session.add(queued)
+
+    return queued
+
+
+def ensure_queued(func, **kwargs):
+    """Queue `func(**kwargs)` unless a job of that name is already waiting.
+
+    For jobs that queue their own next run, like `compact_trending`: this
+    starts them off, or restarts them after they failed.
+    """
+
+    waiting = (Job.query
+               .filter(Job.name == func.__name__, Job.failed_at.is_(None))
+               .first())
+
+    return waiting or enqueue(func, **kwargs)
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def _claimable(now):
+    """Filter for jobs that are due and not leased by a live worker."""
+
+    expired = now - timedelta(seconds=_config('JOB_LOCK_TIMEOUT',
+                                              DEFAULT_LOCK_TIMEOUT))
+
+    return (Job.failed_at.is_(None),
+            Job.run_at <= now,
+            or_(Job.locked_at.is_(None), Job.locked_at < expired))
+
+
+def _claim(worker):
+    """Lease the next due job to `worker`; return it, or None."""
+
+    now = datetime.utcnow()
+    claimable = _claimable(now)
+
+    query = (Job.query
+             .filter(*claimable)
+             .order_by(Job.run_at, Job.id)
+             .limit(1))
+
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+        lock = nullcontext()
+    else:
+        lock = _sqlite_claim_lock
+
+    with lock:
+        claimed = query.first()
+
+        if claimed is None:
+            db.session.rollback()
+            return None
+
+        # conditional, so that two processes sharing a SQLite file can't
+        # both lease the same job
+        leased = db.session.execute(
+            update(Job)
+            .where(Job.id == claimed.id, *claimable)
+            .values(locked_by=worker, locked_at=now,
+                    attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+
+    return claimed if leased.rowcount else None
+
+
+def renew_lease():
+    """Extend the running job's lease, in the current transaction.
+
+    Raises `LeaseLost` if another worker has claimed the job. Outside a job
+    it does nothing.
+    """
+
+    lease = getattr(_running, 'lease', None)
+    if lease is None:
+        return
+
+    job_id, worker = lease
+    renewed = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker)
+        .values(locked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False))
+
+    if not renewed.rowcount:
+        raise LeaseLost(f"job {job_id} was claimed by another worker")
+
+
+def _failed(job_id, worker, attempts, error):
+    """Schedule a retry of a job that raised `error`, or give up on it."""
+
+    now = datetime.utcnow()
+    values = dict(locked_by=None, locked_at=None,
+                  last_error=repr(error)[:MAX_ERROR_LENGTH])
+
+    if attempts >= _config('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        values['failed_at'] = now
+    else:
+        backoff = _config('JOB_BACKOFF', DEFAULT_BACKOFF)
+        values['run_at'] = now + timedelta(seconds=backoff * 2 **
+                                           (attempts - 1))
+
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker)
+        .values(values)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def work_one(worker):
+    """Claim and run one due job; return False if there was none."""
+
+    claimed = _claim(worker)
+    if claimed is None:
+        return False
+
+    job_id, name, args, attempts = (claimed.id, claimed.name, claimed.args,
+                                    claimed.attempts)
+
+    _running.lease = (job_id, worker)
+    try:
+        func = _registry.get(name)
+        if func is None:
+            raise LookupError(f"No job called {name}")
+
+        func(**args)
+
+        finished = db.session.execute(
+            delete(Job)
+            .where(Job.id == job_id, Job.locked_by == worker)
+            .execution_options(synchronize_session=False))
+        if not finished.rowcount:
+            raise LeaseLost(f"job {job_id} was claimed by another worker")
+        db.session.commit()
+
+    except LeaseLost:
+        # the job is the other worker's now, to finish or retry
+        db.session.rollback()
+        logger.warning("job %s %s(%s) lost its lease", job_id, name, args)
+
+    except Exception as error:
+        db.session.rollback()
+        logger.exception("job %s %s(%s) failed on attempt %s",
+                         job_id, name, args, attempts)
+        _failed(job_id, worker, attempts, error)
+
+    finally:
+        _running.lease = None
+
+    return True
+
+
+def _worker_name(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def work_off(max_jobs=None):
+    """Run due jobs in this thread until there are none; return how many ran.
+
+    For tests and maintenance scripts.
+    """
+
+    worker = _worker_name()
+    count = 0
+
+    while max_jobs is None or count < max_jobs:
+        if not work_one(worker):
+            break
+        count += 1
+
+    return count
+
+
+def run_workers(app, threads=1, interval=1.0):
+    """Run `threads` worker threads until interrupted or terminated.
+
+    Idle workers look for new jobs every `interval` seconds.
+    """
+
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    def work(index):
+        worker = _worker_name(index)
+
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    busy = work_one(worker)
+                except Exception:
+                    # e.g. the database went away; back off and try again
+                    logger.exception("worker %s couldn't claim a job", worker)
+                    db.session.rollback()
+                    busy = False
+
+                if not busy:
+                    stop.wait(interval)
+
+            db.session.remove()
+
+    pool = [Thread(target=work, args=(index,), name=f'jobs-worker-{index}')
+            for index in range(threads)]
+
+    for thread in pool:
+        thread.start()
+
+    try:
+        while any(thread.is_alive() for thread in pool):
+            stop.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # running jobs are finished first
+        stop.set()
+        for thread in pool:
+            thread.join()
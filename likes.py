@@ -0,0 +1,196 @@
+"""Liking and unliking messages.
+
+Likes are idempotent: liking twice or unliking something that isn't liked
+changes nothing and reports so, instead of failing on the likes primary key.
+A user can't like their own messages, nor messages that don't exist.
+Messages by deleted users can't be liked or unliked either: their likes
+stopped counting when the account was deleted (see purge.py), and liking or
+unliking locks the author's row (FOR SHARE) so that can't happen mid-like.
+
+On PostgreSQL a like or unlike is a single statement: the INSERT ... ON
+CONFLICT DO NOTHING (or DELETE) of the like runs in a CTE, and the UPDATE of
+the user's like_count and the message's trending score (see `trending`)
+only happen if a row actually changed. The user's row is locked for that one
+statement, not for a read-modify-write round trip. These are written out as
+SQL because SQLAlchemy 1.4 can't cache the compiled form of an ON CONFLICT
+insert, and compiling it costs more than running it. SQLite has no
+data-modifying CTEs, so there a like is a few statements, as in `set_likes`.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from counters import adjust_counts
+from models import db, LikedBy, Message, User
+from trending import add_likes, half_life, remove_likes
+
+
+LIKE_POSTGRESQL = text("""
+    WITH liked AS (
+        INSERT INTO likes (user_id, message_id, liked_at)
+        SELECT :user_id, messages.id, :now
+        FROM messages JOIN users ON users.id = messages.user_id
+        WHERE messages.id = :message_id AND messages.user_id != :user_id
+            AND users.deleted_at IS NULL
+        FOR SHARE OF users
+        ON CONFLICT DO NOTHING
+        RETURNING user_id, message_id, liked_at),
+    counted AS (
+        UPDATE users SET like_count = like_count + 1, updated_at = :now
+        WHERE id IN (SELECT user_id FROM liked)),
+    scored AS (
+        INSERT INTO trending_scores (message_id, score)
+        SELECT message_id,
+               power(2, extract(epoch FROM liked_at - epoch) / :half_life)
+        FROM liked, trending_epoch
+        ON CONFLICT (message_id)
+        DO UPDATE SET score = trending_scores.score + excluded.score)
+    SELECT count(*) FROM liked
+""")
+
+UNLIKE_POSTGRESQL = text("""
+    WITH unliked AS (
+        DELETE FROM likes
+        WHERE user_id = :user_id AND message_id IN (
+            SELECT messages.id
+            FROM messages JOIN users ON users.id = messages.user_id
+            WHERE messages.id = :message_id AND users.deleted_at IS NULL
+            FOR SHARE OF users)
+        RETURNING user_id, message_id, liked_at),
+    counted AS (
+        UPDATE users SET like_count = like_count - 1, updated_at = :now
+        WHERE id IN (SELECT user_id FROM unliked)),
+    scored AS (
+        UPDATE trending_scores
+        SET score = greatest(score - power(
+            2, extract(epoch FROM liked_at - epoch) / :half_life), 0)
+        FROM unliked, trending_epoch
+        WHERE trending_scores.message_id = unliked.message_id)
+    SELECT count(*) FROM unliked
+""")
+
+
+def _postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _likeable(message_ids):
+    """SELECT of those of `message_ids` whose authors aren't deleted, locking
+    the authors' rows until commit."""
+
+    return (select(Message.id)
+            .join(User, User.id == Message.user_id)
+            .where(Message.id.in_(message_ids), User.deleted_at.is_(None))
+            .with_for_update(read=True, of=User))
+
+
+def _insert_likes(user_id, message_ids, now):
+    """INSERT of `user_id`'s likes of `message_ids`, skipping existing ones."""
+
+    insert = postgresql.insert if _postgresql() else sqlite.insert
+    likeable = (select(literal(user_id, db.Integer), Message.id,
+                       literal(now, db.DateTime))
+                .where(Message.id.in_(_likeable(message_ids)),
+                       Message.user_id != user_id))
+
+    return (insert(LikedBy)
+            .from_select(['user_id', 'message_id', 'liked_at'], likeable)
+            .on_conflict_do_nothing())
+
+
+def _delete_likes(user_id, message_ids):
+    return (delete(LikedBy)
+            .where(LikedBy.user_id == user_id,
+                   LikedBy.message_id.in_(_likeable(message_ids)))
+            .execution_options(synchronize_session=False))
+
+
+def _change_one(sql, user_id, message_id):
+    """Run a like or unlike `sql` on PostgreSQL; did it change anything?"""
+
+    changed = db.session.execute(sql, dict(user_id=user_id,
+                                           message_id=message_id,
+                                           now=datetime.utcnow(),
+                                           half_life=half_life()))
+    return changed.scalar() > 0
+
+
+def like(user_id, message_id):
+    """Make `user_id` like `message_id`; return whether anything changed.
+
+    Runs in the caller's transaction.
+    """
+
+    if _postgresql():
+        return _change_one(LIKE_POSTGRESQL, user_id, message_id)
+
+    newly_liked, _ = set_likes(user_id, liked=[message_id])
+    return bool(newly_liked)
+
+
+def unlike(user_id, message_id):
+    """Make `user_id` stop liking `message_id`; return whether it had."""
+
+    if _postgresql():
+        return _change_one(UNLIKE_POSTGRESQL, user_id, message_id)
+
+    _, newly_unliked = set_likes(user_id, unliked=[message_id])
+    return bool(newly_unliked)
+
+
+def _changed_rows(statement, before, *columns):
+    """Run a likes `statement`, returning `columns` of the likes it changed.
+
+    `before` is a SELECT of those columns of the likes it will change, used
+    where there's no RETURNING.
+    """
+
+    if _postgresql():
+        return db.session.execute(statement.returning(*columns)).all()
+
+    rows = db.session.execute(before).all()
+    if rows:
+        db.session.execute(statement)
+
+    return rows
+
+
+def set_likes(user_id, liked=(), unliked=()):
+    """Like the messages `liked` and unlike `unliked`, all at once.
+
+    Runs in the caller's transaction. Returns the lists of message ids that
+    became liked and unliked.
+    """
+
+    now = datetime.utcnow()
+    newly_liked = newly_unliked = []
+
+    if liked:
+        existing = (select(LikedBy.message_id)
+                    .where(LikedBy.user_id == user_id,
+                           LikedBy.message_id.in_(liked)))
+        new = (select(Message.id)
+               .where(Message.id.in_(_likeable(liked)),
+                      Message.user_id != user_id,
+                      Message.id.not_in(existing)))
+        rows = _changed_rows(_insert_likes(user_id, liked, now), new,
+                             LikedBy.message_id)
+        newly_liked = [message_id for message_id, in rows]
+        add_likes(newly_liked, now)
+
+    if unliked:
+        existing = (select(LikedBy.message_id, LikedBy.liked_at)
+                    .where(LikedBy.user_id == user_id,
+                           LikedBy.message_id.in_(_likeable(unliked))))
+        rows = _changed_rows(_delete_likes(user_id, unliked), existing,
+                             LikedBy.message_id, LikedBy.liked_at)
+        newly_unliked = [message_id for message_id, _ in rows]
+        remove_likes(rows)
+
+    delta = len(newly_liked) - len(newly_unliked)
+    if delta:
+        adjust_counts(user_id, like_count=delta)
+
+    return newly_liked, newly_unliked
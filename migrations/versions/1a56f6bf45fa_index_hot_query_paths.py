@@ -0,0 +1,38 @@
+"""Index hot query paths
+
+Revision ID: 1a56f6bf45fa
+Revises: d785cdeb1290
+Create Date: 2026-10-18 07:20:05.722275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a56f6bf45fa'
+down_revision = 'd785cdeb1290'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built CONCURRENTLY on PostgreSQL so big tables stay writable; that
+    # can't run inside the migration's transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_follows_user_following_id', 'follows',
+                        ['user_following_id'], unique=False,
+                        if_not_exists=True, postgresql_concurrently=True)
+        op.create_index('ix_likes_message_id', 'likes', ['message_id'],
+                        unique=False,
+                        if_not_exists=True, postgresql_concurrently=True)
+        op.create_index('ix_messages_user_timestamp', 'messages',
+                        ['user_id', sa.text('timestamp DESC'),
+                         sa.text('id DESC')], unique=False,
+                        if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_messages_user_timestamp', table_name='messages')
+    op.drop_index('ix_likes_message_id', table_name='likes')
+    op.drop_index('ix_follows_user_following_id', table_name='follows')
@@ -1,14 +1,44 @@
 """SQLAlchemy models for Warbler."""
 
+import os
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+from sqlalchemy.engine import make_url
 
-from flask import g
+from flask import g, has_app_context
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hash_password, check_password, needs_rehash
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends reads to a replica engine when asked to.
+
+    While `g.read_replica` holds an engine (see `replicas`), SELECTs go to
+    it, until the session writes something: from then on everything goes to
+    the primary, so a request reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = g.get('read_replica') if has_app_context() else None
+
+        if (replica is not None
+                and not self._flushing
+                and not self.info.get('wrote')
+                and getattr(clause, 'is_select', False)
+                and getattr(clause, '_for_update_arg', None) is None):
+            return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -28,6 +58,11 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key covers lookups by user_being_followed_id only
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -74,6 +109,57 @@ class User(db.Model):
         nullable=False,
     )
 
+    message_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follower_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    timeline_warm = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # bumped by every UPDATE of the row, counter changes included; pages
+    # about this user use it as their cache validator
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # set when the account is deleted; the user is hidden from then on and
+    # their rows are removed in the background by purge.py
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
 
     followers = db.relationship(
@@ -100,32 +186,76 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
-    def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+    def liked_message_ids(self, message_ids):
+        """Return the set of `message_ids` this user has liked.
+
+        One query on the likes primary key, however many likes the user has.
+        """
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        if not message_ids:
+            return set()
 
-    def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        rows = (db.session
+                .query(LikedBy.message_id)
+                .filter(LikedBy.user_id == self.id,
+                        LikedBy.message_id.in_(message_ids)))
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return {message_id for (message_id,) in rows}
 
     @classmethod
-    def like_message(cls, user_id, message_id):
-        """Like a message"""
+    def active(cls):
+        """Query of the users that haven't deleted their accounts."""
 
-        like = LikedBy(
-            user_id=user_id,
-            message_id=message_id
-        )
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def following_of(cls, user_id):
+        """Query of the users that `user_id` follows."""
+
+        return (cls
+                .active()
+                .join(Follows, Follows.user_being_followed_id == cls.id)
+                .filter(Follows.user_following_id == user_id))
+
+    @classmethod
+    def followers_of(cls, user_id):
+        """Query of the users following `user_id`."""
+
+        return (cls
+                .active()
+                .join(Follows, Follows.user_following_id == cls.id)
+                .filter(Follows.user_being_followed_id == user_id))
+
+    # ids of the users this user follows, cached by following_ids()
+    _following_ids = None
+
+    def following_ids(self):
+        """Set of ids of the users this user follows.
+
+        Loaded with one query the first time it's needed and kept on this
+        instance (so for the rest of the request); changes made through
+        `following`/`followers` reset it.
+        """
 
-        db.session.add(like)
-        db.session.commit()
+        if self._following_ids is None:
+            rows = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id))
+            self._following_ids = {user_id for (user_id,) in rows}
 
-        return like
+        return self._following_ids
 
+    def is_followed_by(self, other_user):
+        """Is this user followed by `other_user`?"""
+
+        follow = Follows.query.filter_by(user_being_followed_id=self.id,
+                                         user_following_id=other_user.id)
+        return db.session.query(follow.exists()).scalar()
+
+    def is_following(self, other_user):
+        """Is this user following `other_use`?"""
+
+        return other_user.id in self.following_ids()
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -134,7 +264,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username,
@@ -155,18 +285,44 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the hash was made with an old bcrypt cost, it's replaced with one
+        at the current cost; the caller commits it.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_password(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
                 return user
 
         return False
 
 
+# Columns shown on user cards (/users, following and followers pages).
+USER_CARD = orm.load_only(User.id, User.username, User.image_url,
+                          User.header_image_url, User.bio)
+
+
+@db.event.listens_for(User.following, 'append')
+@db.event.listens_for(User.following, 'remove')
+def reset_following_ids(user, followed_user, initiator):
+    """Forget `user`'s cached following ids when they follow/unfollow."""
+
+    user._following_ids = None
+
+
+@db.event.listens_for(User.followers, 'append')
+@db.event.listens_for(User.followers, 'remove')
+def reset_follower_following_ids(user, follower, initiator):
+    """Forget `follower`'s cached following ids when they're added/removed."""
+
+    follower._following_ids = None
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -196,6 +352,36 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # a user's messages newest first: profiles and the timeline fallback
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp',
+                 'user_id', timestamp.desc(), id.desc()),
+    )
+
+    @classmethod
+    def by_user(cls, user_id):
+        """Query of the messages written by `user_id`."""
+
+        return cls.query.filter(cls.user_id == user_id)
+
+    @classmethod
+    def author_of(cls, message_id):
+        """SELECT of the id of `message_id`'s author, for use in queries."""
+
+        return db.select(cls.user_id).where(cls.id == message_id)
+
+    @classmethod
+    def liked_by(cls, user_id):
+        """Query of the messages liked by `user_id`, whose authors aren't
+        deleted."""
+
+        return (cls
+                .query
+                .join(LikedBy, LikedBy.message_id == cls.id)
+                .join(User, User.id == cls.user_id)
+                .filter(LikedBy.user_id == user_id,
+                        User.deleted_at.is_(None)))
+
 
 class LikedBy(db.Model):
     """A warble like made by a user."""
@@ -216,12 +402,248 @@ class LikedBy(db.Model):
         primary_key=True,
     )
 
+    # when the like was made, so that an unlike can take back exactly what
+    # the like added to the message's trending score
+    liked_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline."""
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp',
+                 'user_id', timestamp.desc(), message_id.desc()),
+        db.Index('ix_timelines_user_author', 'user_id', 'author_id'),
+        db.Index('ix_timelines_message_id', 'message_id'),
+    )
+
+
+class AccountPurge(db.Model):
+    """Progress of removing a deleted account's rows."""
+
+    __tablename__ = 'account_purges'
+
+    # no foreign key: the user row is the last thing the purge deletes
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    step = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+
+class TrendingScore(db.Model):
+    """A message's time-decayed like count, kept up to date by `trending`."""
+
+    __tablename__ = 'trending_scores'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # the sum of the message's like weights, relative to TrendingEpoch.epoch
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_trending_scores_score', score.desc(), message_id.desc()),
+    )
+
+
+class TrendingEpoch(db.Model):
+    """The one row holding the time trending scores are relative to."""
+
+    __tablename__ = 'trending_epoch'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    epoch = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class Job(db.Model):
+    """A unit of background work, queued by `jobs.enqueue`."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # name of the @job function to call, and its keyword arguments
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # the worker running the job, and since when; a lease that's held too
+    # long (the worker died) can be claimed by another worker
+    locked_by = db.Column(
+        db.Text,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    # set when the job has run out of attempts; it's then left alone
+    failed_at = db.Column(
+        db.DateTime,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_due', 'run_at', 'id',
+                 postgresql_where=failed_at.is_(None),
+                 sqlite_where=failed_at.is_(None)),
+    )
+
+
+def pool_options(app, prefix, url):
+    """Engine options for `url` from the `<prefix>_POOL_*` settings."""
+
+    options = dict(pool_pre_ping=app.config.get(f'{prefix}_POOL_PRE_PING',
+                                                False))
+
+    # SQLite connections aren't pooled the same way, and take no sizes
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=app.config.get(f'{prefix}_POOL_SIZE', 5),
+            max_overflow=app.config.get(f'{prefix}_MAX_OVERFLOW', 10))
+
+    return options
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
     You should call this in your Flask app.
+
+    The primary engine is pooled per the `DATABASE_*` settings. If
+    `DATABASE_REPLICA_URL` is set, a replica engine is made too, pooled per
+    the `REPLICA_*` settings, for `replicas` to route reads to.
+
+    Pools are emptied in forked children (see `dispose_engines`).
     """
 
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update(
+        pool_options(app, 'DATABASE', app.config['SQLALCHEMY_DATABASE_URI']))
+
     db.app = app
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+
+    replica_url = app.config.get('DATABASE_REPLICA_URL')
+    app.extensions['replica_engine'] = (
+        create_engine(replica_url,
+                      **pool_options(app, 'REPLICA', replica_url))
+        if replica_url else None)
+
+    os.register_at_fork(after_in_child=lambda: dispose_engines(app))
+
+
+def dispose_engines(app):
+    """Drop the pooled connections a forked process inherited.
+
+    They belong to the parent, which may still be using them, so they're
+    let go without being closed; the child opens its own.
+    """
+
+    engines = [db.get_engine(app), app.extensions.get('replica_engine')]
+
+    for engine in engines:
+        if engine is not None:
+            engine.dispose(close=False)
@@ -0,0 +1,107 @@
+"""Keyset (cursor) pagination for Warbler's list pages.
+
+Pages are ordered newest-first on a set of key columns, e.g.
+`(Message.timestamp, Message.id)` or `(User.id,)`. The next page is requested
+with an opaque `?before=` cursor holding the keys of the last item shown, so
+every page is an index range read no matter how deep it is.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import abort, current_app
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class Page:
+    """One page of results plus the cursor for the page after it."""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size():
+    """Number of items on each page."""
+
+    return current_app.config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def encode_cursor(values):
+    """Encode key values into an opaque, URL-safe cursor."""
+
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Decode `cursor` into values for `keys`; abort 400 if it's malformed."""
+
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(keys):
+            raise ValueError(cursor)
+
+        return [datetime.fromisoformat(value)
+                if key.type.python_type is datetime else int(value)
+                for key, value in zip(keys, values)]
+
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def keyset_query(query, keys, before=None, size=None):
+    """Limit `query` to the page after cursor `before`, newest first.
+
+    Fetches one extra row so `make_page` can tell whether a next page exists.
+    """
+
+    size = size or page_size()
+
+    if before:
+        query = query.filter(tuple_(*keys) < tuple_(*decode_cursor(before, keys)))
+
+    return (query
+            .order_by(*(key.desc() for key in keys))
+            .limit(size + 1))
+
+
+def make_page(rows, attrs, size=None):
+    """Build a Page from the rows fetched by `keyset_query`.
+
+    `attrs` names the attributes on each row holding its key values.
+    """
+
+    size = size or page_size()
+    items = rows[:size]
+    next_cursor = None
+
+    if len(rows) > size:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, attr) for attr in attrs])
+
+    return Page(items, next_cursor)
+
+
+def paginate(query, keys, before=None, size=None, attrs=None):
+    """Return the Page of `query` after cursor `before`.
+
+    `keys` are the columns to order and seek on; `attrs` defaults to their
+    names and must be given when the items aren't the keys' own entity.
+    """
+
+    rows = keyset_query(query, keys, before, size).all()
+
+    return make_page(rows, attrs or [key.key for key in keys], size)
@@ -0,0 +1,129 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow: at cost 12 each hash or check burns a few
+hundred milliseconds of CPU. Running it on the request thread let a burst of
+logins starve every other page, so hashing runs on a small dedicated pool
+(`BCRYPT_WORKERS` threads; bcrypt releases the GIL while it works).
+
+At most `BCRYPT_MAX_PENDING` hashes may be queued or running. Past that, new
+requests fail fast with `AuthBusy`, which the app turns into a 503, instead
+of piling up behind the queue.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app, has_app_context
+from flask_bcrypt import Bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+
+bcrypt = Bcrypt()
+
+_executor = None
+_lock = Lock()
+_stats = dict(pending=0, completed=0, rejected=0)
+
+
+class AuthBusy(Exception):
+    """Too many password hashes are already queued."""
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+
+    return default
+
+
+def log_rounds():
+    """The bcrypt cost factor new hashes should use."""
+
+    return _config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+
+def _workers():
+    return _config('BCRYPT_WORKERS', os.cpu_count() or 1)
+
+
+def _max_pending():
+    max_pending = _config('BCRYPT_MAX_PENDING', None)
+
+    return _workers() * 4 if max_pending is None else max_pending
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_workers(),
+                                       thread_name_prefix='bcrypt')
+
+    return _executor
+
+
+def _forget_executor():
+    # a forked child doesn't get the parent's pool threads
+    global _executor
+
+    _executor = None
+    _stats['pending'] = 0
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def _finished(future):
+    with _lock:
+        _stats['pending'] -= 1
+        _stats['completed'] += 1
+
+
+def _run(fn, *args):
+    """Run `fn(*args)` on the bcrypt pool and wait for its result."""
+
+    with _lock:
+        if _stats['pending'] >= _max_pending():
+            _stats['rejected'] += 1
+            raise AuthBusy()
+
+        _stats['pending'] += 1
+        executor = _get_executor()
+
+    future = executor.submit(fn, *args)
+    future.add_done_callback(_finished)
+
+    return future.result()
+
+
+def hash_password(password):
+    """Return a bcrypt hash of `password` at the configured cost."""
+
+    pw_hash = _run(bcrypt.generate_password_hash, password, log_rounds())
+    return pw_hash.decode('UTF-8')
+
+
+def check_password(pw_hash, password):
+    """Does `password` match the stored `pw_hash`?"""
+
+    return _run(bcrypt.check_password_hash, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """Was `pw_hash` made with a different cost than we use now?"""
+
+    try:
+        rounds = int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != log_rounds()
+
+
+def stats():
+    """Pool size, queue depth and completed/rejected counts."""
+
+    with _lock:
+        return dict(_stats, workers=_workers(), max_pending=_max_pending())
+
@@ -0,0 +1,141 @@
+"""Opt-in per-request profiling for Warbler.
+
+When `PROFILE_REQUESTS` is on, every request records how many SQL statements
+it ran, the time spent in the database and in template rendering, and its
+slowest statement. These are sent back in a `Server-Timing` header (visible in
+the browser's network panel) and requests over `PROFILE_SLOW_REQUEST_MS` are
+logged as one JSON line to the `warbler.profiler` logger.
+
+When it's off nothing is hooked up at all, so it costs nothing.
+"""
+
+import json
+import logging
+from time import perf_counter
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.profiler')
+
+DEFAULT_SLOW_REQUEST_MS = 500
+
+# how much of the slowest statement to put in the slow-request log
+MAX_LOGGED_SQL = 500
+
+
+class RequestProfile:
+    """Timings collected for one request."""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_start = None
+        self.slowest_time = 0.0
+        self.slowest_sql = None
+
+    def add_query(self, statement, elapsed):
+        """Record one SQL statement that took `elapsed` seconds."""
+
+        self.queries += 1
+        self.db_time += elapsed
+
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_sql = statement
+
+    def server_timing(self, total):
+        """Format the Server-Timing header value, in milliseconds."""
+
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'tpl;dur={self.render_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+def _current_profile():
+    """The running request's profile, or None outside a profiled request."""
+
+    if has_request_context():
+        return g.get('_profile')
+
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info['profile_start'] = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = perf_counter() - conn.info['profile_start']
+    profile = _current_profile()
+
+    if profile is not None:
+        profile.add_query(statement, elapsed)
+
+
+def _start_render(sender, template, context, **extra):
+    profile = _current_profile()
+
+    if profile is not None:
+        profile.render_start = perf_counter()
+
+
+def _finish_render(sender, template, context, **extra):
+    profile = _current_profile()
+
+    if profile is not None and profile.render_start is not None:
+        profile.render_time += perf_counter() - profile.render_start
+        profile.render_start = None
+
+
+def _start_request():
+    g._profile = RequestProfile()
+
+
+def _finish_request(response):
+    profile = g.pop('_profile', None)
+
+    if profile is None:
+        return response
+
+    total = perf_counter() - profile.start
+    response.headers['Server-Timing'] = profile.server_timing(total)
+
+    slow_ms = current_app.config.get('PROFILE_SLOW_REQUEST_MS',
+                                     DEFAULT_SLOW_REQUEST_MS)
+    if total * 1000 >= slow_ms:
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(profile.db_time * 1000, 1),
+            'queries': profile.queries,
+            'render_ms': round(profile.render_time * 1000, 1),
+            'slowest_ms': round(profile.slowest_time * 1000, 1),
+            'slowest_sql': (profile.slowest_sql or '')[:MAX_LOGGED_SQL],
+        }))
+
+    return response
+
+
+def init_profiler(app):
+    """Hook request profiling into `app` if PROFILE_REQUESTS is set."""
+
+    if not app.config.get('PROFILE_REQUESTS'):
+        return
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
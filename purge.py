@@ -0,0 +1,208 @@
+"""Background removal of deleted accounts.
+
+Deleting an account in a request only marks it: `User.deleted_at` is set,
+which hides the user and their messages everywhere, their follows and likes
+stop counting in other users' counters (`forget_user`), an `AccountPurge`
+row is added to track the removal of their rows, and a `purge_account` job
+is queued. The job deletes those rows with set-based DELETEs of at most
+`PURGE_CHUNK_SIZE` rows, one short transaction per chunk, in this order:
+
+    likes of the user's messages, the user's likes, follows both ways,
+    the user's timeline, their messages, then the user
+
+Follows and likes of an active user lock that user's row (`FOR SHARE`), as
+does marking the account deleted (`FOR UPDATE`), so none can be added once
+`forget_user` has counted them. Each chunk takes the likes it deletes out of
+their messages' trending scores in the same transaction, going by the rows
+the DELETE returned rather than the ones it meant to delete. The purge row
+records the step it's on and how many rows it has deleted; an interrupted
+purge picks up at its step when the job is retried, since each step just
+deletes whatever is left of it. Each chunk renews the job's lease, and is
+rolled back if another worker has taken the job over.
+"""
+
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, select, tuple_
+
+from counters import adjust_counts, forget_user
+from fragments import forget_messages
+from jobs import enqueue, job, renew_lease
+from models import (db, AccountPurge, Follows, LikedBy, Message, TimelineEntry,
+                    User)
+from trending import remove_likes
+
+DEFAULT_CHUNK_SIZE = 1000
+
+logger = logging.getLogger('warbler.purge')
+
+
+def delete_account(user):
+    """Hide `user` from now on and queue the removal of their rows.
+
+    Runs in the caller's transaction.
+    """
+
+    user.deleted_at = datetime.utcnow()
+    # locks the user's row until commit, waiting for follows and likes of
+    # them in flight
+    db.session.flush()
+    forget_user(user.id)
+    db.session.add(AccountPurge(user_id=user.id, step=next(iter(STEPS))))
+    enqueue(purge_account, user_id=user.id)
+
+
+def _delete_chunk(model, condition, limit, *columns):
+    """Delete up to `limit` rows of `model` matching `condition`.
+
+    Returns the primary keys and `columns` of the rows this DELETE removed,
+    leaving out any someone else deleted first. SQLite has no RETURNING
+    here, so there the rows are picked first, and if the DELETE then
+    removes fewer the job fails, to be retried.
+    """
+
+    keys = list(model.__table__.primary_key.columns)
+    primary_key = tuple_(*keys)
+
+    if db.engine.dialect.name == 'postgresql':
+        chunk = select(*keys).where(condition).limit(limit)
+        return db.session.execute(
+            delete(model)
+            .where(primary_key.in_(chunk))
+            .returning(*keys, *columns)
+            .execution_options(synchronize_session=False)).all()
+
+    rows = db.session.execute(
+        select(*keys, *columns).where(condition).limit(limit)).all()
+    if not rows:
+        return rows
+
+    result = db.session.execute(
+        delete(model)
+        .where(primary_key.in_([row[:len(keys)] for row in rows]))
+        .execution_options(synchronize_session=False))
+    if result.rowcount != len(rows):
+        raise RuntimeError(f"{model.__tablename__} rows went while purging")
+
+    return rows
+
+
+def _delete_likes(condition, limit):
+    likes = _delete_chunk(LikedBy, condition, limit, LikedBy.liked_at)
+    remove_likes([(message_id, liked_at) for _, message_id, liked_at in likes])
+
+    return len(likes)
+
+
+def _delete_follows(condition, limit):
+    return len(_delete_chunk(Follows, condition, limit))
+
+
+def _delete_timeline_entries(condition, limit):
+    return len(_delete_chunk(TimelineEntry, condition, limit))
+
+
+def _likes_received(user_id, limit):
+    messages = select(Message.id).where(Message.user_id == user_id)
+    return _delete_likes(LikedBy.message_id.in_(messages), limit)
+
+
+def _likes_given(user_id, limit):
+    return _delete_likes(LikedBy.user_id == user_id, limit)
+
+
+def _following(user_id, limit):
+    return _delete_follows(Follows.user_following_id == user_id, limit)
+
+
+def _followers(user_id, limit):
+    return _delete_follows(Follows.user_being_followed_id == user_id, limit)
+
+
+def _timeline(user_id, limit):
+    return _delete_timeline_entries(TimelineEntry.user_id == user_id, limit)
+
+
+def _messages(user_id, limit):
+    message_ids = db.session.scalars(
+        select(Message.id)
+        .where(Message.user_id == user_id)
+        .order_by(Message.id)
+        .limit(limit)).all()
+
+    if not message_ids:
+        return 0
+
+    # a popular message is on many timelines, so its entries go first, a
+    # chunk at a time; any likes left go too
+    in_chunk = TimelineEntry.message_id.in_(message_ids)
+    deleted = (_delete_timeline_entries(in_chunk, limit)
+               or _delete_likes(LikedBy.message_id.in_(message_ids), limit))
+    if deleted:
+        return deleted
+
+    deleted = db.session.execute(
+        delete(Message)
+        .where(Message.id.in_(message_ids))
+        .execution_options(synchronize_session=False)).rowcount
+    adjust_counts(user_id, message_count=-deleted)
+    forget_messages(message_ids)
+
+    return deleted
+
+
+def _user(user_id, limit):
+    result = db.session.execute(
+        delete(User)
+        .where(User.id == user_id)
+        .execution_options(synchronize_session=False))
+
+    return result.rowcount
+
+
+# step name -> function deleting one chunk of it, returning the rows deleted
+STEPS = {
+    'likes_received': _likes_received,
+    'likes_given': _likes_given,
+    'following': _following,
+    'followers': _followers,
+    'timeline': _timeline,
+    'messages': _messages,
+    'user': _user,
+}
+
+
+@job
+def purge_account(user_id, chunk_size=None):
+    """Delete the rows of a deleted account, resuming where it stopped.
+
+    Each chunk locks the purge row first, so two runs for the same account
+    (say, one whose lease expired and its retry) take turns, each picking up
+    where the other left off.
+    """
+
+    chunk_size = chunk_size or current_app.config.get('PURGE_CHUNK_SIZE',
+                                                      DEFAULT_CHUNK_SIZE)
+    names = list(STEPS)
+
+    while True:
+        purge = db.session.get(AccountPurge, user_id, with_for_update=True,
+                               populate_existing=True)
+        if purge is None or purge.finished_at is not None:
+            return
+
+        if deleted := STEPS[purge.step](user_id, chunk_size):
+            purge.rows_deleted += deleted
+        else:
+            logger.info("user %s: %s done, %s rows deleted so far",
+                        user_id, purge.step, purge.rows_deleted)
+
+            if purge.step == names[-1]:
+                purge.finished_at = datetime.utcnow()
+            else:
+                purge.step = names[names.index(purge.step) + 1]
+
+        renew_lease()
+        db.session.commit()
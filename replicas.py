@@ -0,0 +1,160 @@
+"""Routing read-only pages to a read replica.
+
+With `DATABASE_REPLICA_URL` set, views marked `@read_replica` run their
+SELECTs on the replica engine `connect_db` made, and everything else uses
+the primary as before. Within a request, once the session writes anything
+its reads go to the primary too (see `models.RoutingSession`).
+
+Replicas lag, so a page falls back to the primary when:
+
+- the viewer's own session committed a write in the last
+  `REPLICA_STICKY_SECONDS`, so they see what they just did (the deadline
+  is kept in their Flask session); or
+- the replica is more than `REPLICA_MAX_LAG` seconds behind, or can't be
+  reached. The lag is checked at most every `REPLICA_LAG_CHECK_INTERVAL`
+  seconds per process.
+
+Writes that change nothing, like unliking a message that wasn't liked,
+don't count.
+
+Locally, any second database works as a "replica": another SQLite file or
+another PostgreSQL database, kept in step by hand.
+"""
+
+import logging
+from threading import Lock
+from time import monotonic, time
+
+from flask import current_app, g, has_request_context, request, session
+from sqlalchemy import event, text
+from sqlalchemy.sql.elements import TextClause
+
+from models import db
+
+DEFAULT_STICKY_SECONDS = 5
+DEFAULT_MAX_LAG = 5
+DEFAULT_LAG_CHECK_INTERVAL = 1
+
+STICKY_KEY = '_primary_until'
+
+POSTGRES_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+logger = logging.getLogger('warbler.replicas')
+
+_lag_lock = Lock()
+_lag = dict(checked=None, seconds=None)
+
+
+def read_replica(view):
+    """Let a read-only view's queries run on the replica."""
+
+    view.read_replica = True
+    return view
+
+
+def replica_lag(engine):
+    """Seconds `engine`'s replica is behind its primary; None if it's down.
+
+    Only PostgreSQL streaming replicas can tell; anything else is taken to
+    be up to date.
+    """
+
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+
+    try:
+        with engine.connect() as connection:
+            return float(connection.execute(POSTGRES_LAG).scalar() or 0)
+    except Exception:
+        logger.exception("couldn't check the replica's lag")
+        return None
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def _current_lag(engine):
+    interval = _config('REPLICA_LAG_CHECK_INTERVAL',
+                       DEFAULT_LAG_CHECK_INTERVAL)
+
+    with _lag_lock:
+        now = monotonic()
+        if _lag['checked'] is None or now - _lag['checked'] >= interval:
+            _lag.update(checked=now, seconds=replica_lag(engine))
+
+        return _lag['seconds']
+
+
+def _usable_replica():
+    """The replica engine, if this request may read from it; else None."""
+
+    engine = current_app.extensions.get('replica_engine')
+    if engine is None:
+        return None
+
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'read_replica', False):
+        return None
+
+    if session.get(STICKY_KEY, 0) > time():
+        return None
+
+    lag = _current_lag(engine)
+    if lag is None or lag > _config('REPLICA_MAX_LAG', DEFAULT_MAX_LAG):
+        return None
+
+    return engine
+
+
+def _choose_engine():
+    # what counts is what this request writes
+    db.session.info.pop('wrote', None)
+    g.read_replica = _usable_replica()
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _note_writes(orm_execute_state):
+    statement = orm_execute_state.statement
+
+    if getattr(statement, 'is_dml', False):
+        result = orm_execute_state.invoke_statement()
+        if result.rowcount:
+            orm_execute_state.session.info['wrote'] = True
+        return result
+
+    # whole statements written out as SQL are only used to write
+    if isinstance(statement, TextClause):
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_flush(session_, flush_context):
+    session_.info['wrote'] = True
+
+
+def stick_to_primary():
+    """Keep the viewer's reads on the primary for a while after a write."""
+
+    if (has_request_context()
+            and current_app.extensions.get('replica_engine') is not None):
+        session[STICKY_KEY] = time() + _config('REPLICA_STICKY_SECONDS',
+                                               DEFAULT_STICKY_SECONDS)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _stick_to_primary(session_):
+    if session_.info.get('wrote'):
+        stick_to_primary()
+
+
+def init_replicas(app):
+    """Route the reads of `@read_replica` views to the replica, if any."""
+
+    app.before_request(_choose_engine)
@@ -0,0 +1,248 @@
+"""Indexed user search for Warbler.
+
+Substring search on usernames (and, with `SEARCH_PROFILES`, bios and
+locations) is backed by a trigram index: `pg_trgm` GIN indexes on
+PostgreSQL and an FTS5 table with the trigram tokenizer on SQLite. Results
+are ranked exact match, then prefix match, then shortest username, and
+always limited.
+
+Autocomplete is a prefix range read on an index over `lower(username)`
+(byte-ordered, so the same index serves the range and the ORDER BY).
+
+The indexes are created along with the `users` table; `create_search_indexes`
+can also be run by hand, e.g. after a bulk load.
+"""
+
+import logging
+import sqlite3
+
+from flask import current_app
+from sqlalchemy import DDL, case, event, func, or_, select, text
+from sqlalchemy.orm import load_only
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUTOCOMPLETE_LIMIT = 10
+
+# trigram indexes can't help with shorter search strings
+MIN_TRIGRAM_LENGTH = 3
+
+# sorts after every character, closing prefix ranges
+MAX_CHAR = '\U0010ffff'
+
+SQLITE_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+SQLITE_SEARCH_DDL = [
+    'CREATE INDEX IF NOT EXISTS ix_users_username_lower '
+    'ON users (lower(username))',
+]
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+    "username, bio, location, content='users', content_rowid='id', "
+    "tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users "
+    "BEGIN "
+    "INSERT INTO users_fts (rowid, username, bio, location) "
+    "VALUES (new.id, new.username, new.bio, new.location); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users "
+    "BEGIN "
+    "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+    "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_update "
+    "AFTER UPDATE OF username, bio, location ON users "
+    "BEGIN "
+    "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+    "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+    "INSERT INTO users_fts (rowid, username, bio, location) "
+    "VALUES (new.id, new.username, new.bio, new.location); "
+    "END",
+    "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+]
+
+# managed here rather than by the models, so migrations leave them alone
+SEARCH_INDEXES = {'ix_users_username_lower', 'ix_users_username_trgm',
+                  'ix_users_bio_trgm', 'ix_users_location_trgm'}
+SEARCH_TABLE_PREFIX = 'users_fts'
+
+POSTGRES_SEARCH_DDL = [
+    'CREATE INDEX IF NOT EXISTS ix_users_username_lower '
+    'ON users ((lower(username) COLLATE "C"))',
+]
+
+POSTGRES_TRIGRAM_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_users_username_trgm '
+    'ON users USING gin (username gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_users_bio_trgm '
+    'ON users USING gin (bio gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_users_location_trgm '
+    'ON users USING gin (location gin_trgm_ops)',
+]
+
+
+def create_search_indexes(connection):
+    """Create the search indexes for `connection`'s database."""
+
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        statements = list(POSTGRES_SEARCH_DDL)
+        has_trgm = connection.execute(text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )).scalar()
+
+        if has_trgm:
+            statements += POSTGRES_TRIGRAM_DDL
+        else:
+            logger.warning("pg_trgm is not installed; user search will "
+                           "scan the users table")
+
+    elif dialect == 'sqlite':
+        statements = list(SQLITE_SEARCH_DDL)
+
+        if SQLITE_TRIGRAM:
+            statements += SQLITE_FTS_DDL
+        else:
+            logger.warning("SQLite %s has no trigram tokenizer; user search "
+                           "will scan the users table", sqlite3.sqlite_version)
+
+    else:
+        return
+
+    for statement in statements:
+        connection.execute(DDL(statement))
+
+
+@event.listens_for(User.__table__, 'after_create')
+def create_search_indexes_with_users(target, connection, **kw):
+    create_search_indexes(connection)
+
+
+event.listen(
+    User.__table__, 'before_drop',
+    DDL('DROP TABLE IF EXISTS users_fts').execute_if(dialect='sqlite'))
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _sort_key():
+    """Byte-ordered lower(username), matching ix_users_username_lower."""
+
+    key = func.lower(User.username)
+
+    if _dialect() == 'postgresql':
+        key = key.collate('C')
+
+    return key
+
+
+def _like_pattern(search):
+    """A LIKE pattern matching `search` anywhere, with wildcards escaped."""
+
+    escaped = (search
+               .replace('\\', '\\\\')
+               .replace('%', '\\%')
+               .replace('_', '\\_'))
+
+    return f'%{escaped}%'
+
+
+def _fts_query(search, columns):
+    """An FTS5 MATCH expression for `search` as one quoted phrase."""
+
+    phrase = search.replace('"', '""')
+
+    return f'{{{" ".join(columns)}}} : "{phrase}"'
+
+
+def _search_columns():
+    if current_app.config.get('SEARCH_PROFILES'):
+        return ['username', 'bio', 'location']
+
+    return ['username']
+
+
+def search_users(search, limit):
+    """Return up to `limit` users matching `search`, best match first."""
+
+    statement = search_query(search, limit)
+    if statement is None:
+        return []
+
+    return db.session.execute(statement).scalars().all()
+
+
+def search_query(search, limit):
+    """SELECT of up to `limit` users matching `search`, best match first.
+
+    None if `search` is blank.
+    """
+
+    search = search.strip()
+    if not search:
+        return None
+
+    if len(search) < MIN_TRIGRAM_LENGTH:
+        return _prefix_query(search).limit(limit)
+
+    columns = _search_columns()
+    query = _active_users()
+
+    if _dialect() == 'sqlite' and SQLITE_TRIGRAM:
+        matches = text('SELECT rowid FROM users_fts WHERE users_fts MATCH :q')
+        query = query.where(User.id.in_(
+            matches.bindparams(q=_fts_query(search, columns))
+                   .columns(rowid=db.Integer)))
+    else:
+        pattern = _like_pattern(search)
+        query = query.where(or_(*(getattr(User, column).ilike(pattern,
+                                                               escape='\\')
+                                  for column in columns)))
+
+    lowered = search.lower()
+    rank = case((func.lower(User.username) == lowered, 0),
+                (_sort_key().startswith(lowered, autoescape=True), 1),
+                else_=2)
+
+    return (query
+            .order_by(rank, func.length(User.username), User.id)
+            .limit(limit))
+
+
+def _active_users():
+    return select(User).where(User.deleted_at.is_(None))
+
+
+def _prefix_query(prefix):
+    """SELECT of users whose username starts with `prefix`, in order."""
+
+    key = _sort_key()
+    prefix = prefix.lower()
+
+    return (_active_users()
+            .where(key >= prefix, key < prefix + MAX_CHAR)
+            .order_by(key))
+
+
+def autocomplete_users(prefix, limit=DEFAULT_AUTOCOMPLETE_LIMIT):
+    """Return up to `limit` users whose username starts with `prefix`.
+
+    Only id, username and image_url are loaded.
+    """
+
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+
+    statement = (_prefix_query(prefix)
+                 .options(load_only(User.id, User.username, User.image_url))
+                 .limit(limit))
+
+    return db.session.execute(statement).scalars().all()
@@ -1,22 +1,269 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows, LikedBy
+    python seed.py [--data generator] [--chunk-size 50000] [--jobs 4] [--resume]
 
-db.drop_all()
-db.create_all()
+Each CSV is streamed in chunks, each chunk committed on its own: `COPY FROM
+STDIN` on PostgreSQL, batched `executemany` on SQLite. Rows get explicit ids
+(the CSV line number), which is what the generator's foreign keys refer to.
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+Tables are created bare and their foreign keys (PostgreSQL only; SQLite
+can't add them later), indexes and search indexes are built after the load,
+which is much faster than maintaining them row by row. With no foreign keys
+to satisfy, PostgreSQL loads the tables in parallel.
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+If a load dies part way, `--resume` picks up where it stopped: each table's
+progress is read back from the database, so nothing else needs tracking.
+"""
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+import argparse
+import csv
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import monotonic
 
-with open('generator/liked_by.csv') as likes:
-    db.session.bulk_insert_mappings(LikedBy, DictReader(likes))
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import AddConstraint, CreateTable
 
-db.session.commit()
+from app import create_app
+from counters import reconcile_counters
+from models import db, User, Message, Follows, LikedBy
+from search import create_search_indexes, create_search_indexes_with_users
+from trending import create_epoch
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_JOBS = 4
+
+# (CSV file, table) in load order
+SOURCES = [
+    ('users.csv', User.__table__),
+    ('messages.csv', Message.__table__),
+    ('follows.csv', Follows.__table__),
+    ('liked_by.csv', LikedBy.__table__),
+]
+
+# tables whose ids come from the CSV line number
+NUMBERED = {User.__table__, Message.__table__}
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def create_bare_tables(engine, fresh=True):
+    """Create every table without its indexes (and foreign keys on PostgreSQL).
+
+    With `fresh`, existing tables are dropped first; otherwise only missing
+    tables are created.
+    """
+
+    postgres = engine.dialect.name == 'postgresql'
+
+    if fresh:
+        db.metadata.drop_all(engine)
+
+    existing = set(inspect(engine).get_table_names())
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                connection.execute(CreateTable(
+                    table,
+                    include_foreign_key_constraints=[] if postgres else None))
+
+
+def loaded_rows(connection, table):
+    """How many CSV rows of `table` are already in the database."""
+
+    if table in NUMBERED:
+        column = func.max(table.c.id)
+    else:
+        column = func.count()
+
+    return connection.execute(select(column).select_from(table)).scalar() or 0
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy(cursor, table, columns, chunk):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def _insert(cursor, table, columns, chunk):
+    placeholders = ', '.join('?' for _ in columns)
+    cursor.executemany(
+        f"INSERT INTO {table.name} ({', '.join(columns)}) "
+        f"VALUES ({placeholders})",
+        chunk)
+
+
+def load_table(engine, path, table, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream the CSV at `path` into `table`, skipping rows already loaded.
+
+    Returns the number of rows loaded.
+    """
+
+    write = _copy if engine.dialect.name == 'postgresql' else _insert
+
+    with engine.connect() as connection:
+        done = loaded_rows(connection, table)
+
+    with open(path, newline='') as source:
+        rows = csv.reader(source)
+        columns = next(rows)
+
+        unknown = set(columns) - set(table.c.keys())
+        if unknown:
+            raise ValueError(f"{path}: no such columns in {table.name}: "
+                             f"{', '.join(sorted(unknown))}")
+
+        rows = islice(rows, done, None)
+
+        if table in NUMBERED:
+            columns = ['id'] + columns
+            rows = ([n, *row] for n, row in enumerate(rows, done + 1))
+
+        if done:
+            log(f"{table.name}: resuming after {done:,} rows")
+
+        connection = engine.raw_connection()
+        loaded = 0
+        started = reported = monotonic()
+
+        try:
+            cursor = connection.cursor()
+
+            for chunk in _chunks(rows, chunk_size):
+                write(cursor, table, columns, chunk)
+                connection.commit()
+                loaded += len(chunk)
+
+                now = monotonic()
+                if now - reported >= 5:
+                    log(f"{table.name}: {done + loaded:,} rows "
+                        f"({loaded / (now - started):,.0f} rows/s)")
+                    reported = now
+
+        finally:
+            connection.close()
+
+    elapsed = monotonic() - started
+    log(f"{table.name}: loaded {loaded:,} rows in {elapsed:.1f}s "
+        f"({loaded / max(elapsed, 0.001):,.0f} rows/s)")
+
+    return loaded
+
+
+def finish_tables(engine):
+    """Add the foreign keys, indexes and search indexes left out of the load.
+
+    Also starts the trending scores' epoch, which `CreateTable` left out.
+
+    Safe to run again: anything that already exists is skipped.
+    """
+
+    postgres = engine.dialect.name == 'postgresql'
+    inspector = inspect(engine)
+    started = monotonic()
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if postgres and not inspector.get_foreign_keys(table.name):
+                for constraint in table.foreign_key_constraints:
+                    connection.execute(AddConstraint(constraint))
+
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+        create_search_indexes(connection)
+        create_epoch(connection)
+
+        if postgres:
+            for table in NUMBERED:
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                    f"'id'), coalesce(max(id), 0) + 1, false) "
+                    f"FROM {table.name}"))
+
+    with Session(engine) as session:
+        reconcile_counters(session)
+        session.commit()
+
+    if postgres:
+        with engine.connect() as connection:
+            connection.execute(text('ANALYZE'))
+
+    log(f"indexes, constraints and counters built in "
+        f"{monotonic() - started:.1f}s")
+
+
+def seed(data_dir='generator', chunk_size=DEFAULT_CHUNK_SIZE,
+         jobs=DEFAULT_JOBS, resume=False, engine=None):
+    """Load the CSVs in `data_dir` into the database at `engine` (default:
+    the app's)."""
+
+    engine = engine or db.engine
+
+    # the search indexes (and SQLite's FTS triggers) are built after the load
+    event.remove(User.__table__, 'after_create',
+                 create_search_indexes_with_users)
+
+    try:
+        create_bare_tables(engine, fresh=not resume)
+    finally:
+        event.listen(User.__table__, 'after_create',
+                     create_search_indexes_with_users)
+
+    # SQLite has one writer at a time, so there's nothing to gain
+    if engine.dialect.name != 'postgresql':
+        jobs = 1
+
+    started = monotonic()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(load_table, engine, os.path.join(data_dir, name),
+                            table, chunk_size)
+            for name, table in SOURCES
+        ]
+        total = sum(future.result() for future in futures)
+
+    elapsed = monotonic() - started
+    log(f"loaded {total:,} rows in {elapsed:.1f}s "
+        f"({total / max(elapsed, 0.001):,.0f} rows/s)")
+
+    finish_tables(engine)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load Warbler seed data.")
+    parser.add_argument('--data', default='generator',
+                        help="directory holding the CSV files")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows per COPY / executemany batch")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help="tables loaded at once (PostgreSQL only)")
+    parser.add_argument('--resume', action='store_true',
+                        help="keep loaded rows and continue an earlier load")
+    args = parser.parse_args(argv)
+
+    with create_app().app_context():
+        seed(args.data, args.chunk_size, args.jobs, args.resume)
+
+
+if __name__ == '__main__':
+    main()
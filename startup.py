@@ -0,0 +1,130 @@
+"""Startup timing for Warbler's web processes.
+
+Three phases are timed in each process:
+
+- `import`: importing app.py, i.e. Flask, SQLAlchemy and Warbler's modules
+  (app.py imports this module first, to start the clock);
+- `create_app`: building the app;
+- `worker_boot`: in a forked worker, from the fork to being ready to serve
+  (gunicorn.conf.py reports it). Under `gunicorn --preload` the master did
+  the first two already, so this is all a new worker costs.
+
+They're logged once each process is ready, with a warning if their total
+is over `STARTUP_BUDGET` seconds, and are in GET /metrics. For CI,
+`flask startup-time` times fresh interpreters and fails over budget.
+
+Dev-only extensions (Flask-DebugToolbar, and Flask-Migrate outside the
+`flask db` commands) are only imported when used, and the budget check also
+fails if a worker imported them.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from statistics import median
+from time import perf_counter
+
+logger = logging.getLogger('warbler.startup')
+
+DEV_ONLY_MODULES = ('flask_debugtoolbar', 'flask_migrate')
+
+# run in a fresh interpreter by `measure`
+PROBE = """
+import json, sys
+import app
+app.create_app()
+import startup
+print(json.dumps(dict(startup.stats(), dev_only_modules=[
+    name for name in startup.DEV_ONLY_MODULES if name in sys.modules])))
+"""
+
+_started = perf_counter()
+_forked = None
+_timings = {}
+
+
+def imported():
+    """Call when app.py's imports are done."""
+
+    _timings.setdefault('import', perf_counter() - _started)
+
+
+def _after_fork():
+    global _forked
+
+    _forked = perf_counter()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+@contextmanager
+def timed(phase):
+    """Record how long the block takes as `phase`."""
+
+    started = perf_counter()
+    yield
+    _timings[phase] = perf_counter() - started
+
+
+def worker_ready(app, log=logger):
+    """Record a forked worker's boot time and report startup."""
+
+    if _forked is not None:
+        _timings['worker_boot'] = perf_counter() - _forked
+
+    report(app, log)
+
+
+def report(app, log=logger):
+    """Log this process's startup times; warn if they're over budget."""
+
+    total = sum(_timings.values())
+    budget = app.config.get('STARTUP_BUDGET')
+    line = ', '.join(f'{phase} {seconds * 1000:.0f}ms'
+                     for phase, seconds in _timings.items())
+
+    if budget and total > budget:
+        log.warning("startup took %.0fms, over the %.0fms budget: %s",
+                    total * 1000, budget * 1000, line)
+    else:
+        log.info("startup took %.0fms: %s", total * 1000, line)
+
+
+def stats():
+    """This process's startup phases, in milliseconds."""
+
+    return {phase: round(seconds * 1000, 1)
+            for phase, seconds in _timings.items()}
+
+
+def measure(runs=5, config=None):
+    """Time import + create_app in `runs` fresh interpreters.
+
+    Returns the median of each phase in milliseconds, and the dev-only
+    modules any run imported. `config` names the config to build (default:
+    `WARBLER_CONFIG`, as usual).
+    """
+
+    env = dict(os.environ)
+    if config:
+        env['WARBLER_CONFIG'] = config
+
+    results = []
+
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], env=env,
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    phases = [phase for phase in results[0] if phase != 'dev_only_modules']
+    measured = {phase: median(result[phase] for result in results)
+                for phase in phases}
+    measured['dev_only_modules'] = sorted(
+        {name for result in results for name in result['dev_only_modules']})
+
+    return measured
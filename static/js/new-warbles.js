@@ -0,0 +1,53 @@
+// Counts warbles posted since the home timeline was loaded, and shows a link
+// to reload it. Uses the server-sent events stream, or long-polls without
+// EventSource.
+
+(function () {
+  const banner = document.getElementById('new-warbles');
+  if (!banner) return;
+
+  let after = Number(banner.dataset.after);
+  let count = 0;
+
+  function show(text) {
+    banner.textContent = text;
+    banner.classList.remove('d-none');
+  }
+
+  function received(messageId) {
+    after = Math.max(after, messageId);
+    count += 1;
+    show(count === 1 ? 'Show 1 new warble' : `Show ${count} new warbles`);
+  }
+
+  if (window.EventSource) {
+    const source = new EventSource(`/api/v1/timeline/stream?after=${after}`);
+
+    source.addEventListener('message', function (event) {
+      received(Number(event.lastEventId));
+    });
+
+    source.addEventListener('reset', function () {
+      source.close();
+      show('Show new warbles');
+    });
+    return;
+  }
+
+  async function poll() {
+    try {
+      const resp = await fetch(`/api/v1/timeline/updates?after=${after}`);
+      if (resp.ok) {
+        const body = await resp.json();
+        body.messages.forEach(function (message) { received(message.id); });
+      } else {
+        await new Promise(function (resolve) { setTimeout(resolve, 5000); });
+      }
+    } catch (error) {
+      await new Promise(function (resolve) { setTimeout(resolve, 5000); });
+    }
+    poll();
+  }
+
+  poll();
+})();
@@ -0,0 +1,303 @@
+"""Live delivery of new messages to open home timelines.
+
+A viewer on "/" keeps a server-sent events stream open (or long-polls where
+EventSource isn't available) and is told about each new message by an
+author they follow, without reloading the timeline.
+
+New messages are announced by `announce_message`, in the transaction that
+adds them. Each process has one `Broker` holding the open streams indexed
+by the authors they follow, so an announcement is handed straight to the
+streams that want it: an idle stream does no database queries and holds no
+connection, and a delivery needs none either, since the announcement
+carries the message and its author.
+
+On PostgreSQL the announcement is a `NOTIFY` on the `warbler_messages`
+channel, sent by PostgreSQL when (and only if) the transaction commits, so
+every process sees every message. A process starts listening with one
+dedicated connection when its first stream opens. Elsewhere (SQLite: one
+process) it's published to this process's broker after the commit.
+
+A stream is a generator waiting on an Event, so under gevent workers
+(`gunicorn -k gevent --worker-connections 10000 app:app`) each open stream
+is a greenlet, not a thread. Under gevent, psycopg2 also needs
+`psycogreen.gevent.patch_psycopg()` so queries don't block other streams.
+
+Streams that fall more than `STREAM_QUEUE_SIZE` messages behind are sent a
+`reset` event and closed, and the client reloads. `stream_stats()` counts
+open streams and deliveries and the lag from commit to delivery.
+"""
+
+import json
+import logging
+import os
+import select
+from collections import defaultdict, deque
+from threading import Event, Lock, Thread
+from time import sleep, time
+
+from sqlalchemy import event, text
+
+from models import db
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+CHANNEL = 'warbler_messages'
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_KEEPALIVE = 15
+
+# PostgreSQL's NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD = 7900
+
+# how many deliveries the lag percentiles are taken over
+LAG_SAMPLES = 1000
+
+# seconds between attempts to reconnect a lost LISTEN connection
+RECONNECT_DELAY = 1
+
+PENDING_KEY = 'announcements'
+
+logger = logging.getLogger('warbler.stream')
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+class Announcement:
+    """A new message, as its JSON body for clients."""
+
+    def __init__(self, message_id, author_id, data, published):
+        self.message_id = message_id
+        self.author_id = author_id
+        self.data = data
+        self.published = published
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Unpack an announcement made by `payload()`."""
+
+        body = json.loads(payload)
+        published = body.pop('published')
+        message = body['message']
+
+        return cls(message['id'], message['user_id'], _dumps(body),
+                   published)
+
+
+def payload(msg, author):
+    """The announcement of `msg` by `author`, as JSON text.
+
+    Laid out like a message in the JSON API, with its author.
+    """
+
+    body = {
+        'message': {
+            'id': msg.id,
+            'text': msg.text,
+            'timestamp': msg.timestamp.isoformat(),
+            'user_id': author.id,
+            'liked': False,
+        },
+        'user': {'id': author.id, 'username': author.username,
+                 'image_url': author.image_url},
+        'published': time(),
+    }
+
+    encoded = _dumps(body)
+    if len(encoded) > MAX_PAYLOAD:
+        # a very long image URL; clients can look the author up instead
+        del body['user']['image_url']
+        encoded = _dumps(body)
+
+    return encoded.decode()
+
+
+class Subscription:
+    """One open stream: the authors it wants and the messages waiting."""
+
+    def __init__(self, author_ids, size):
+        self.author_ids = frozenset(author_ids)
+        self.size = size
+        self.overflowed = False
+        self._waiting = deque()
+        self._ready = Event()
+
+    def put(self, announcement):
+        if len(self._waiting) >= self.size:
+            self.overflowed = True
+        else:
+            self._waiting.append(announcement)
+
+        self._ready.set()
+
+    def get(self, timeout):
+        """Wait up to `timeout` seconds; return the announcements waiting."""
+
+        self._ready.wait(timeout)
+        self._ready.clear()
+
+        announcements = []
+        while self._waiting:
+            announcements.append(self._waiting.popleft())
+
+        return announcements
+
+
+class Broker:
+    """This process's open streams, indexed by the authors they follow."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._by_author = defaultdict(set)
+        self._stats = dict(open=0, opened=0, delivered=0, overflowed=0)
+        self._lags = deque(maxlen=LAG_SAMPLES)
+
+    def subscribe(self, author_ids, size=DEFAULT_QUEUE_SIZE):
+        subscription = Subscription(author_ids, size)
+
+        with self._lock:
+            for author_id in subscription.author_ids:
+                self._by_author[author_id].add(subscription)
+            self._stats['open'] += 1
+            self._stats['opened'] += 1
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for author_id in subscription.author_ids:
+                subscribers = self._by_author[author_id]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_author[author_id]
+            self._stats['open'] -= 1
+            if subscription.overflowed:
+                self._stats['overflowed'] += 1
+
+    def publish(self, announcement):
+        with self._lock:
+            subscribers = list(self._by_author.get(announcement.author_id,
+                                                   ()))
+
+        for subscription in subscribers:
+            subscription.put(announcement)
+
+    def delivered(self, announcements):
+        """Record that `announcements` were sent to a client."""
+
+        now = time()
+
+        with self._lock:
+            self._stats['delivered'] += len(announcements)
+            self._lags.extend(now - announcement.published
+                              for announcement in announcements)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lags = sorted(self._lags)
+
+        for name, fraction in (('lag_p50_ms', 0.5), ('lag_p99_ms', 0.99)):
+            stats[name] = (round(lags[int(fraction * (len(lags) - 1))] * 1000,
+                                 1) if lags else None)
+
+        return stats
+
+
+broker = Broker()
+
+_listener = None
+_listener_lock = Lock()
+
+
+def _postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def announce_message(msg, author):
+    """Announce the new `msg` by `author` once the transaction commits."""
+
+    if _postgresql():
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           dict(channel=CHANNEL, payload=payload(msg, author)))
+    else:
+        db.session.info.setdefault(PENDING_KEY, []).append(
+            payload(msg, author))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_pending(session):
+    for pending in session.info.pop(PENDING_KEY, ()):
+        broker.publish(Announcement.from_payload(pending))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def _listen(app):
+    """Publish every announcement NOTIFYed on CHANNEL, for good."""
+
+    while True:
+        try:
+            with app.app_context():
+                connection = db.engine.raw_connection()
+
+            try:
+                dbapi_connection = connection.connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f'LISTEN {CHANNEL}')
+
+                while True:
+                    select.select([dbapi_connection], [], [])
+                    dbapi_connection.poll()
+
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        broker.publish(
+                            Announcement.from_payload(notify.payload))
+            finally:
+                connection.invalidate()
+
+        except Exception:
+            logger.exception("lost the %s listener; reconnecting", CHANNEL)
+            sleep(RECONNECT_DELAY)
+
+
+def _forget_listener():
+    # a forked child doesn't get the parent's listener thread
+    global _listener
+
+    _listener = None
+
+
+os.register_at_fork(after_in_child=_forget_listener)
+
+
+def start_listening(app):
+    """Make sure this process hears announcements from every process."""
+
+    global _listener
+
+    if not _postgresql():
+        return
+
+    with _listener_lock:
+        if _listener is None:
+            _listener = Thread(target=_listen, args=(app,), daemon=True,
+                               name='stream-listener')
+            _listener.start()
+
+
+def stream_stats():
+    """Open stream counts, deliveries and delivery lag for this process."""
+
+    return broker.stats()
@@ -0,0 +1,136 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+from user_cache import invalidate_user
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 read endpoints."""
+
+    def setUp(self):
+        """Create a viewer following an author with three messages."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+
+        self.client = app.test_client()
+
+        viewer = User.signup("viewer", "viewer@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+
+        self.id = viewer.id
+        self.author_id = author.id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+        self.client.post(f'/users/follow/{self.author_id}')
+
+        self.message_ids = []
+        for i in range(3):
+            msg = Message(text=f"warble {i}", user_id=self.author_id)
+            db.session.add(msg)
+            db.session.commit()
+            self.message_ids.append(msg.id)
+
+        db.session.add(LikedBy(user_id=self.id,
+                               message_id=self.message_ids[0]))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        invalidate_user(self.id)
+        invalidate_user(self.author_id)
+
+    def test_user_messages(self):
+        """Messages are slim, with their author listed once"""
+
+        resp = self.client.get(f'/api/v1/users/{self.author_id}/messages')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/json')
+
+        body = resp.get_json()
+        self.assertEqual([msg['text'] for msg in body['messages']],
+                         ["warble 2", "warble 1", "warble 0"])
+        self.assertEqual(body['users'], [{'id': self.author_id,
+                                          'username': 'author',
+                                          'image_url': '/static/images/default-pic.png'}])
+        self.assertEqual([msg['liked'] for msg in body['messages']],
+                         [False, False, True])
+        self.assertIsNone(body['next'])
+
+    def test_cursor_pagination(self):
+        """?before= pages through with the same cursors as the HTML pages"""
+
+        app.config['PAGE_SIZE'] = 2
+
+        try:
+            first = self.client.get(
+                f'/api/v1/users/{self.author_id}/messages').get_json()
+            second = self.client.get(
+                f'/api/v1/users/{self.author_id}/messages',
+                query_string={'before': first['next']}).get_json()
+        finally:
+            app.config['PAGE_SIZE'] = 50
+
+        self.assertEqual(len(first['messages']), 2)
+        self.assertEqual([msg['text'] for msg in second['messages']],
+                         ["warble 0"])
+        self.assertIsNone(second['next'])
+
+    def test_timeline(self):
+        """The home timeline has the followed author's messages"""
+
+        body = self.client.get('/api/v1/timeline').get_json()
+
+        self.assertEqual([msg['id'] for msg in body['messages']],
+                         self.message_ids[::-1])
+        self.assertEqual([user['id'] for user in body['users']],
+                         [self.author_id])
+
+    def test_follows_and_likes(self):
+        """Followers, following and likes lists"""
+
+        following = self.client.get(f'/api/v1/users/{self.id}/following')
+        self.assertEqual([user['username'] for user in
+                          following.get_json()['users']], ['author'])
+
+        followers = self.client.get(
+            f'/api/v1/users/{self.author_id}/followers')
+        self.assertEqual([user['username'] for user in
+                          followers.get_json()['users']], ['viewer'])
+
+        likes = self.client.get(f'/api/v1/users/{self.id}/likes').get_json()
+        self.assertEqual([msg['id'] for msg in likes['messages']],
+                         [self.message_ids[0]])
+
+    def test_errors_are_json(self):
+        """Logged-out reads get a JSON 401; missing users a JSON 404"""
+
+        resp = self.client.get('/api/v1/users/999999/messages')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json(), {'error': 'not found'})
+
+        with self.client.session_transaction() as change_session:
+            del change_session[CURR_USER_KEY]
+
+        resp = self.client.get('/api/v1/timeline')
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.get_json(), {'error': 'unauthorized'})
@@ -0,0 +1,183 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+from flask import url_for
+
+import assets
+from assets import build_assets, load_assets, vendor_assets, VENDOR_ASSETS
+from testing import app
+
+FONT_CSS = (b'@font-face { src: url("../webfonts/fa-solid-900.eot?#iefix") '
+            b'format("embedded-opentype"), url(../webfonts/fa-solid-900.woff2)'
+            b' format("woff2"); }')
+
+
+class AssetsTestCase(TestCase):
+    """Test building, linking and serving fingerprinted static files."""
+
+    def setUp(self):
+        """Build a copy of static/ and serve it."""
+
+        self.folder = tempfile.mkdtemp()
+        self.static = os.path.join(self.folder, 'static')
+        shutil.copytree(app.static_folder, self.static)
+
+        self.manifest = build_assets(self.static)
+
+        self.static_folder = app.static_folder
+        app.static_folder = self.static
+        app.config['FINGERPRINT_ASSETS'] = True
+        load_assets(app)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.static_folder
+        app.config['FINGERPRINT_ASSETS'] = False
+        app.config['VENDOR_ASSETS'] = False
+        app.extensions['assets'] = assets.EMPTY
+        shutil.rmtree(self.folder)
+
+    def read(self, filename):
+        with open(os.path.join(self.static, filename), 'rb') as file:
+            return file.read()
+
+    def test_build(self):
+        """Files are copied under a hash of their contents"""
+
+        hashed = self.manifest['urls']['js/new-warbles.js']
+
+        self.assertRegex(hashed, r'^dist/js/new-warbles\.[0-9a-f]{12}\.js$')
+        self.assertEqual(self.read(hashed), self.read('js/new-warbles.js'))
+        self.assertEqual(gzip.decompress(self.read(hashed + '.gz')),
+                         self.read('js/new-warbles.js'))
+        self.assertIn('gzip', self.manifest['files'][hashed])
+
+        # images are already compressed
+        logo = self.manifest['urls']['images/warbler-logo.png']
+        self.assertEqual(self.manifest['files'][logo], [])
+
+        # and the same files hash the same way
+        self.assertEqual(build_assets(self.static), self.manifest)
+
+    def test_stylesheet_references(self):
+        """A stylesheet links the hashed images it uses"""
+
+        css = self.read(self.manifest['urls']['stylesheets/style.css'])
+        nav_bg = self.manifest['urls']['images/nav-bg.png']
+
+        self.assertIn(f'url("/static/{nav_bg}")'.encode(), css)
+        self.assertNotIn(b'/static/images/', css)
+
+    def test_links(self):
+        """url_for('static') links the hashed file"""
+
+        with app.test_request_context():
+            url = url_for('static', filename='stylesheets/style.css')
+
+        self.assertEqual(
+            url, f"/static/{self.manifest['urls']['stylesheets/style.css']}")
+
+        resp = self.client.get('/')
+        self.assertIn(url, resp.get_data(as_text=True))
+
+    def test_precompressed(self):
+        """Hashed files are sent precompressed, immutable, and vary"""
+
+        hashed = self.manifest['urls']['stylesheets/style.css']
+
+        resp = self.client.get(f'/static/{hashed}',
+                               headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        self.assertEqual(gzip.decompress(resp.data), self.read(hashed))
+
+        resp = self.client.get(f'/static/{hashed}')
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp.data, self.read(hashed))
+
+    @skipIf(assets.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        """Brotli is preferred when the client takes it"""
+
+        hashed = self.manifest['urls']['stylesheets/style.css']
+        resp = self.client.get(f'/static/{hashed}',
+                               headers={'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(assets.brotli.decompress(resp.data),
+                         self.read(hashed))
+
+    def test_uncompressed_files(self):
+        """Images don't vary; unhashed files are revalidated"""
+
+        logo = self.manifest['urls']['images/warbler-logo.png']
+        resp = self.client.get(f'/static/{logo}',
+                               headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Vary', resp.headers)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+
+        resp = self.client.get('/static/images/warbler-logo.png')
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+
+    def test_vendor(self):
+        """Vendored libraries and their fonts go through the pipeline"""
+
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            return FONT_CSS if url.endswith('.css') else url.encode()
+
+        vendor_assets(self.static, fetch)
+        manifest = build_assets(self.static)
+
+        self.assertIn('https://use.fontawesome.com/releases/v5.3.1/webfonts/'
+                      'fa-solid-900.woff2', fetched)
+
+        css = self.read(manifest['urls']['vendor/fontawesome/css/all.css'])
+        woff2 = manifest['urls']['vendor/fontawesome/webfonts/'
+                                 'fa-solid-900.woff2']
+        eot = manifest['urls']['vendor/fontawesome/webfonts/'
+                               'fa-solid-900.eot']
+
+        self.assertIn(f'url("../webfonts/{os.path.basename(woff2)}")'.encode(),
+                      css)
+        self.assertIn(f'url("../webfonts/{os.path.basename(eot)}?#iefix")'
+                      .encode(), css)
+
+        load_assets(app)
+        app.config['VENDOR_ASSETS'] = True
+        html = self.client.get('/').get_data(as_text=True)
+
+        self.assertIn(f"/static/{manifest['urls']['vendor/jquery/jquery.js']}",
+                      html)
+        self.assertNotIn('unpkg.com', html)
+
+    def test_cdn(self):
+        """Without VENDOR_ASSETS, pages link the CDNs"""
+
+        html = self.client.get('/').get_data(as_text=True)
+
+        for url in VENDOR_ASSETS.values():
+            self.assertIn(url, html)
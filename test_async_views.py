@@ -0,0 +1,160 @@
+"""Async view tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_async_views.py
+
+
+import asyncio
+from contextlib import contextmanager
+from time import perf_counter, sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+import async_views
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+from user_cache import invalidate_user
+
+db.create_all()
+
+# simulated round trip to the database, in seconds
+LATENCY = 0.02
+
+NUM_REQUESTS = 10
+
+
+class AsyncViewTestCase(TestCase):
+    """Test that the async pages match the sync ones, only faster."""
+
+    def setUp(self):
+        """Create a viewer who follows and likes an author's messages."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        viewer = User.signup("viewer", "viewer@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.flush()
+
+        author.followers.append(viewer)
+        messages = [Message(text=f"warble {i}", user_id=author.id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add(LikedBy(user_id=viewer.id, message_id=messages[0].id))
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+        self.message_id = messages[0].id
+        invalidate_user(self.viewer_id)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.viewer_id
+
+        self.sync_views = {name: app.view_functions[name]
+                           for name in async_views.VIEWS}
+        app.async_to_sync = async_views.run_on_loop
+
+    def tearDown(self):
+        db.session.rollback()
+        app.view_functions.update(self.sync_views)
+
+    @contextmanager
+    def async_pages(self):
+        app.view_functions.update(async_views.VIEWS)
+        try:
+            yield
+        finally:
+            app.view_functions.update(self.sync_views)
+
+    def urls(self):
+        return ['/', '/users', '/users?q=auth',
+                f'/users/{self.author_id}',
+                f'/users/{self.viewer_id}/following',
+                f'/users/{self.author_id}/followers',
+                f'/messages/{self.message_id}']
+
+    def test_pages_match_sync(self):
+        """Each async page is the same as the sync one"""
+
+        # warm the home timeline first, so both see the same one
+        self.client.get('/')
+
+        for url in self.urls():
+            expected = self.client.get(url)
+
+            with self.async_pages():
+                resp = self.client.get(url)
+
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertEqual(resp.get_data(as_text=True),
+                             expected.get_data(as_text=True), url)
+
+    def test_cold_timeline(self):
+        """The async home page builds a cold timeline"""
+
+        with self.async_pages():
+            resp = self.client.get('/')
+
+        self.assertIn('warble 4', resp.get_data(as_text=True))
+        self.assertTrue(db.session.get(User, self.viewer_id).timeline_warm)
+
+    def test_missing(self):
+        """Missing users and messages still 404"""
+
+        with self.async_pages():
+            self.assertEqual(self.client.get('/users/999999').status_code, 404)
+            self.assertEqual(
+                self.client.get('/messages/999999').status_code, 404)
+
+    def test_anonymous(self):
+        """Relationship lists still send anonymous visitors home"""
+
+        with self.client.session_transaction() as change_session:
+            del change_session[CURR_USER_KEY]
+
+        with self.async_pages():
+            resp = self.client.get(f'/users/{self.author_id}/followers')
+
+        self.assertEqual(resp.status_code, 302)
+
+    def test_faster_under_latency(self):
+        """With slow round trips, async profiles serve more requests/sec"""
+
+        url = f'/users/{self.author_id}'
+        self.client.get(url)
+
+        def slow_cursor(*args):
+            sleep(LATENCY)
+
+        original = async_views._execute
+
+        async def slow_execute(statement, engine):
+            await asyncio.sleep(LATENCY)
+            return await original(statement, engine)
+
+        def requests_per_second():
+            start = perf_counter()
+            for _ in range(NUM_REQUESTS):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            return NUM_REQUESTS / (perf_counter() - start)
+
+        event.listen(db.engine, 'before_cursor_execute', slow_cursor)
+        try:
+            sync_rate = requests_per_second()
+
+            with self.async_pages(), \
+                    patch.object(async_views, '_execute', slow_execute):
+                async_rate = requests_per_second()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', slow_cursor)
+
+        self.assertGreater(async_rate, sync_rate * 1.5)
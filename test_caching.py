@@ -0,0 +1,153 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+from unittest import TestCase
+
+from flask import template_rendered, url_for
+
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+
+db.create_all()
+
+
+class CachingTestCase(TestCase):
+    """Test cache policies and conditional GETs."""
+
+    def setUp(self):
+        """Create a viewer and an author with one message."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+
+        self.client = app.test_client()
+
+        viewer = User.signup("viewer", "viewer@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+
+        msg = Message(text="cache me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.id = viewer.id
+        self.author_id = author.id
+        self.message_id = msg.id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+        self.rendered = []
+        template_rendered.connect(self.record_render, app)
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        template_rendered.disconnect(self.record_render, app)
+        db.session.rollback()
+
+    def record_render(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def revalidate(self, url, etag):
+        self.rendered.clear()
+        return self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_profile_not_modified(self):
+        """A matching If-None-Match gets a 304 without rendering"""
+
+        url = f'/users/{self.author_id}'
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        self.assertIn('Last-Modified', response.headers)
+        etag = response.headers['ETag']
+
+        response = self.revalidate(url, etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(self.rendered, [])
+
+    def test_profile_changes_etag(self):
+        """Following the user changes their profile ETag"""
+
+        url = f'/users/{self.author_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        self.client.post(f'/users/follow/{self.author_id}')
+
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('users/show.html', self.rendered)
+
+    def test_message_changes_etag(self):
+        """Liking a message changes its ETag"""
+
+        url = f'/messages/{self.message_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        self.client.post(f'/messages/{self.message_id}/like')
+
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'fas fa-star', response.data)
+
+    def test_viewer_in_etag(self):
+        """Pages cached for one viewer are not reused for another"""
+
+        url = f'/users/{self.author_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as change_session:
+            del change_session[CURR_USER_KEY]
+
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_pending_flash_renders(self):
+        """Pending flashed messages bypass the 304"""
+
+        url = f'/users/{self.author_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as change_session:
+            change_session['_flashes'] = [('success', 'Hello!')]
+
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Hello!', response.data)
+
+    def test_missing_user(self):
+        """Missing users still 404"""
+
+        self.assertEqual(self.client.get('/users/999999').status_code, 404)
+
+    def test_cache_policies(self):
+        """Sensitive forms are no-store and versioned static is immutable"""
+
+        response = self.client.get('/login')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+        response = self.client.get('/users')
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+
+        with app.test_request_context():
+            static_url = url_for('static', filename='stylesheets/style.css')
+
+        self.assertIn('?v=', static_url)
+        response = self.client.get(static_url)
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        response.close()
@@ -0,0 +1,69 @@
+"""Config tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from config import load_config, ProductionConfig, TestingConfig
+
+
+class ConfigTestCase(TestCase):
+    """Test loading settings from config classes and the environment."""
+
+    def load(self, config, **environ):
+        app = Flask(__name__)
+        with patch.dict(os.environ, environ, clear=True):
+            load_config(app, config)
+        return app.config
+
+    def test_defaults(self):
+        """Settings come from the config class"""
+
+        config = self.load('testing')
+
+        self.assertTrue(config['TESTING'])
+        self.assertEqual(config['SQLALCHEMY_DATABASE_URI'],
+                         TestingConfig.SQLALCHEMY_DATABASE_URI)
+        self.assertEqual(config['PAGE_SIZE'], 50)
+
+    def test_environment(self):
+        """Environment variables override settings, parsed by type"""
+
+        config = self.load('development', PAGE_SIZE='20',
+                           REPLICA_MAX_LAG='2.5', ASYNC_VIEWS='1',
+                           REPLICA_POOL_PRE_PING='0',
+                           BCRYPT_MAX_PENDING='0',
+                           DATABASE_URL='postgres://u:p@db.example.com/w')
+
+        self.assertEqual(config['PAGE_SIZE'], 20)
+        self.assertEqual(config['REPLICA_MAX_LAG'], 2.5)
+        self.assertIs(config['ASYNC_VIEWS'], True)
+        self.assertIs(config['REPLICA_POOL_PRE_PING'], False)
+        self.assertEqual(config['BCRYPT_MAX_PENDING'], 0)
+        self.assertEqual(config['SQLALCHEMY_DATABASE_URI'],
+                         'postgresql://u:p@db.example.com/w')
+
+    def test_tests_ignore_database_url(self):
+        """The tests only use TEST_DATABASE_URL"""
+
+        config = self.load('testing', DATABASE_URL='postgresql:///warbler')
+
+        self.assertEqual(config['SQLALCHEMY_DATABASE_URI'],
+                         TestingConfig.SQLALCHEMY_DATABASE_URI)
+
+    def test_production_requires(self):
+        """Production refuses to start without a database and secret key"""
+
+        with self.assertRaises(RuntimeError):
+            self.load(ProductionConfig, SECRET_KEY='x')
+
+        config = self.load(ProductionConfig, SECRET_KEY='x',
+                           DATABASE_URL='postgresql:///warbler')
+        self.assertEqual(config['SECRET_KEY'], 'x')
@@ -0,0 +1,126 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+from unittest import TestCase
+
+from models import db, AccountPurge, User, Message, Follows, LikedBy, Job
+
+from app import CURR_USER_KEY
+from testing import app
+from counters import reconcile_counters
+from jobs import work_off
+
+db.create_all()
+
+
+class CounterTestCase(TestCase):
+    """Test that user counters follow the rows they count."""
+
+    def setUp(self):
+        """Create two users and a test client logged in as the first."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        AccountPurge.query.delete()
+        Job.query.delete()
+
+        self.client = app.test_client()
+
+        user1 = User.signup(
+                username="test_user",
+                password="test_password",
+                email="test1@test.com",
+                image_url="test.com",
+            )
+
+        user2 = User.signup(
+                username="test_user2",
+                password="test_password2",
+                email="test2@test.com",
+                image_url="test2.com",
+            )
+
+        db.session.commit()
+
+        self.id = user1.id
+        self.id2 = user2.id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def test_follow_counts(self):
+        """Following and unfollowing update both users' counts"""
+
+        self.client.post(f'/users/follow/{self.id2}')
+
+        self.assertEqual(User.query.get(self.id).following_count, 1)
+        self.assertEqual(User.query.get(self.id2).follower_count, 1)
+
+        self.client.post(f'/users/stop-following/{self.id2}')
+
+        self.assertEqual(User.query.get(self.id).following_count, 0)
+        self.assertEqual(User.query.get(self.id2).follower_count, 0)
+
+    def test_message_and_like_counts(self):
+        """Posting, liking and deleting messages update counts"""
+
+        msg = Message(text="like me", user_id=self.id2)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        self.client.post(f'/messages/{msg_id}/like')
+        self.assertEqual(User.query.get(self.id).like_count, 1)
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id2
+
+        self.client.post('/messages/new', data={"text": "another"})
+        self.assertEqual(User.query.get(self.id2).message_count, 1)
+
+        self.client.post(f'/messages/{msg_id}/delete')
+        self.assertEqual(User.query.get(self.id).like_count, 0)
+
+    def test_delete_user_counts(self):
+        """Deleting a user removes their follows from other counts"""
+
+        self.client.post(f'/users/follow/{self.id2}')
+        self.client.post('/users/delete')
+
+        self.assertEqual(User.query.get(self.id2).follower_count, 0)
+
+        with app.app_context():
+            work_off()
+
+        self.assertEqual(User.query.get(self.id2).follower_count, 0)
+
+    def test_reconcile_counters(self):
+        """Reconciling recomputes counts from the tables"""
+
+        user1 = User.query.get(self.id)
+        user2 = User.query.get(self.id2)
+        msg = Message(text="counted", user_id=self.id2)
+        user1.following.append(user2)
+        db.session.add(msg)
+        db.session.commit()
+
+        db.session.add(LikedBy(user_id=self.id, message_id=msg.id))
+        db.session.commit()
+
+        reconcile_counters()
+        db.session.commit()
+
+        user1 = User.query.get(self.id)
+        user2 = User.query.get(self.id2)
+        self.assertEqual((user1.following_count, user1.like_count), (1, 1))
+        self.assertEqual((user2.follower_count, user2.message_count), (1, 1))
@@ -0,0 +1,109 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+from fragments import LRUBackend, fragment_stats, message_fragments
+from user_cache import invalidate_user
+
+db.create_all()
+
+
+class FragmentTestCase(TestCase):
+    """Test caching and invalidating rendered message list items."""
+
+    def setUp(self):
+        """Create a logged-in author with two messages."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.client = app.test_client()
+
+        user = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+
+        msgs = [Message(text=f"warble {i}", user_id=user.id) for i in range(2)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        self.id = user.id
+        self.message_ids = [msg.id for msg in msgs]
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        invalidate_user(self.id)
+        self.ctx.pop()
+
+    def test_fragments_cached(self):
+        """A second render of the same messages is all cache hits"""
+
+        messages = Message.query.filter(Message.id.in_(self.message_ids)).all()
+
+        first = message_fragments(messages)
+        before = fragment_stats()
+        second = message_fragments(messages)
+        after = fragment_stats()
+
+        self.assertEqual(first, second)
+        self.assertIn('warble 0', first[self.message_ids[0]])
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_profile_edit_refreshes_fragments(self):
+        """Changing username re-renders the author's messages"""
+
+        self.client.get(f'/users/{self.id}')
+
+        resp = self.client.post('/users/profile', data={
+            'username': 'author',
+            'email': 'author@test.com',
+            'image_url': 'http://new.example.com/me.jpg',
+            'header_image_url': '',
+            'bio': '',
+            'password': 'password',
+        })
+        self.assertEqual(resp.status_code, 302)
+
+        html = self.client.get(f'/users/{self.id}').get_data(as_text=True)
+        # nav bar, profile card and both messages
+        self.assertEqual(html.count('http://new.example.com/me.jpg'), 4)
+
+    def test_deleted_message_forgotten(self):
+        """Deleting a message drops its fragment"""
+
+        self.client.get(f'/users/{self.id}')
+        self.client.post(f'/messages/{self.message_ids[0]}/delete')
+
+        html = self.client.get(f'/users/{self.id}').get_data(as_text=True)
+        self.assertNotIn('warble 0', html)
+        self.assertIn('warble 1', html)
+
+    def test_lru_backend(self):
+        """The in-process backend evicts and deletes"""
+
+        backend = LRUBackend(2)
+        backend.set_many({'a': '1', 'b': '2', 'c': '3'})
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), [None, '2', '3'])
+
+        backend.delete_many(['b'])
+        self.assertEqual(backend.get_many(['b']), [None])
+        self.assertEqual(backend.stats()['size'], 1)
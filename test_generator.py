@@ -0,0 +1,66 @@
+"""CSV generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import csv
+import os
+import sys
+import tempfile
+from random import Random
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+import create_csvs
+
+ARGS = ['--users', '50', '--messages', '200', '--follows', '400',
+        '--likes', '600', '--seed', '7']
+
+
+class GeneratorTestCase(TestCase):
+    """Test that generated likes are reproducible and valid."""
+
+    def generate(self, argv=ARGS):
+        out = tempfile.TemporaryDirectory()
+        self.addCleanup(out.cleanup)
+        create_csvs.main(argv + ['--out', out.name])
+
+        files = {}
+        for name in os.listdir(out.name):
+            with open(os.path.join(out.name, name)) as f:
+                files[name] = list(csv.DictReader(f))
+
+        return files
+
+    def test_deterministic(self):
+        """The same seed gives the same files"""
+
+        self.assertEqual(self.generate(), self.generate())
+
+    def test_likes(self):
+        """Likes are distinct, and never of the user's own messages"""
+
+        files = self.generate()
+        authors = {i: int(row['user_id'])
+                   for i, row in enumerate(files['messages.csv'], 1)}
+        likes = [(int(row['user_id']), int(row['message_id']))
+                 for row in files['liked_by.csv']]
+
+        self.assertEqual(len(likes), 600)
+        self.assertEqual(len(set(likes)), len(likes))
+        self.assertEqual([(user_id, message_id) for user_id, message_id in likes
+                          if authors[message_id] == user_id], [])
+
+    def test_args_unchanged(self):
+        """Writing the likes doesn't change the arguments"""
+
+        args = create_csvs.parse_args(['--messages', '0'])
+
+        with tempfile.TemporaryDirectory() as out:
+            create_csvs.write_likes(os.path.join(out, 'liked_by.csv'), args,
+                                    Random(0))
+
+        self.assertEqual(args.likes, 3000)
@@ -0,0 +1,118 @@
+"""Index usage tests for the hot read queries."""
+
+# run these tests like:
+#
+#    python -m unittest test_indexes.py
+
+
+from unittest import TestCase
+
+from models import db, Follows, Message, LikedBy, TimelineEntry, TrendingScore
+
+from testing import app
+
+db.create_all()
+
+
+def query_plan(query):
+    """EXPLAIN `query` and return the plan as one string.
+
+    The test tables are tiny, so on PostgreSQL sequential and bitmap scans
+    are turned off for the transaction; otherwise the planner would rightly
+    prefer reading the whole table and sorting it.
+    """
+
+    statement = query.statement
+    compiled = statement.compile(dialect=db.engine.dialect,
+                                 compile_kwargs={'render_postcompile': True})
+    conn = db.session.connection()
+
+    if db.engine.dialect.name == 'postgresql':
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        conn.exec_driver_sql('SET LOCAL enable_bitmapscan = off')
+        explain = 'EXPLAIN '
+    else:
+        explain = 'EXPLAIN QUERY PLAN '
+
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    rows = conn.exec_driver_sql(explain + str(compiled), params)
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+class IndexTestCase(TestCase):
+    """Test that timeline, relationship and trending queries are index scans."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def assertUsesIndex(self, query, index):
+        plan = query_plan(query)
+        self.assertIn(index, plan, plan)
+
+    def test_user_messages(self):
+        """A user's newest messages come from ix_messages_user_timestamp"""
+
+        query = (Message.by_user(1)
+                 .order_by(Message.timestamp.desc(), Message.id.desc())
+                 .limit(50))
+        self.assertUsesIndex(query, 'ix_messages_user_timestamp')
+
+    def test_timeline_fallback(self):
+        """Followed users' messages come from ix_messages_user_timestamp"""
+
+        query = (Message.query
+                 .filter(Message.user_id.in_([1, 2, 3]))
+                 .order_by(Message.timestamp.desc(), Message.id.desc())
+                 .limit(50))
+        self.assertUsesIndex(query, 'ix_messages_user_timestamp')
+
+    def test_timeline_entries(self):
+        """A home timeline page comes from ix_timelines_user_timestamp"""
+
+        query = (TimelineEntry.query
+                 .filter(TimelineEntry.user_id == 1)
+                 .order_by(TimelineEntry.timestamp.desc(),
+                           TimelineEntry.message_id.desc())
+                 .limit(50))
+        self.assertUsesIndex(query, 'ix_timelines_user_timestamp')
+
+    def test_following(self):
+        """Who a user follows comes from ix_follows_user_following_id"""
+
+        query = Follows.query.filter(Follows.user_following_id == 1)
+        self.assertUsesIndex(query, 'ix_follows_user_following_id')
+
+    def test_followers(self):
+        """A user's followers come from the follows primary key"""
+
+        if db.engine.dialect.name == 'postgresql':
+            index = 'follows_pkey'
+        else:
+            index = 'sqlite_autoindex_follows_1'
+
+        query = Follows.query.filter(Follows.user_being_followed_id == 1)
+        self.assertUsesIndex(query, index)
+
+    def test_likes_of_message(self):
+        """Likes of a message come from ix_likes_message_id"""
+
+        query = LikedBy.query.filter(LikedBy.message_id == 1)
+        self.assertUsesIndex(query, 'ix_likes_message_id')
+
+    def test_trending(self):
+        """The top trending scores come from ix_trending_scores_score"""
+
+        query = (TrendingScore.query
+                 .order_by(TrendingScore.score.desc(),
+                           TrendingScore.message_id.desc())
+                 .limit(50))
+        self.assertUsesIndex(query, 'ix_trending_scores_score')
@@ -0,0 +1,176 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import select, update
+
+from models import db, Job
+
+from testing import app
+from jobs import enqueue, job, renew_lease, work_off
+
+db.create_all()
+
+ran = []
+
+
+@job
+def record(value):
+    ran.append(value)
+
+
+@job
+def explode():
+    raise RuntimeError("boom")
+
+
+@job
+def renewing(steal):
+    renew_lease()
+    ran.append(db.session.scalar(select(Job.locked_at)))
+
+    if steal:
+        # another worker claims the job after its lease expired
+        with db.engine.begin() as other:
+            other.execute(update(Job).values(locked_by='elsewhere'))
+
+
+class JobTestCase(TestCase):
+    """Test queuing, claiming and retrying jobs."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        Job.query.delete()
+        db.session.commit()
+        ran.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_enqueue_is_transactional(self):
+        """Jobs are queued with the caller's commit, and not on rollback"""
+
+        enqueue(record, value='rolled back')
+        db.session.rollback()
+
+        enqueue(record, value='committed')
+        db.session.commit()
+
+        self.assertEqual(work_off(), 1)
+        self.assertEqual(ran, ['committed'])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_jobs_run_in_order(self):
+        """Due jobs run oldest first; future ones wait"""
+
+        later = datetime.utcnow() + timedelta(hours=1)
+        enqueue(record, value='later', run_at=later)
+        enqueue(record, value='first')
+        enqueue(record, value='second')
+        db.session.commit()
+
+        self.assertEqual(work_off(), 2)
+        self.assertEqual(ran, ['first', 'second'])
+        self.assertEqual(Job.query.one().args, {'value': 'later'})
+
+    def test_retry_with_backoff(self):
+        """A failing job is retried later, and kept once out of attempts"""
+
+        queued = enqueue(explode)
+        db.session.commit()
+        job_id = queued.id
+
+        self.assertEqual(work_off(), 1)
+
+        failed = db.session.get(Job, job_id)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIsNone(failed.locked_by)
+        self.assertIn('boom', failed.last_error)
+        self.assertGreater(failed.run_at,
+                           datetime.utcnow() + timedelta(seconds=5))
+
+        failed.run_at = datetime.utcnow()
+        db.session.commit()
+
+        app.config['JOB_BACKOFF'] = 0
+        try:
+            self.assertEqual(work_off(), 4)
+        finally:
+            app.config['JOB_BACKOFF'] = 10
+
+        db.session.expire_all()
+        failed = db.session.get(Job, job_id)
+        self.assertEqual(failed.attempts, 5)
+        self.assertIsNotNone(failed.failed_at)
+        self.assertEqual(work_off(), 0)
+
+    def test_leases(self):
+        """Jobs leased by a live worker are skipped; expired leases aren't"""
+
+        queued = enqueue(record, value='leased')
+        queued.locked_by = 'elsewhere'
+        queued.locked_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertEqual(work_off(), 0)
+
+        queued.locked_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+
+        self.assertEqual(work_off(), 1)
+        self.assertEqual(ran, ['leased'])
+
+    def test_renew_lease(self):
+        """A running job can extend its lease"""
+
+        queued = enqueue(renewing, steal=False)
+        db.session.commit()
+        job_id = queued.id
+
+        started = datetime.utcnow()
+        self.assertEqual(work_off(), 1)
+        self.assertGreaterEqual(ran[0], started)
+        self.assertIsNone(db.session.get(Job, job_id))
+
+    def test_lost_lease(self):
+        """A job claimed by another worker meanwhile is left to it"""
+
+        queued = enqueue(renewing, steal=True)
+        db.session.commit()
+        job_id = queued.id
+
+        self.assertEqual(work_off(), 1)
+
+        db.session.expire_all()
+        stolen = db.session.get(Job, job_id)
+        self.assertEqual(stolen.locked_by, 'elsewhere')
+        self.assertEqual(stolen.attempts, 1)
+        self.assertIsNone(stolen.last_error)
+
+        with app.test_request_context():
+            self.assertIsNone(renew_lease())
+
+    def test_skip_locked(self):
+        """Rows locked by another transaction are skipped, not waited on"""
+
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest("SKIP LOCKED is PostgreSQL only")
+
+        enqueue(record, value='locked')
+        db.session.commit()
+
+        with db.engine.connect() as other:
+            with other.begin():
+                other.execute(select(Job.id).with_for_update())
+                self.assertEqual(work_off(), 0)
+
+        self.assertEqual(work_off(), 1)
@@ -0,0 +1,155 @@
+"""Like and unlike tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+from user_cache import invalidate_user
+
+db.create_all()
+
+
+class LikeTestCase(TestCase):
+    """Test idempotent likes, unlikes and batches of them."""
+
+    def setUp(self):
+        """Create a liker, and an author with three messages."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+
+        self.client = app.test_client()
+
+        liker = User.signup("liker", "liker@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+
+        self.id = liker.id
+        self.author_id = author.id
+        invalidate_user(self.id)
+        invalidate_user(self.author_id)
+
+        msgs = [Message(text=f"warble {i}", user_id=self.author_id)
+                for i in range(3)]
+        own = Message(text="my own", user_id=self.id)
+        db.session.add_all(msgs + [own])
+        db.session.commit()
+
+        self.message_ids = [msg.id for msg in msgs]
+        self.own_id = own.id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def like_count(self):
+        db.session.expire_all()
+        return User.query.get(self.id).like_count
+
+    def test_like_twice(self):
+        """A double-clicked like is one like"""
+
+        for _ in range(2):
+            resp = self.client.post(f'/messages/{self.message_ids[0]}/like')
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(LikedBy.query.filter_by(user_id=self.id).count(), 1)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_unlike_twice(self):
+        """Unliking something no longer liked changes nothing"""
+
+        self.client.post(f'/messages/{self.message_ids[0]}/like')
+
+        for _ in range(2):
+            resp = self.client.post(f'/messages/{self.message_ids[0]}/unlike')
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(LikedBy.query.count(), 0)
+        self.assertEqual(self.like_count(), 0)
+
+    def test_unlikeable(self):
+        """Own messages can't be liked; missing ones are a 404"""
+
+        resp = self.client.post(f'/messages/{self.own_id}/like',
+                                follow_redirects=True)
+        self.assertIn("You can&#39;t like your own warble!",
+                      resp.get_data(as_text=True))
+
+        resp = self.client.post('/messages/999999/like')
+        self.assertEqual(resp.status_code, 404)
+
+        self.assertEqual(LikedBy.query.count(), 0)
+        self.assertEqual(self.like_count(), 0)
+
+    def test_like_is_one_statement(self):
+        """On PostgreSQL the like and the counter change are one statement"""
+
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest("data-modifying CTEs are PostgreSQL only")
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.client.post(f'/messages/{self.message_ids[0]}/like')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+        writes = [sql for sql in statements
+                  if 'likes' in sql and not sql.lstrip().startswith('SELECT')]
+        self.assertEqual(len(writes), 1, writes)
+        self.assertIn('UPDATE users', writes[0])
+
+    def test_batch(self):
+        """The batch endpoint reports only what changed"""
+
+        self.client.post(f'/messages/{self.message_ids[2]}/like')
+
+        body = {'like': self.message_ids[:2] + [self.own_id],
+                'unlike': [self.message_ids[2]]}
+        resp = self.client.post('/api/v1/likes', json=body)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), {'liked': self.message_ids[:2],
+                                           'unliked': [self.message_ids[2]]})
+        self.assertEqual(self.like_count(), 2)
+
+        resp = self.client.post('/api/v1/likes', json=body)
+        self.assertEqual(resp.get_json(), {'liked': [], 'unliked': []})
+        self.assertEqual(self.like_count(), 2)
+
+    def test_batch_rejects_bad_bodies(self):
+        """Batches must be JSON lists of ids, liked or unliked, not both"""
+
+        message_id = self.message_ids[0]
+
+        for body in [{'like': [message_id], 'unlike': [message_id]},
+                     {'like': ['1']},
+                     {'like': list(range(101))}]:
+            resp = self.client.post('/api/v1/likes', json=body)
+            self.assertEqual(resp.status_code, 400, body)
+
+        resp = self.client.post('/api/v1/likes',
+                                data={'like': str(message_id)})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.like_count(), 0)
@@ -1,14 +1,10 @@
-import os
 from unittest import TestCase
 
 from models import db, User, Message, Follows, LikedBy
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-from app import app, db
+from app import db
+from testing import app
 from sqlalchemy.exc import IntegrityError
-app.config['WTF_CSRF_ENABLED'] = False
-app.config['TESTING'] = True
 
 db.create_all()
 
@@ -115,3 +111,19 @@ class MessageModelTestCase(TestCase):
 
 
 
+
+    def test_liked_message_ids(self):
+        """Tests the liked-by-viewer lookup for a page of messages"""
+
+        liked = Message(text="liked", user_id=self.id)
+        other = Message(text="not liked", user_id=self.id)
+        db.session.add_all([liked, other])
+        db.session.commit()
+
+        db.session.add(LikedBy(user_id=self.id, message_id=liked.id))
+        db.session.commit()
+
+        user1 = User.query.get(self.id)
+
+        self.assertEqual(user1.liked_message_ids([liked.id, other.id]), {liked.id})
+        self.assertEqual(user1.liked_message_ids([]), set())
@@ -0,0 +1,102 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiler.py
+
+
+from unittest import TestCase
+
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import profiler
+from models import db, User, Message, Follows
+
+from app import CURR_USER_KEY
+from testing import app
+
+db.create_all()
+
+
+def hook_profiler():
+    """Hook the profiler into the shared app as `init_profiler` does, in a
+    way `unhook_profiler` can undo, so other test modules aren't profiled."""
+
+    event.listen(Engine, 'before_cursor_execute',
+                 profiler._before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute',
+                 profiler._after_cursor_execute)
+    before_render_template.connect(profiler._start_render, app)
+    template_rendered.connect(profiler._finish_render, app)
+    # app.before_request() can't be called once the app has served requests
+    app.before_request_funcs.setdefault(None, []).append(
+        profiler._start_request)
+    app.after_request_funcs.setdefault(None, []).append(
+        profiler._finish_request)
+
+
+def unhook_profiler():
+    event.remove(Engine, 'before_cursor_execute',
+                 profiler._before_cursor_execute)
+    event.remove(Engine, 'after_cursor_execute',
+                 profiler._after_cursor_execute)
+    before_render_template.disconnect(profiler._start_render, app)
+    template_rendered.disconnect(profiler._finish_render, app)
+    app.before_request_funcs[None].remove(profiler._start_request)
+    app.after_request_funcs[None].remove(profiler._finish_request)
+
+
+class ProfilerTestCase(TestCase):
+    """Test the Server-Timing header and slow-request log."""
+
+    def setUp(self):
+        """Create a logged-in test client."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        hook_profiler()
+        self.addCleanup(unhook_profiler)
+        self.client = app.test_client()
+
+        user = User.signup(
+                username="test_user",
+                password="test_password",
+                email="test1@test.com",
+                image_url="test.com",
+            )
+        db.session.commit()
+        self.id = user.id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        app.config['PROFILE_SLOW_REQUEST_MS'] = 500
+
+    def test_server_timing_header(self):
+        """Profiled responses report db, template and total time"""
+
+        response = self.client.get('/users')
+        timing = response.headers['Server-Timing']
+
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_slow_request_log(self):
+        """Requests over the threshold are logged with their slowest query"""
+
+        app.config['PROFILE_SLOW_REQUEST_MS'] = 0
+
+        with self.assertLogs('warbler.profiler', level='WARNING') as logs:
+            self.client.get('/users')
+
+        self.assertIn('"endpoint": "warbler.list_users"', logs.output[0])
+        self.assertIn('"slowest_sql": "SELECT', logs.output[0])
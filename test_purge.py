@@ -0,0 +1,242 @@
+"""Account deletion and purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purge.py
+
+
+from threading import Thread
+from unittest import TestCase, skipIf
+
+from sqlalchemy import delete
+
+from models import (db, AccountPurge, Job, User, Message, Follows, LikedBy,
+                    TimelineEntry)
+
+from app import CURR_USER_KEY
+from testing import app
+from counters import reconcile_counters
+from jobs import work_off
+from purge import _delete_chunk
+from user_cache import invalidate_user
+
+db.create_all()
+
+COUNTERS = ('message_count', 'follower_count', 'following_count',
+            'like_count')
+
+
+class PurgeTestCase(TestCase):
+    """Test deleting an account that follows, is followed and has likes."""
+
+    def setUp(self):
+        """Create a doomed user tangled up with two others."""
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+        TimelineEntry.query.delete()
+        AccountPurge.query.delete()
+        Job.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ("doomed", "friend", "fan")]
+        db.session.commit()
+
+        self.id, self.friend_id, self.fan_id = [user.id for user in users]
+        for user_id in (self.id, self.friend_id, self.fan_id):
+            invalidate_user(user_id)
+
+        for follower, followed in [(self.id, self.friend_id),
+                                   (self.friend_id, self.id),
+                                   (self.fan_id, self.id)]:
+            self.login(follower)
+            self.client.post(f'/users/follow/{followed}')
+
+        # warm the friend's and fan's timelines so they get fan-out
+        for user_id in (self.friend_id, self.fan_id):
+            self.login(user_id)
+            self.client.get('/')
+
+        self.login(self.id)
+        for i in range(3):
+            self.client.post('/messages/new', data={"text": f"warble {i}"})
+
+        self.login(self.friend_id)
+        self.client.post('/messages/new', data={"text": "friendly"})
+
+        doomed_ids = [msg.id for msg in Message.by_user(self.id)]
+        for message_id in doomed_ids:
+            self.login(self.fan_id)
+            self.client.post(f'/messages/{message_id}/like')
+
+        self.login(self.id)
+        friendly = Message.by_user(self.friend_id).one()
+        self.client.post(f'/messages/{friendly.id}/like')
+
+        work_off()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        for user_id in (self.id, self.friend_id, self.fan_id):
+            invalidate_user(user_id)
+        self.ctx.pop()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = user_id
+
+    def counters(self, user_id):
+        user = db.session.get(User, user_id)
+        return {name: getattr(user, name) for name in COUNTERS}
+
+    def test_delete_hides_user(self):
+        """Deleting marks the account and hides it before any purge"""
+
+        self.client.post('/users/delete')
+        db.session.expire_all()
+
+        self.assertIsNotNone(db.session.get(User, self.id).deleted_at)
+        self.assertEqual(AccountPurge.query.get(self.id).step,
+                         'likes_received')
+
+        self.assertEqual(self.client.get(f'/users/{self.id}').status_code, 404)
+
+        self.login(self.fan_id)
+        following = self.client.get(f'/users/{self.fan_id}/following')
+        self.assertNotIn('@doomed', following.get_data(as_text=True))
+
+        resp = self.client.post('/login', data={'username': 'doomed',
+                                                'password': 'password'})
+        self.assertIn('Invalid credentials', resp.get_data(as_text=True))
+
+    def test_delete_hides_messages_and_counts(self):
+        """Until the purge, the user's messages, follows and likes are
+        hidden, and can't be added to or taken away"""
+
+        doomed_ids = [msg.id for msg in Message.by_user(self.id)]
+        self.client.post('/users/delete')
+        db.session.expire_all()
+
+        self.login(self.fan_id)
+        home = self.client.get('/').get_data(as_text=True)
+        likes = self.client.get(f'/users/{self.fan_id}/likes')
+        for i in range(3):
+            self.assertNotIn(f"warble {i}", home)
+            self.assertNotIn(f"warble {i}", likes.get_data(as_text=True))
+        timeline = self.client.get('/api/v1/timeline').get_json()
+        self.assertEqual(timeline['messages'], [])
+
+        self.assertEqual(self.counters(self.friend_id),
+                         dict(message_count=1, follower_count=0,
+                              following_count=0, like_count=0))
+        self.assertEqual(self.counters(self.fan_id),
+                         dict(message_count=0, follower_count=0,
+                              following_count=0, like_count=0))
+
+        self.client.post(f'/messages/{doomed_ids[0]}/unlike')
+        self.assertEqual(
+            self.client.post(f'/users/stop-following/{self.id}').status_code,
+            404)
+        self.login(self.friend_id)
+        self.client.post(f'/messages/{doomed_ids[0]}/like')
+        self.assertEqual(
+            self.client.post(f'/users/follow/{self.id}').status_code, 404)
+
+        db.session.expire_all()
+        counters = [self.counters(user_id)
+                    for user_id in (self.friend_id, self.fan_id)]
+        self.assertEqual(counters[0]['like_count'], 0)
+        self.assertEqual(counters[1]['following_count'], 0)
+        self.assertEqual(LikedBy.query.filter_by(user_id=self.fan_id).count(),
+                         3)
+
+        reconcile_counters()
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(counters, [self.counters(user_id)
+                                    for user_id in (self.friend_id,
+                                                    self.fan_id)])
+
+    def test_purge_removes_rows_and_keeps_counters(self):
+        """Purging in small chunks leaves no rows and exact counters"""
+
+        self.client.post('/users/delete')
+        app.config['PURGE_CHUNK_SIZE'] = 1
+        try:
+            self.assertEqual(work_off(), 1)
+        finally:
+            app.config['PURGE_CHUNK_SIZE'] = 1000
+
+        self.assertIsNone(db.session.get(User, self.id))
+        self.assertEqual(Message.by_user(self.id).count(), 0)
+        self.assertEqual(LikedBy.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(author_id=self.id).count(), 0)
+
+        purge = AccountPurge.query.get(self.id)
+        self.assertEqual(purge.step, 'user')
+        self.assertIsNotNone(purge.finished_at)
+        # 3 likes received, 1 given, 3 follows, 6 entries on others'
+        # timelines (their own was never warmed), 3 messages and the user
+        self.assertEqual(purge.rows_deleted, 17)
+
+        self.assertEqual(self.counters(self.friend_id),
+                         dict(message_count=1, follower_count=0,
+                              following_count=0, like_count=0))
+        self.assertEqual(self.counters(self.fan_id),
+                         dict(message_count=0, follower_count=0,
+                              following_count=0, like_count=0))
+
+        counters = [self.counters(user_id)
+                    for user_id in (self.friend_id, self.fan_id)]
+        reconcile_counters()
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(counters, [self.counters(user_id)
+                                    for user_id in (self.friend_id,
+                                                    self.fan_id)])
+
+        self.assertEqual(work_off(), 0)
+
+    @skipIf(db.engine.dialect.name != 'postgresql',
+            "SQLite has no concurrent writers")
+    def test_chunk_skips_rows_deleted_meanwhile(self):
+        """A chunk only returns the rows it deleted itself"""
+
+        liked = sorted(like.message_id for like
+                       in LikedBy.query.filter_by(user_id=self.fan_id))
+        db.session.commit()
+
+        other = db.engine.connect()
+        unliking = other.begin()
+        other.execute(delete(LikedBy).where(LikedBy.user_id == self.fan_id,
+                                            LikedBy.message_id == liked[0]))
+
+        deleted = []
+
+        def purge():
+            with app.app_context():
+                deleted.extend(_delete_chunk(
+                    LikedBy, LikedBy.user_id == self.fan_id, 10))
+                db.session.commit()
+
+        thread = Thread(target=purge)
+        thread.start()
+        # the chunk waits for the unlike to commit
+        thread.join(0.5)
+        unliking.commit()
+        other.close()
+        thread.join()
+
+        self.assertEqual(sorted(message_id for _, message_id in deleted),
+                         liked[1:])
@@ -0,0 +1,128 @@
+"""SQL statement budget tests for list pages."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_counts.py
+
+
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, LikedBy
+
+from app import CURR_USER_KEY
+from testing import app
+
+db.create_all()
+
+NUM_AUTHORS = 10
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run inside the block."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class QueryCountTestCase(TestCase):
+    """Each page runs a fixed number of statements however long its list is."""
+
+    def setUp(self):
+        """Create a viewer who follows, and likes messages from, 10 authors."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        viewer = User(username="viewer", email="viewer@test.com",
+                      password="HASHED_PASSWORD")
+        authors = [User(username=f"author{i}", email=f"author{i}@test.com",
+                        password="HASHED_PASSWORD")
+                   for i in range(NUM_AUTHORS)]
+        db.session.add_all([viewer, *authors])
+        db.session.commit()
+
+        viewer.following.extend(authors)
+        for author in authors:
+            author.following.append(viewer)
+            author.messages.extend(Message(text=f"{author.username} {i}")
+                                   for i in range(3))
+        db.session.commit()
+
+        db.session.add_all(LikedBy(user_id=viewer.id, message_id=msg.id)
+                           for msg in Message.query.all())
+        db.session.commit()
+
+        self.id = viewer.id
+        self.author_id = authors[0].id
+        self.message_id = authors[0].messages[0].id
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.id
+
+        # build the viewer's home timeline up front
+        self.client.get('/')
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+
+    def assertMaxQueries(self, url, max_queries):
+        """Fetch `url` and check it ran at most `max_queries` statements."""
+
+        with count_queries() as statements:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(statements), max_queries,
+                             "\n".join(statements))
+
+    def test_homepage_queries(self):
+        """Home timeline has no N+1 queries"""
+
+        self.assertMaxQueries('/', 6)
+
+    def test_list_users_queries(self):
+        """User listing has no N+1 queries"""
+
+        self.assertMaxQueries('/users', 3)
+
+    def test_user_profile_queries(self):
+        """User profile has no N+1 queries"""
+
+        self.assertMaxQueries(f'/users/{self.author_id}', 5)
+
+    def test_likes_queries(self):
+        """Likes page has no N+1 queries"""
+
+        self.assertMaxQueries(f'/users/{self.id}/likes', 2)
+
+    def test_following_queries(self):
+        """Following page has no N+1 queries"""
+
+        self.assertMaxQueries(f'/users/{self.id}/following', 3)
+
+    def test_followers_queries(self):
+        """Followers page has no N+1 queries"""
+
+        self.assertMaxQueries(f'/users/{self.id}/followers', 3)
+
+    def test_message_queries(self):
+        """Single message page has no N+1 queries"""
+
+        self.assertMaxQueries(f'/messages/{self.message_id}', 4)
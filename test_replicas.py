@@ -0,0 +1,112 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message, Follows
+
+from app import CURR_USER_KEY
+from testing import app
+from user_cache import invalidate_user
+
+db.create_all()
+
+# only ever in the replica
+REPLICA_USER_ID = 999999
+
+
+class ReplicaTestCase(TestCase):
+    """Test which pages read from a replica that's a separate database."""
+
+    def setUp(self):
+        """Make an empty replica with one user the primary doesn't have."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        writer = User.signup("writer", "writer@test.com", "password", None)
+        db.session.commit()
+        self.writer_id = writer.id
+        invalidate_user(self.writer_id)
+
+        self.dir = TemporaryDirectory()
+        self.replica = create_engine(
+            f"sqlite:///{os.path.join(self.dir.name, 'replica.db')}")
+        db.metadata.create_all(self.replica)
+
+        with self.replica.begin() as connection:
+            connection.execute(User.__table__.insert().values(
+                id=REPLICA_USER_ID, username="replicated",
+                email="replicated@test.com", password="x"))
+
+        app.extensions['replica_engine'] = self.replica
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.extensions['replica_engine'] = None
+        self.replica.dispose()
+        self.dir.cleanup()
+
+    def test_reads_use_replica(self):
+        """Read-only pages read the replica; others the primary"""
+
+        resp = self.client.get(f'/users/{REPLICA_USER_ID}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('@replicated', resp.get_data(as_text=True))
+
+        self.assertEqual(
+            self.client.get(f'/users/{self.writer_id}').status_code, 404)
+
+        # not marked read-only
+        resp = self.client.get(f'/api/v1/users/{self.writer_id}/messages')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_no_replica(self):
+        """Without a replica everything reads the primary"""
+
+        app.extensions['replica_engine'] = None
+
+        self.assertEqual(
+            self.client.get(f'/users/{REPLICA_USER_ID}').status_code, 404)
+        self.assertEqual(
+            self.client.get(f'/users/{self.writer_id}').status_code, 200)
+
+    def test_read_your_writes(self):
+        """After writing, the writer's pages read the primary for a while"""
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.writer_id
+
+        self.client.post('/messages/new', data={'text': 'fresh'})
+
+        resp = self.client.get(f'/users/{self.writer_id}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('fresh', resp.get_data(as_text=True))
+
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        try:
+            self.client.post('/messages/new', data={'text': 'fresher'})
+            self.assertEqual(
+                self.client.get(f'/users/{self.writer_id}').status_code, 404)
+        finally:
+            app.config['REPLICA_STICKY_SECONDS'] = 5
+
+    def test_lagging_replica(self):
+        """A replica lagging more than REPLICA_MAX_LAG isn't used"""
+
+        app.config['REPLICA_MAX_LAG'] = -1
+        try:
+            self.assertEqual(
+                self.client.get(f'/users/{self.writer_id}').status_code, 200)
+        finally:
+            app.config['REPLICA_MAX_LAG'] = 5
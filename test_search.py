@@ -0,0 +1,86 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+from app import CURR_USER_KEY
+from testing import app
+from search import search_users, autocomplete_users
+
+db.create_all()
+
+
+class SearchTestCase(TestCase):
+    """Test ranked user search and autocomplete."""
+
+    def setUp(self):
+        """Create a few users with overlapping names."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.client = app.test_client()
+
+        for username in ["bobcat", "Bob", "jimbob", "bobby_tables", "alice"]:
+            db.session.add(User(username=username,
+                                email=f"{username}@test.com",
+                                password="HASHED_PASSWORD",
+                                location="Oakland"))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_search_ranking(self):
+        """Exact matches come first, then prefixes, then other matches"""
+
+        users = search_users("bob", limit=10)
+
+        self.assertEqual([user.username for user in users],
+                         ["Bob", "bobcat", "bobby_tables", "jimbob"])
+
+    def test_search_limit(self):
+        """Search results are limited"""
+
+        self.assertEqual(len(search_users("bob", limit=2)), 2)
+
+    def test_search_escapes_wildcards(self):
+        """LIKE wildcards in the search are matched literally"""
+
+        self.assertEqual([user.username for user in search_users("y_t", 10)],
+                         ["bobby_tables"])
+        self.assertEqual(search_users("b%b", 10), [])
+
+    def test_search_profiles(self):
+        """Bios and locations are only searched when SEARCH_PROFILES is on"""
+
+        self.assertEqual(search_users("oakland", 10), [])
+
+        app.config['SEARCH_PROFILES'] = True
+        try:
+            self.assertEqual(len(search_users("oakland", 10)), 5)
+        finally:
+            app.config['SEARCH_PROFILES'] = False
+
+    def test_autocomplete(self):
+        """Autocomplete returns prefix matches in username order"""
+
+        users = autocomplete_users("BO")
+        self.assertEqual([user.username for user in users],
+                         ["Bob", "bobby_tables", "bobcat"])
+
+        response = self.client.get('/users/autocomplete?q=al')
+        self.assertEqual(response.json[0]["username"], "alice")
@@ -0,0 +1,168 @@
+"""Seed loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_seed.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from models import db, User, Message, Follows, LikedBy
+
+from testing import app
+from seed import seed
+
+db.create_all()
+
+# seeding drops and recreates every table, so it gets a database of its own
+# (`<test database>_seed`), leaving the other tests' alone
+SEED_SUFFIX = '_seed'
+
+
+def _create_database(url):
+    """Create the empty database `url`, replacing any left over."""
+
+    with db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{url.database}"'))
+        connection.execute(text(f'CREATE DATABASE "{url.database}"'))
+
+
+def _drop_database(url):
+    with db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{url.database}"'))
+
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+
+def write_csv(path, headers, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+class SeedTestCase(TestCase):
+    """Test loading CSVs in chunks, and resuming a partial load."""
+
+    def setUp(self):
+        """Write a small data set to a temporary directory."""
+
+        self.dir = tempfile.TemporaryDirectory()
+        data = self.dir.name
+
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+        if url.get_backend_name() == 'postgresql':
+            self.url = url.set(database=url.database + SEED_SUFFIX)
+            _create_database(self.url)
+        else:
+            self.url = make_url(f"sqlite:///{os.path.join(data, 'seed.db')}")
+
+        self.engine = create_engine(self.url)
+
+        self.session = Session(self.engine)
+
+        write_csv(os.path.join(data, 'users.csv'),
+                  ['email', 'username', 'image_url', 'password', 'bio',
+                   'header_image_url', 'location'],
+                  [[f'u{i}@test.com', f'user{i}', '', PASSWORD, 'bio', '', '']
+                   for i in range(1, 6)])
+
+        write_csv(os.path.join(data, 'messages.csv'),
+                  ['text', 'timestamp', 'user_id'],
+                  [[f'warble {i}', f'2021-01-0{i} 12:00:00', i % 5 + 1]
+                   for i in range(1, 8)])
+
+        write_csv(os.path.join(data, 'follows.csv'),
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[1, 2], [1, 3], [1, 4], [2, 1]])
+
+        write_csv(os.path.join(data, 'liked_by.csv'),
+                  ['user_id', 'message_id'],
+                  [[1, 1], [1, 2], [2, 1]])
+
+    def tearDown(self):
+        """Drop the seeded database."""
+
+        self.session.close()
+        self.engine.dispose()
+
+        if self.engine.dialect.name == 'postgresql':
+            _drop_database(self.url)
+
+        self.dir.cleanup()
+
+    def seed(self, **kwargs):
+        seed(self.dir.name, chunk_size=2, engine=self.engine, **kwargs)
+        self.session.expire_all()
+
+    def count(self, model):
+        return self.session.query(model).count()
+
+    def test_seed(self):
+        self.seed()
+
+        self.assertEqual(self.count(User), 5)
+        self.assertEqual(self.count(Message), 7)
+        self.assertEqual(self.count(Follows), 4)
+        self.assertEqual(self.count(LikedBy), 3)
+
+        # ids are CSV line numbers and counters are built after the load
+        user1 = self.session.get(User, 1)
+        self.assertEqual(user1.username, 'user1')
+        self.assertEqual(user1.follower_count, 3)
+        self.assertEqual(user1.following_count, 1)
+        self.assertEqual(user1.like_count, 2)
+        self.assertEqual(self.session.get(Message, 4).user_id, 5)
+
+        # indexes and foreign keys were added afterwards
+        inspector = inspect(self.engine)
+        self.assertIn('ix_timelines_user_timestamp',
+                      [i['name'] for i in inspector.get_indexes('timelines')])
+
+        if self.engine.dialect.name == 'postgresql':
+            self.assertTrue(inspector.get_foreign_keys('likes'))
+
+        # new rows don't collide with the loaded ids
+        user = User(username='newbie', email='new@test.com',
+                    password=PASSWORD)
+        self.session.add(user)
+        self.session.commit()
+        self.assertEqual(user.id, 6)
+
+    def test_resume(self):
+        self.seed()
+
+        # lose the end of two tables, as if the load had died part way
+        self.session.query(LikedBy).filter(LikedBy.user_id == 2).delete()
+        self.session.query(Message).filter(Message.id > 4).delete()
+        self.session.commit()
+
+        self.seed(resume=True)
+
+        self.assertEqual(self.count(User), 5)
+        self.assertEqual(self.count(Message), 7)
+        self.assertEqual(self.count(LikedBy), 3)
+        self.assertEqual(self.session.get(Message, 7).text, 'warble 7')
+
+    def test_leaves_app_database(self):
+        """Seeding doesn't touch the app's own tables"""
+
+        user = User.signup('bystander', 'by@test.com', 'password', None)
+        db.session.commit()
+
+        try:
+            self.seed()
+            self.assertIsNotNone(db.session.get(User, user.id))
+        finally:
+            db.session.delete(user)
+            db.session.commit()
@@ -0,0 +1,50 @@
+"""Startup time tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_startup.py
+
+
+from unittest import TestCase
+
+import startup
+from testing import app
+
+
+class StartupTestCase(TestCase):
+    """Test that the app is quick to import and build."""
+
+    def test_within_budget(self):
+        """A fresh process imports and builds the app within budget"""
+
+        measured = startup.measure(runs=1, config='testing')
+
+        self.assertEqual(measured.pop('dev_only_modules'), [])
+        self.assertEqual(set(measured), {'import', 'create_app'})
+        self.assertLess(sum(measured.values()),
+                        app.config['STARTUP_BUDGET'] * 1000)
+
+    def test_over_budget(self):
+        """Startup over budget is logged as a warning"""
+
+        budget = app.config['STARTUP_BUDGET']
+        app.config['STARTUP_BUDGET'] = 0.000001
+        try:
+            with self.assertLogs('warbler.startup', 'WARNING') as logs:
+                startup.report(app)
+        finally:
+            app.config['STARTUP_BUDGET'] = budget
+
+        self.assertIn('over the', logs.output[0])
+
+    def test_metrics(self):
+        """This process's startup times are in /metrics"""
+
+        app.config['METRICS_TOKEN'] = 'secret'
+        try:
+            resp = app.test_client().get(
+                '/metrics', headers={'Authorization': 'Bearer secret'})
+        finally:
+            app.config['METRICS_TOKEN'] = None
+
+        self.assertIn('create_app', resp.get_json()['startup'])
@@ -0,0 +1,189 @@
+"""Live timeline stream tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_stream.py
+
+
+import json
+from threading import Timer
+from time import monotonic, time
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+from app import CURR_USER_KEY
+from testing import app
+from stream import Announcement, Broker, broker, stream_stats
+from user_cache import invalidate_user
+
+db.create_all()
+
+
+def announcement(message_id, author_id):
+    data = {'message': {'id': message_id, 'user_id': author_id},
+            'user': {'id': author_id}}
+    return Announcement(message_id, author_id, json.dumps(data).encode(),
+                        time())
+
+
+class BrokerTestCase(TestCase):
+    """Test handing announcements to the streams that want them."""
+
+    def test_publish_by_author(self):
+        """Streams get only their authors' messages, until they overflow"""
+
+        local = Broker()
+        mine = local.subscribe([1, 2], size=2)
+        other = local.subscribe([3])
+
+        for message_id in (10, 11):
+            local.publish(announcement(message_id, 1))
+        local.publish(announcement(12, 4))
+
+        self.assertEqual([a.message_id for a in mine.get(0)], [10, 11])
+        self.assertEqual(other.get(0), [])
+
+        for message_id in (13, 14, 15):
+            local.publish(announcement(message_id, 2))
+        self.assertTrue(mine.overflowed)
+
+        local.unsubscribe(mine)
+        local.unsubscribe(other)
+        self.assertEqual(local.stats()['open'], 0)
+        self.assertEqual(local.stats()['overflowed'], 1)
+
+
+class StreamViewTestCase(TestCase):
+    """Test the stream and long-poll endpoints."""
+
+    def setUp(self):
+        """Create a reader following a writer, and a stranger."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ("reader", "writer", "stranger")]
+        db.session.commit()
+
+        self.reader_id, self.writer_id, self.stranger_id = [u.id for u in users]
+        for user_id in (self.reader_id, self.writer_id, self.stranger_id):
+            invalidate_user(user_id)
+
+        db.session.add(Follows(user_being_followed_id=self.writer_id,
+                               user_following_id=self.reader_id))
+        old = Message(text="old news", user_id=self.writer_id)
+        db.session.add(old)
+        db.session.commit()
+        self.old_id = old.id
+
+        app.config['STREAM_KEEPALIVE'] = 0.05
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['STREAM_KEEPALIVE'] = 15
+
+    def login(self, client, user_id):
+        with client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = user_id
+
+    def post(self, user_id, text):
+        client = app.test_client()
+        self.login(client, user_id)
+        client.post('/messages/new', data={'text': text})
+
+    def read_until(self, chunks, text, timeout=5):
+        """Read stream chunks until one contains `text`; return them all."""
+
+        received = b''
+        deadline = monotonic() + timeout
+
+        while text.encode() not in received and monotonic() < deadline:
+            received += next(chunks)
+
+        return received.decode()
+
+    def test_stream(self):
+        """New messages by followed authors are pushed, others aren't"""
+
+        self.login(self.client, self.reader_id)
+        resp = self.client.get(f'/api/v1/timeline/stream?after={self.old_id}',
+                               buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        chunks = iter(resp.response)
+
+        try:
+            next(chunks)
+            self.post(self.stranger_id, "not for you")
+            self.post(self.writer_id, "hot off the press")
+
+            received = self.read_until(chunks, "hot off the press")
+            self.assertIn('event: message', received)
+            self.assertIn('"username":"writer"', received)
+            self.assertNotIn('not for you', received)
+            self.assertNotIn('old news', received)
+            self.assertEqual(stream_stats()['open'], 1)
+        finally:
+            resp.close()
+
+        self.assertEqual(stream_stats()['open'], 0)
+        self.assertIsNotNone(stream_stats()['lag_p50_ms'])
+
+    def test_stream_catches_up(self):
+        """A reconnecting stream first gets what it missed"""
+
+        self.login(self.client, self.reader_id)
+        resp = self.client.get('/api/v1/timeline/stream',
+                               headers={'Last-Event-ID': self.old_id - 1},
+                               buffered=False)
+
+        try:
+            received = self.read_until(iter(resp.response), "old news")
+            self.assertIn(f'id: {self.old_id}', received)
+        finally:
+            resp.close()
+
+    def test_long_poll(self):
+        """Long-polls return missed messages at once, or wait for one"""
+
+        self.login(self.client, self.reader_id)
+
+        resp = self.client.get(
+            f'/api/v1/timeline/updates?after={self.old_id - 1}')
+        self.assertEqual([msg['id'] for msg in resp.get_json()['messages']],
+                         [self.old_id])
+
+        resp = self.client.get(
+            f'/api/v1/timeline/updates?after={self.old_id}&wait=0')
+        self.assertEqual(resp.get_json(), {'messages': [], 'users': [],
+                                           'last_id': self.old_id})
+
+        new = announcement(self.old_id + 100, self.writer_id)
+        Timer(0.1, broker.publish, [new]).start()
+        resp = self.client.get(
+            f'/api/v1/timeline/updates?after={self.old_id}&wait=5')
+        self.assertEqual(resp.get_json()['last_id'], self.old_id + 100)
+
+        resp = self.client.get('/api/v1/timeline/updates?after=x')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_metrics(self):
+        """Metrics are only served with the token"""
+
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+        app.config['METRICS_TOKEN'] = 'sesame'
+        try:
+            resp = self.client.get('/metrics', headers={
+                'Authorization': 'Bearer sesame'})
+            self.assertIn('open', resp.get_json()['stream'])
+
+            resp = self.client.get('/metrics', headers={
+                'Authorization': 'Bearer guess'})
+            self.assertEqual(resp.status_code, 404)
+        finally:
+            app.config['METRICS_TOKEN'] = None
@@ -0,0 +1,178 @@
+"""Home timeline store tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, TimelineEntry, Job
+
+from app import CURR_USER_KEY
+from testing import app
+from jobs import enqueue, work_off
+from timelines import fan_out_message, home_timeline, warm_timeline
+
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    """Test the materialized home timelines."""
+
+    def setUp(self):
+        """Create two users, where user1 follows user2."""
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        Job.query.delete()
+        TimelineEntry.query.delete()
+
+        self.client = app.test_client()
+
+        user1 = User.signup(
+                username="test_user",
+                password="test_password",
+                email="test1@test.com",
+                image_url="test.com",
+            )
+
+        user2 = User.signup(
+                username="test_user2",
+                password="test_password2",
+                email="test2@test.com",
+                image_url="test2.com",
+            )
+
+        db.session.commit()
+
+        user1.following.append(user2)
+        db.session.commit()
+
+        self.id = user1.id
+        self.id2 = user2.id
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        self.ctx.pop()
+
+    def add_message(self, user_id, text):
+        """Post a message the same way messages_add does."""
+
+        msg = Message(text=text, user_id=user_id)
+        db.session.add(msg)
+        db.session.flush()
+        enqueue(fan_out_message, message_id=msg.id)
+        db.session.commit()
+        work_off()
+
+        return msg
+
+    def test_cold_timeline_is_warmed_on_read(self):
+        """Reading a cold timeline builds it from the messages table"""
+
+        msg = self.add_message(self.id2, "before warm")
+        user1 = User.query.get(self.id)
+
+        self.assertFalse(user1.timeline_warm)
+        self.assertEqual(home_timeline(user1).items, [msg])
+        self.assertTrue(user1.timeline_warm)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.id).count(), 1)
+
+    def test_post_fans_out_to_warm_followers(self):
+        """New messages land in warm followers' timelines only"""
+
+        warm_timeline(User.query.get(self.id))
+        msg = self.add_message(self.id2, "hello followers")
+
+        entry = TimelineEntry.query.get((self.id, msg.id))
+        self.assertIsNotNone(entry)
+        self.assertEqual(entry.author_id, self.id2)
+
+        # user2's own timeline is still cold, so nothing was pushed there
+        self.assertIsNone(TimelineEntry.query.get((self.id2, msg.id)))
+
+    def test_unfollow_prunes_timeline(self):
+        """Unfollowing removes that author's messages from the timeline"""
+
+        warm_timeline(User.query.get(self.id))
+        self.add_message(self.id2, "soon gone")
+
+        with self.client as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.id
+
+            response = client.post(f'/users/stop-following/{self.id2}')
+            self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.id).count(), 0)
+
+    def test_timeline_is_capped(self):
+        """Timelines are trimmed to TIMELINE_LENGTH as messages are pushed"""
+
+        app.config['TIMELINE_LENGTH'] = 2
+        try:
+            warm_timeline(User.query.get(self.id))
+            for i in range(4):
+                self.add_message(self.id2, f"message {i}")
+
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.id).count(), 2)
+
+            messages = home_timeline(User.query.get(self.id)).items
+            self.assertEqual(messages[0].text, "message 3")
+        finally:
+            app.config['TIMELINE_LENGTH'] = 800
+
+    def test_reading_doesnt_write(self):
+        """Reading a warm timeline runs no writes"""
+
+        warm_timeline(User.query.get(self.id))
+        self.add_message(self.id2, "read me")
+
+        statements = []
+        count = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            with self.client as client:
+                with client.session_transaction() as change_session:
+                    change_session[CURR_USER_KEY] = self.id
+
+                self.assertIn("read me", client.get('/').get_data(as_text=True))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        self.assertEqual([sql for sql in statements
+                          if not sql.lstrip().startswith('SELECT')], [])
+
+    def test_timeline_pages(self):
+        """The homepage is paginated with an opaque 'before' cursor"""
+
+        app.config['PAGE_SIZE'] = 2
+        try:
+            for i in range(3):
+                self.add_message(self.id2, f"message {i}")
+
+            with self.client as client:
+                with client.session_transaction() as change_session:
+                    change_session[CURR_USER_KEY] = self.id
+
+                html = client.get('/').get_data(as_text=True)
+                self.assertIn("message 2", html)
+                self.assertNotIn("message 0", html)
+
+                page = home_timeline(User.query.get(self.id))
+                html = client.get(f'/?before={page.next_cursor}').get_data(as_text=True)
+                self.assertIn("message 0", html)
+                self.assertNotIn("message 2", html)
+                self.assertNotIn("Older", html)
+        finally:
+            app.config['PAGE_SIZE'] = 50
@@ -0,0 +1,181 @@
+"""Trending score and page tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, Job, User, Message, Follows, LikedBy, TrendingEpoch,
+                    TrendingScore)
+
+from app import CURR_USER_KEY
+from testing import app
+from jobs import work_off
+from trending import (add_likes, compact_trending, decayed_scores,
+                      trending_messages)
+from user_cache import invalidate_user
+
+db.create_all()
+
+HALF_LIFE = app.config['TRENDING_HALF_LIFE']
+
+
+class TrendingTestCase(TestCase):
+    """Test keeping trending scores as messages are liked and unliked."""
+
+    def setUp(self):
+        """Create an author with three messages, and two fans."""
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedBy.query.delete()
+        TrendingScore.query.delete()
+        Job.query.delete()
+        db.session.get(TrendingEpoch, 1).epoch = datetime.utcnow()
+
+        self.client = app.test_client()
+
+        users = [User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ("author", "fan1", "fan2")]
+        db.session.commit()
+
+        self.author_id, self.fan1_id, self.fan2_id = [u.id for u in users]
+        for user_id in (self.author_id, self.fan1_id, self.fan2_id):
+            invalidate_user(user_id)
+
+        msgs = [Message(text=f"warble {i}", user_id=self.author_id)
+                for i in range(3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        self.message_ids = [msg.id for msg in msgs]
+
+    def tearDown(self):
+        """Clean up fouled transactions."""
+
+        db.session.rollback()
+        self.ctx.pop()
+
+    def like(self, user_id, message_id, action='like'):
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = user_id
+
+        self.client.post(f'/messages/{message_id}/{action}')
+
+    def trending_ids(self):
+        db.session.expire_all()
+        return [msg.id for msg in trending_messages()]
+
+    def scores(self):
+        db.session.expire_all()
+        return {score.message_id: decayed_scores([score.score])[0]
+                for score in TrendingScore.query}
+
+    def test_likes_and_unlikes(self):
+        """Messages rank by likes; an unlike takes its like back"""
+
+        first, second, third = self.message_ids
+        self.like(self.fan1_id, second)
+        self.like(self.fan2_id, second)
+        self.like(self.fan1_id, first)
+        self.like(self.fan1_id, first)
+
+        self.assertEqual(self.trending_ids(), [second, first])
+        scores = self.scores()
+        self.assertAlmostEqual(scores[second], 2, places=2)
+        self.assertAlmostEqual(scores[first], 1, places=2)
+
+        self.like(self.fan1_id, second, 'unlike')
+        self.like(self.fan2_id, second, 'unlike')
+        self.like(self.fan2_id, second, 'unlike')
+
+        self.assertEqual(self.trending_ids()[0], first)
+        self.assertAlmostEqual(self.scores()[second], 0, places=6)
+
+    def test_decay(self):
+        """A like counts half as much every half-life"""
+
+        first, second, _ = self.message_ids
+        now = datetime.utcnow()
+        add_likes([first, first], now - timedelta(seconds=2 * HALF_LIFE))
+        add_likes([second], now - timedelta(seconds=HALF_LIFE))
+        db.session.commit()
+
+        scores = self.scores()
+        self.assertAlmostEqual(scores[first], 0.5, places=2)
+        self.assertAlmostEqual(scores[second], 0.5, places=2)
+
+        add_likes([second], now)
+        db.session.commit()
+        self.assertEqual(self.trending_ids(), [second, first])
+
+    def test_compaction(self):
+        """Compacting keeps decayed scores, drops cold ones and requeues"""
+
+        first, second, _ = self.message_ids
+        now = datetime.utcnow()
+        db.session.get(TrendingEpoch, 1).epoch = now - timedelta(days=30)
+        add_likes([first], now)
+        add_likes([second], now - timedelta(seconds=5 * HALF_LIFE))
+        db.session.commit()
+
+        before = self.scores()
+        self.assertGreater(TrendingScore.query.get(first).score, 1e30)
+
+        compact_trending()
+        db.session.commit()
+
+        after = self.scores()
+        self.assertEqual(list(after), [first])
+        self.assertAlmostEqual(after[first], before[first], places=4)
+        self.assertAlmostEqual(TrendingScore.query.get(first).score, 1,
+                               places=2)
+
+        queued = Job.query.one()
+        self.assertEqual(queued.name, 'compact_trending')
+        self.assertGreater(queued.run_at, now)
+        self.assertEqual(work_off(), 0)
+
+    def test_deleted_messages_and_authors(self):
+        """Deleted messages lose their scores; deleted authors are hidden"""
+
+        first, second, _ = self.message_ids
+        self.like(self.fan1_id, first)
+        self.like(self.fan1_id, second)
+
+        with self.client.session_transaction() as change_session:
+            change_session[CURR_USER_KEY] = self.author_id
+        self.client.post(f'/messages/{first}/delete')
+
+        self.assertEqual(self.trending_ids(), [second])
+        self.assertIsNone(TrendingScore.query.get(first))
+
+        db.session.get(User, self.author_id).deleted_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(self.trending_ids(), [])
+
+    def test_pages(self):
+        """The page and the API are public"""
+
+        first = self.message_ids[0]
+        self.like(self.fan1_id, first)
+
+        with self.client.session_transaction() as change_session:
+            del change_session[CURR_USER_KEY]
+
+        resp = self.client.get('/trending')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('warble 0', resp.get_data(as_text=True))
+
+        resp = self.client.get('/api/v1/trending')
+        self.assertEqual(resp.status_code, 200)
+        [message] = resp.get_json()['messages']
+        self.assertEqual(message['id'], first)
+        self.assertAlmostEqual(message['score'], 1, places=2)
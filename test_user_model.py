@@ -5,26 +5,14 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from unittest import TestCase
 
 from models import db, User, Message, Follows
 from flask import session
 from sqlalchemy.exc import IntegrityError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app, db, CURR_USER_KEY
-app.config['WTF_CSRF_ENABLED'] = False
-app.config['TESTING'] = True
-
+from app import db, CURR_USER_KEY
+from testing import app
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -186,15 +174,35 @@ class UserModelTestCase(TestCase):
         self.assertIn(user2, user1.following)
         self.assertTrue(user1.is_following(user2))
 
+    def test_following_ids_cache_resets(self):
+        """Test that cached follow checks see follows and unfollows"""
 
+        user1 = User.query.get(self.id)
+        user2 = User.query.get(self.id2)
 
+        self.assertFalse(user1.is_following(user2))
 
+        user1.following.append(user2)
+        db.session.commit()
+        self.assertTrue(user1.is_following(user2))
 
-
-
-
-
-
-
-
-
+        user1.following.remove(user2)
+        db.session.commit()
+        self.assertFalse(user1.is_following(user2))
+        self.assertFalse(user2.is_followed_by(user1))
+
+    def test_rehash_on_cost_change(self):
+        """Test that logging in upgrades hashes made at an old bcrypt cost"""
+
+        log_rounds = app.config['BCRYPT_LOG_ROUNDS']
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        try:
+            with app.app_context():
+                user = User.authenticate("test_user", "test_password")
+                self.assertTrue(user.password.startswith('$2b$04$'))
+                db.session.commit()
+
+                self.assertEqual(User.authenticate("test_user", "test_password"),
+                                 user)
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = log_rounds
@@ -5,26 +5,17 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Job
 from flask import session
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app, db, do_logout, g, CURR_USER_KEY
-app.config['WTF_CSRF_ENABLED'] = False
-app.config['TESTING'] = True
-
+from app import db, do_logout, g, CURR_USER_KEY
+from testing import app
+from jobs import work_off
+from user_cache import _user_cache, get_user, invalidate_user
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -41,6 +32,7 @@ class UserViewTestCase(TestCase):
         User.query.delete()
         Message.query.delete()
         Follows.query.delete()
+        Job.query.delete()
 
         self.client = app.test_client()
 
@@ -63,6 +55,11 @@ class UserViewTestCase(TestCase):
         self.id = user1.id
         self.id2 = user2.id
 
+        # the bulk deletes above don't reach the session user cache, and
+        # some databases reuse ids
+        invalidate_user(self.id)
+        invalidate_user(self.id2)
+
 
     def tearDown(self):
         """Clean up fouled transactions."""
@@ -143,6 +140,90 @@ class UserViewTestCase(TestCase):
             self.assertIn("What is up", html)
 
 
+    def test_cached_session_user(self):
+        """Pages that only show the nav bar don't query for the user"""
+
+        with self.client as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.id
+
+            client.get('/messages/new')
+
+            statements = []
+            count = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                response = client.get('/messages/new')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            self.assertIn('alt="test_user"', response.get_data(as_text=True))
+            self.assertEqual(statements, [])
+
+    def test_profile_edit_refreshes_cached_user(self):
+        """Editing the profile isn't hidden by the cached session user"""
+
+        with self.client as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.id
+
+            client.get('/messages/new')
+            client.post('/users/profile', data={"username": "test_user",
+                                                "email": "test1@test.com",
+                                                "password": "test_password",
+                                                "image_url": "new.png"})
+
+            html = client.get('/messages/new').get_data(as_text=True)
+            self.assertIn('src="new.png"', html)
+
+    def test_invalidated_while_loading(self):
+        """A snapshot read before an invalidation isn't cached"""
+
+        with app.app_context():
+            # the profile changes while the old row is being read
+            invalidate = lambda *args: invalidate_user(self.id)
+            event.listen(db.engine, 'after_cursor_execute', invalidate)
+            try:
+                get_user(self.id)
+            finally:
+                event.remove(db.engine, 'after_cursor_execute', invalidate)
+
+            statements = []
+            count = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                get_user(self.id)
+                get_user(self.id)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            # loaded again once, then cached
+            self.assertEqual(len(statements), 1)
+
+    def test_user_cache_bounded(self):
+        """Invalidating many users doesn't grow the cache past its size"""
+
+        with app.app_context():
+            cache = _user_cache()
+            for user_id in range(cache.maxsize + 100):
+                invalidate_user(user_id)
+
+            self.assertLessEqual(len(cache), cache.maxsize)
+
+    def test_login_rejected_when_busy(self):
+        """Logins fail fast with a 503 when the bcrypt queue is full"""
+
+        max_pending = app.config['BCRYPT_MAX_PENDING']
+        app.config['BCRYPT_MAX_PENDING'] = 0
+        try:
+            response = self.client.post('/login', data={
+                "username": "test_user", "password": "test_password"})
+
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+        finally:
+            app.config['BCRYPT_MAX_PENDING'] = max_pending
+
     def test_delete_user(self):
         """Tests to see if user is deleted correctly"""
 
@@ -153,6 +234,14 @@ class UserViewTestCase(TestCase):
             url = '/users/delete'
             response = client.post(url, follow_redirects = True)
             self.assertEqual(response.status_code, 200)
+            self.assertNotIn(CURR_USER_KEY, session)
+
+            # hidden right away, removed by the purge worker
+            self.assertIsNotNone(User.query.get(self.id).deleted_at)
+            self.assertEqual(client.get(f'/users/{self.id}').status_code, 404)
+
+            with app.app_context():
+                work_off()
 
             user = User.query.get(self.id)
 
@@ -0,0 +1,9 @@
+"""The app the tests share, built once per process from TestingConfig.
+
+Test modules import `app` from here rather than each building their own,
+since Flask-SQLAlchemy binds the session to one app's engine at a time.
+"""
+
+from app import create_app
+
+app = create_app('testing')
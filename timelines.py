@@ -0,0 +1,254 @@
+"""Materialized home timelines for Warbler.
+
+Every user's home timeline is kept as rows in the `timelines` table, so
+rendering "/" is one indexed range read instead of a follows lookup plus an
+`IN (...)` query over every followed account.
+
+A timeline is "warm" once it has been built; only warm timelines receive
+fan-out writes. Cold timelines (new users, or anyone who hasn't loaded "/"
+since this store existed) are built from the messages table on first read.
+
+Fan-out of new messages and backfills after a follow run as background jobs,
+so they may land after a timeline was warmed with the same messages; they
+skip entries that already exist. They also trim the timelines they add to
+back to `TIMELINE_LENGTH`, so reading a timeline never writes (unless it's
+cold).
+"""
+
+from flask import current_app
+from sqlalchemy import (delete, exists, func, insert, literal, select, tuple_,
+                        union)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from jobs import job
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import paginate
+
+DEFAULT_TIMELINE_LENGTH = 800
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+
+def timeline_length():
+    """Max number of entries kept in each user's timeline."""
+
+    return current_app.config.get('TIMELINE_LENGTH', DEFAULT_TIMELINE_LENGTH)
+
+
+def timeline_author_ids(user_id):
+    """SELECT of the ids whose messages belong on `user_id`'s timeline.
+
+    Deleted users' messages don't, though they're followed until purged.
+    """
+
+    followed_ids = (select(Follows.user_being_followed_id)
+                    .join(User, User.id == Follows.user_being_followed_id)
+                    .where(Follows.user_following_id == user_id,
+                           User.deleted_at.is_(None)))
+
+    return union(followed_ids, select(literal(user_id)))
+
+
+def _recent_messages(author_ids, user_id):
+    """SELECT of the newest messages by `author_ids`, as timeline rows."""
+
+    return (select(literal(user_id), Message.id, Message.user_id,
+                   Message.timestamp)
+            .where(Message.user_id.in_(author_ids))
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(timeline_length()))
+
+
+def _not_in_timeline(user_id, message_id):
+    """Condition: `message_id` isn't in `user_id`'s timeline yet."""
+
+    return ~exists().where(TimelineEntry.user_id == user_id,
+                           TimelineEntry.message_id == message_id)
+
+
+def push_message(msg):
+    """Add `msg` to the warm timelines of its author and their followers,
+    trimming them to length.
+
+    Runs in the caller's transaction; `msg` must already be flushed.
+    """
+
+    followers = (select(Follows.user_following_id)
+                 .join(User, User.id == Follows.user_following_id)
+                 .where(Follows.user_being_followed_id == msg.user_id,
+                        User.timeline_warm.is_(True)))
+    author = select(User.id).where(User.id == msg.user_id,
+                                   User.timeline_warm.is_(True))
+    recipients = union(followers, author).subquery()
+
+    rows = (select(recipients.c[0], literal(msg.id), literal(msg.user_id),
+                   literal(msg.timestamp))
+            .where(_not_in_timeline(recipients.c[0], msg.id)))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(TIMELINE_COLUMNS, rows))
+    db.session.execute(timeline_trim(select(recipients.c[0])))
+
+
+@job
+def fan_out_message(message_id):
+    """Push a new message to timelines, unless it's been deleted since."""
+
+    msg = db.session.get(Message, message_id)
+
+    if msg is not None:
+        push_message(msg)
+
+
+def remove_message(message_id):
+    """Remove a message from every timeline it was pushed to."""
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.message_id == message_id))
+
+
+@job
+def backfill_follow(follower_id, followed_id):
+    """Copy `followed_id`'s recent messages into `follower_id`'s timeline.
+
+    Nothing to do if the timeline is cold, or they've unfollowed since.
+    """
+
+    follower = db.session.get(User, follower_id)
+    follow = db.session.get(Follows, (followed_id, follower_id))
+
+    if follower is None or follow is None or not follower.timeline_warm:
+        return
+
+    messages = (_recent_messages([followed_id], follower_id)
+                .where(_not_in_timeline(follower_id, Message.id)))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(TIMELINE_COLUMNS, messages))
+    trim_timeline(follower_id)
+
+
+def prune_follow(follower_id, followed_id):
+    """Drop `followed_id`'s messages from `follower_id`'s timeline."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id,
+               TimelineEntry.author_id == followed_id))
+
+
+def timeline_trim(user_ids):
+    """DELETE of the entries past the configured length of the timelines of
+    `user_ids` (an id or a SELECT of ids).
+
+    Each timeline is read newest first along its index, so this costs about
+    TIMELINE_LENGTH entries per timeline.
+    """
+
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+
+    ranked = (select(TimelineEntry.user_id, TimelineEntry.message_id,
+                     func.row_number().over(
+                         partition_by=TimelineEntry.user_id,
+                         order_by=(TimelineEntry.timestamp.desc(),
+                                   TimelineEntry.message_id.desc()))
+                     .label('position'))
+              .where(TimelineEntry.user_id.in_(user_ids))
+              .subquery())
+
+    overflow = (select(ranked.c.user_id, ranked.c.message_id)
+                .where(ranked.c.position > timeline_length()))
+
+    return (delete(TimelineEntry)
+            .where(tuple_(TimelineEntry.user_id,
+                          TimelineEntry.message_id).in_(overflow))
+            .execution_options(synchronize_session=False))
+
+
+def trim_timeline(user_id):
+    """Delete entries past the configured length from one user's timeline."""
+
+    db.session.execute(timeline_trim(user_id))
+
+
+def timeline_fill(user_id):
+    """INSERT of the messages that belong on a new (cold) timeline."""
+
+    return insert(TimelineEntry).from_select(
+        TIMELINE_COLUMNS,
+        _recent_messages(timeline_author_ids(user_id), user_id))
+
+
+def warm_timeline(user):
+    """Build `user`'s timeline from the messages table and mark it warm.
+
+    Returns False if another request warmed it first.
+    """
+
+    try:
+        db.session.execute(timeline_fill(user.id))
+        user.timeline_warm = True
+        db.session.commit()
+
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+    return True
+
+
+def timeline_is_full(user_id):
+    """SELECT of whether `user_id`'s timeline has reached its length cap."""
+
+    entries = (select(TimelineEntry.message_id)
+               .where(TimelineEntry.user_id == user_id)
+               .limit(timeline_length())
+               .subquery())
+
+    return select(func.count() >= timeline_length()).select_from(entries)
+
+
+def home_timeline(user, before=None, size=None, columns=None):
+    """Return a Page of `user`'s home timeline after cursor `before`.
+
+    Pages that reach the end of a full (trimmed) timeline are read from the
+    messages table instead; both use the same (timestamp, id) cursors.
+    Nothing is written unless the timeline is cold.
+
+    Items are Messages with their authors loaded, or rows of just `columns`
+    (which must include Message.timestamp and Message.id) if given.
+    """
+
+    if not user.timeline_warm:
+        warm_timeline(user)
+
+    def select_items(query):
+        if columns:
+            return query.with_entities(*columns)
+
+        return query.options(joinedload(Message.user))
+
+    entries = select_items(Message
+                           .query
+                           .join(TimelineEntry,
+                                 TimelineEntry.message_id == Message.id)
+                           .join(User, User.id == TimelineEntry.author_id)
+                           .filter(TimelineEntry.user_id == user.id,
+                                   User.deleted_at.is_(None)))
+
+    page = paginate(entries,
+                    (TimelineEntry.timestamp, TimelineEntry.message_id),
+                    before, size, attrs=('timestamp', 'id'))
+
+    if (page.next_cursor is None
+            and db.session.execute(timeline_is_full(user.id)).scalar()):
+        fallback = select_items(Message
+                                .query
+                                .filter(Message.user_id.in_(
+                                    timeline_author_ids(user.id))))
+        page = paginate(fallback, (Message.timestamp, Message.id),
+                        before, size)
+
+    return page
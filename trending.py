@@ -0,0 +1,186 @@
+"""Trending messages, ranked by a time-decayed count of their likes.
+
+A like counts for 1 when it's made and half as much every
+`TRENDING_HALF_LIFE` seconds after that. Rather than rewrite every score as
+time passes, each like adds a weight that grows with time instead:
+
+    2 ** ((liked_at - epoch) / half_life)
+
+so newer likes count for more than older ones in exactly the proportion the
+decay asks for, and a message's stored score (the sum of its like weights)
+ranks the same as its decayed score would. Reading the top N is then an
+index scan on `trending_scores.score`. An unlike takes back the weight its
+like added, using the like's `liked_at`.
+
+Weights grow without bound, so `compact_trending` runs every
+`TRENDING_COMPACT_EVERY` seconds: it moves the epoch up to now, scaling every
+score down by the same factor, and drops the scores that have decayed below
+`TRENDING_MIN_SCORE`. A like made while a compaction runs may be weighted
+against the epoch before it, overcounting it slightly until it decays.
+
+On PostgreSQL a single like or unlike updates the score in the same
+statement as the like (see `likes`); elsewhere `add_likes` and
+`remove_likes` do it.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, case, event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+
+from jobs import enqueue, job
+from models import db, Message, TrendingEpoch, TrendingScore, User
+from pagination import Page
+
+DEFAULT_HALF_LIFE = 6 * 60 * 60
+DEFAULT_COMPACT_EVERY = 60 * 60
+DEFAULT_MIN_SCORE = 0.1
+DEFAULT_SIZE = 50
+
+EPOCH_ID = 1
+
+
+def create_epoch(connection):
+    """Start the scores' epoch at now, unless it has been started already."""
+
+    table = TrendingEpoch.__table__
+    started = connection.execute(
+        select(table.c.id).where(table.c.id == EPOCH_ID)).first()
+
+    if started is None:
+        connection.execute(table.insert().values(id=EPOCH_ID,
+                                                 epoch=datetime.utcnow()))
+
+
+@event.listens_for(TrendingEpoch.__table__, 'after_create')
+def create_epoch_with_table(target, connection, **kw):
+    create_epoch(connection)
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def half_life():
+    """Seconds it takes a like's weight in the ranking to halve."""
+
+    return _config('TRENDING_HALF_LIFE', DEFAULT_HALF_LIFE)
+
+
+def _epoch():
+    return db.session.get(TrendingEpoch, EPOCH_ID).epoch
+
+
+def weight(liked_at, epoch):
+    """What a like made at `liked_at` adds to a score relative to `epoch`."""
+
+    return 2 ** ((liked_at - epoch).total_seconds() / half_life())
+
+
+def add_likes(message_ids, liked_at):
+    """Add likes of `message_ids` made at `liked_at` to their scores.
+
+    Runs in the caller's transaction.
+    """
+
+    if not message_ids:
+        return
+
+    added = weight(liked_at, _epoch())
+    scores = defaultdict(float)
+    for message_id in message_ids:
+        scores[message_id] += added
+
+    insert = (postgresql.insert if db.engine.dialect.name == 'postgresql'
+              else sqlite.insert)
+    statement = insert(TrendingScore).values(
+        [{'message_id': message_id, 'score': score}
+         for message_id, score in scores.items()])
+
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[TrendingScore.message_id],
+        set_={'score': TrendingScore.score + statement.excluded.score}))
+
+
+def remove_likes(likes):
+    """Take (message id, liked_at) likes back out of their messages' scores.
+
+    Runs in the caller's transaction.
+    """
+
+    if not likes:
+        return
+
+    epoch = _epoch()
+    scores = defaultdict(float)
+    for message_id, liked_at in likes:
+        scores[message_id] += weight(liked_at, epoch)
+
+    table = TrendingScore.__table__
+    removed = bindparam('removed')
+
+    db.session.execute(
+        update(table)
+        .where(table.c.message_id == bindparam('liked_message_id'))
+        # never below zero, whatever floating point makes of the sums
+        .values(score=case((table.c.score > removed,
+                            table.c.score - removed),
+                           else_=0.0)),
+        [{'liked_message_id': message_id, 'removed': score}
+         for message_id, score in scores.items()])
+
+
+def trending_messages(size=None, columns=None):
+    """Return a Page of the highest scoring messages by active users.
+
+    Items are Messages with their authors loaded, or rows of just `columns`
+    (plus the stored score) if given. There's no next page.
+    """
+
+    query = (Message.query
+             .join(TrendingScore, TrendingScore.message_id == Message.id)
+             .join(User, User.id == Message.user_id)
+             .filter(User.deleted_at.is_(None))
+             .order_by(TrendingScore.score.desc(),
+                       TrendingScore.message_id.desc())
+             .limit(size or _config('TRENDING_SIZE', DEFAULT_SIZE)))
+
+    if columns:
+        query = query.with_entities(*columns, TrendingScore.score)
+    else:
+        query = query.options(joinedload(Message.user))
+
+    return Page(query.all())
+
+
+def decayed_scores(scores):
+    """Stored `scores` as likes' worth at the current time."""
+
+    scale = weight(_epoch(), datetime.utcnow())
+    return [score * scale for score in scores]
+
+
+@job
+def compact_trending():
+    """Move the epoch up to now and drop cold scores; then queue the next."""
+
+    now = datetime.utcnow()
+    state = db.session.get(TrendingEpoch, EPOCH_ID, with_for_update=True)
+
+    db.session.execute(
+        update(TrendingScore)
+        .values(score=TrendingScore.score * weight(state.epoch, now))
+        .execution_options(synchronize_session=False))
+
+    TrendingScore.query.filter(
+        TrendingScore.score < _config('TRENDING_MIN_SCORE',
+                                      DEFAULT_MIN_SCORE)
+    ).delete(synchronize_session=False)
+
+    state.epoch = now
+
+    enqueue(compact_trending, run_at=now + timedelta(
+        seconds=_config('TRENDING_COMPACT_EVERY', DEFAULT_COMPACT_EVERY)))
@@ -0,0 +1,158 @@
+"""Cached snapshots of the logged-in user.
+
+`add_user_to_g` used to load the full user row on every request. Instead,
+g.user is a `LazyUser` built from a small cached snapshot (id, username,
+image_url), which is all the nav bar needs. Anything else on g.user loads
+the full ORM object on first use, once per request.
+
+Snapshots live in a process-local LRU with a TTL. `invalidate_user` replaces
+a snapshot with a fresh `Invalidated` marker when the user changes, and a
+snapshot is only cached if the entry it was read under is still there, so a
+request that read the old row can't cache it again. The markers live in the
+same LRU, so nothing grows past `USER_CACHE_SIZE` entries.
+"""
+
+from threading import Lock
+
+from flask import abort, current_app
+
+from cache import LRUCache
+from models import db, User
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60
+
+_cache = None
+_cache_lock = Lock()
+
+
+class UserSnapshot:
+    """The cached fields of one user."""
+
+    __slots__ = ('id', 'username', 'image_url')
+
+    def __init__(self, id, username, image_url):
+        self.id = id
+        self.username = username
+        self.image_url = image_url
+
+
+class Invalidated:
+    """Cached in place of a user's snapshot when they change."""
+
+    __slots__ = ()
+
+
+class LazyUser:
+    """Stand-in for the logged-in User, loading the full row only if needed.
+
+    Use `load()` where the real ORM object is required, e.g. to delete it.
+    """
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def id(self):
+        return self._snapshot.id
+
+    @property
+    def username(self):
+        return self._snapshot.username
+
+    @property
+    def image_url(self):
+        return self._snapshot.image_url
+
+    def load(self):
+        """Return the full User, loading it on first use."""
+
+        if self._user is None:
+            self.set_loaded(User.query.get(self._snapshot.id))
+
+        return self._user
+
+    def set_loaded(self, user):
+        """Use `user`, the full row loaded some other way, from now on.
+
+        Aborts with 401 if the account is gone, as `load()` does.
+        """
+
+        if user is None or user.deleted_at is not None:
+            invalidate_user(self._snapshot.id)
+            abort(401)
+
+        object.__setattr__(self, '_user', user)
+
+    # these only need the user's id, so they don't load the full row
+    _following_ids = None
+    following_ids = User.following_ids
+    is_following = User.is_following
+    liked_message_ids = User.liked_message_ids
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        if name == '_following_ids':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.load(), name, value)
+
+    def __repr__(self):
+        return f"<LazyUser #{self.id}: {self.username}>"
+
+
+def _user_cache():
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            config = current_app.config
+            _cache = LRUCache(config.get('USER_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                              config.get('USER_CACHE_TTL', DEFAULT_CACHE_TTL))
+
+    return _cache
+
+
+def get_user(user_id):
+    """Return a LazyUser for `user_id`, or None if there's no such user.
+
+    Deleted accounts count as no user, which logs them out everywhere.
+    """
+
+    cache = _user_cache()
+    entry = cache.get(user_id)
+
+    if isinstance(entry, UserSnapshot):
+        return LazyUser(entry)
+
+    row = (db.session
+           .query(User.id, User.username, User.image_url)
+           .filter(User.id == user_id, User.deleted_at.is_(None))
+           .first())
+
+    if row is None:
+        return None
+
+    snapshot = UserSnapshot(row.id, row.username, row.image_url)
+
+    # unless the user was invalidated since we looked
+    cache.replace(user_id, entry, snapshot)
+
+    return LazyUser(snapshot)
+
+
+def invalidate_user(user_id):
+    """Forget the cached snapshot of `user_id` after it changes."""
+
+    if _cache is not None:
+        # a new marker each time, so `replace` sees every invalidation
+        _cache.set(user_id, Invalidated())
+
+
+def cache_stats():
+    """Size and hit/miss counts of the user cache."""
+
+    return _user_cache().stats()